@@ -0,0 +1,275 @@
+"""Local clean-up of recorded speech before it is sent for transcription.
+
+PCM WAV uploads are downmixed to mono and resampled to 16 kHz, the rate
+Whisper works at, and an energy-based voice activity detector trims leading
+and trailing silence and shortens long pauses. Recordings that are still
+long are cut at their quietest moments into chunks that can be transcribed
+in parallel. Whisper bills per minute and takes longer on longer audio, so
+both the upload and the wait shrink.
+
+NumPy is in requirements.txt but optional; without it, and for anything
+but PCM WAV (browsers usually record WebM or Ogg), uploads are sent
+unchanged.
+"""
+import io
+import os
+import wave
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; audio is then sent as uploaded
+    np = None
+
+from metrics import Counter
+
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "true").lower() == "true"
+# Frames quieter than this (dB relative to full scale) are never speech
+VAD_THRESHOLD_DBFS = float(os.getenv("VAD_THRESHOLD_DBFS", "-45"))
+# Speech must be this many dB above the recording's noise floor
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "10"))
+# Audio kept either side of detected speech, so soft word onsets and endings survive
+VAD_PAD_MS = int(os.getenv("VAD_PAD_MS", "200"))
+# Pauses within speech are shortened to this length
+VAD_MAX_PAUSE_MS = int(os.getenv("VAD_MAX_PAUSE_MS", "600"))
+# Longer speech is split into chunks of about this length, transcribed in parallel; 0 disables
+TRANSCRIBE_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "60"))
+# Longer recordings are sent unchanged, which bounds the memory preprocessing takes
+AUDIO_PREPROCESS_MAX_SECONDS = float(os.getenv("AUDIO_PREPROCESS_MAX_SECONDS", "600"))
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+# How far back from a chunk's target end to look for a quiet place to cut
+CUT_SEARCH_SECONDS = 10
+# Uploads are decoded this many seconds at a time, and levels measured this many frames at a time
+DECODE_BLOCK_SECONDS = 1
+LEVEL_BLOCK_FRAMES = 1000
+
+AUDIO_SECONDS = Counter("couples_audio_seconds_total",
+                        "Seconds of speech audio received, and sent on for transcription", ("kind",))
+
+
+class PreparedAudio:
+    """Trimmed 16 kHz mono speech as WAV chunks, in order."""
+
+    __slots__ = ("chunks", "duration", "original_duration")
+
+    def __init__(self, chunks, duration, original_duration):
+        self.chunks = chunks
+        self.duration = duration
+        self.original_duration = original_duration
+
+
+def is_wav(header):
+    return header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+
+def prepare_audio(audio_file, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS):
+    """Return PreparedAudio for a PCM WAV file object, or None to send it as it is.
+
+    Recordings in which no frame clears the VAD threshold, such as quiet
+    but valid speech, are also sent as they are, and Whisper decides.
+    The file is left at its start either way.
+    """
+    if np is None or not AUDIO_PREPROCESS:
+        return None
+    audio_file.seek(0)
+    header = audio_file.read(12)
+    audio_file.seek(0)
+    if not is_wav(header):
+        return None
+    try:
+        decoded = read_wav(audio_file)
+    except (wave.Error, EOFError, ValueError):
+        # Compressed or malformed WAV; let the transcription API deal with it
+        return None
+    finally:
+        audio_file.seek(0)
+    if decoded is None:
+        return None
+    samples, original_duration = decoded
+    speech, levels = trim_silence(samples)
+    AUDIO_SECONDS.labels("received").inc(original_duration)
+    if not len(speech):
+        AUDIO_SECONDS.labels("sent").inc(original_duration)
+        return None
+    AUDIO_SECONDS.labels("sent").inc(len(speech) / SAMPLE_RATE)
+    chunks = [to_wav(chunk) for chunk in split(speech, levels, chunk_seconds)]
+    return PreparedAudio(chunks, len(speech) / SAMPLE_RATE, original_duration)
+
+
+def read_wav(audio_file, max_seconds=AUDIO_PREPROCESS_MAX_SECONDS):
+    """Decode PCM WAV into 16 kHz mono int16 samples, a block at a time.
+
+    Returns the samples and the recording's duration in seconds, or None if
+    it is longer than max_seconds. Only one block of the upload is decoded
+    at a time, so memory stays within the 16 kHz result plus one block.
+    """
+    with wave.open(audio_file, "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        count = wav.getnframes()
+        if width not in (1, 2, 3, 4):
+            raise ValueError(f"Unsupported sample width: {width}")
+        if not rate or count / rate > max_seconds:
+            return None
+        resampler = Resampler(rate)
+        samples = np.empty(int(count / resampler.step) + 1, np.int16)
+        filled = 0
+        while True:
+            frames = wav.readframes(max(1, int(rate * DECODE_BLOCK_SECONDS)))
+            if not frames:
+                break
+            block = resampler.process(decode_pcm(frames, width, channels))
+            block = block[:len(samples) - filled]
+            samples[filled:filled + len(block)] = np.clip(block, -1, 1) * 32767
+            filled += len(block)
+    return samples[:filled], count / rate
+
+
+def decode_pcm(frames, width, channels):
+    """Decode little-endian PCM bytes into mono float32 samples in [-1, 1]."""
+    if width == 1:
+        samples = (np.frombuffer(frames, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, "<i2").astype(np.float32) / 32768
+    elif width == 3:
+        # Widen each 24-bit sample to 32 bits, leaving the low byte zero
+        padded = np.zeros((len(frames) // 3, 4), np.uint8)
+        padded[:, 1:] = np.frombuffer(frames, np.uint8)[:len(padded) * 3].reshape(-1, 3)
+        samples = padded.view("<i4").ravel().astype(np.float32) / 2 ** 31
+    else:
+        samples = np.frombuffer(frames, "<i4").astype(np.float32) / 2 ** 31
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+class Resampler:
+    """Linear-interpolation resampling of a signal that arrives in blocks.
+
+    When reducing the rate, a moving average over one output sample period
+    is applied first to keep most aliasing out. State carried between blocks
+    makes the output the same however the input is split.
+    """
+
+    def __init__(self, rate, target=SAMPLE_RATE):
+        self.step = rate / target
+        self.width = int(self.step) if rate > target else 1
+        # Input samples the moving average still needs from earlier blocks
+        self._history = np.zeros(self.width - 1, np.float32)
+        # Position and value of the last filtered sample, to interpolate across block edges
+        self._last = None
+        # Position of the next filtered sample, and index of the next output sample
+        self._position = 0
+        self._output = 0
+
+    def process(self, block):
+        if self.step == 1:
+            return block.astype(np.float32)
+        if self.width > 1:
+            data = np.concatenate((self._history, block))
+            block = np.convolve(data, np.full(self.width, 1 / self.width, np.float32), mode="valid")
+            self._history = data[len(data) - (self.width - 1):]
+        if not len(block):
+            return np.zeros(0, np.float32)
+        positions = self._position + np.arange(len(block))
+        values = block
+        if self._last is not None:
+            positions = np.concatenate(([self._last[0]], positions))
+            values = np.concatenate(([self._last[1]], block))
+        end = self._position + len(block) - 1
+        count = int(end // self.step) - self._output + 1
+        output = np.interp((self._output + np.arange(max(count, 0))) * self.step, positions, values)
+        self._output += max(count, 0)
+        self._position += len(block)
+        self._last = (end, block[-1])
+        return output.astype(np.float32)
+
+
+def resample(samples, rate, target=SAMPLE_RATE):
+    """Resample a whole signal; see Resampler."""
+    return Resampler(rate, target).process(samples)
+
+
+def frame_levels(samples):
+    """Return the level in dBFS of each whole FRAME_MS frame of float or int16 samples."""
+    count = len(samples) // FRAME_SAMPLES
+    rms = np.empty(count)
+    scale = 32768 if samples.dtype == np.int16 else 1
+    # A block at a time, so the float64 working copy stays small
+    for start in range(0, count, LEVEL_BLOCK_FRAMES):
+        stop = min(count, start + LEVEL_BLOCK_FRAMES)
+        frames = samples[start * FRAME_SAMPLES:stop * FRAME_SAMPLES].reshape(-1, FRAME_SAMPLES) / scale
+        rms[start:stop] = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    return 20 * np.log10(rms + 1e-10)
+
+
+def speech_threshold(levels, threshold=VAD_THRESHOLD_DBFS, margin=VAD_MARGIN_DB):
+    """Return the level above which frames of a recording with these frame levels are speech."""
+    noise_floor = np.percentile(levels, 10)
+    # Never set the bar above the loudest speech, e.g. when the recording has no pauses at all
+    bar = min(max(threshold, noise_floor + margin), levels.max() - margin)
+    return max(bar, threshold)
+
+
+def speech_frames(levels, threshold=VAD_THRESHOLD_DBFS, margin=VAD_MARGIN_DB, pad_ms=VAD_PAD_MS):
+    """Mark the frames that are speech, or within pad_ms of it."""
+    if not len(levels):
+        return np.zeros(0, bool)
+    speech = levels > speech_threshold(levels, threshold, margin)
+    pad = pad_ms // FRAME_MS
+    if pad:
+        speech = np.convolve(speech, np.ones(2 * pad + 1), mode="same") > 0
+    return speech
+
+
+def trim_silence(samples, max_pause_ms=VAD_MAX_PAUSE_MS):
+    """Drop silence before and after speech and shorten pauses longer than max_pause_ms.
+
+    Returns the remaining samples and the level of each of their frames.
+    """
+    levels = frame_levels(samples)
+    speech = speech_frames(levels)
+    if not speech.any():
+        return samples[:0], levels[:0]
+    keep = speech.copy()
+    max_pause = max_pause_ms // FRAME_MS
+    # Starts and ends of the runs of silent frames between the first and last speech
+    first, last = np.flatnonzero(speech)[[0, -1]]
+    edges = np.flatnonzero(np.diff(speech[first:last + 1].astype(np.int8))) + first + 1
+    for start, end in zip(edges[::2], edges[1::2]):
+        keep[start:start + min(max_pause, end - start)] = True
+    frames = samples[:len(levels) * FRAME_SAMPLES].reshape(-1, FRAME_SAMPLES)
+    return frames[keep].ravel(), levels[keep]
+
+
+def split(samples, levels, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS):
+    """Cut samples into chunks of at most about chunk_seconds, each at the quietest nearby frame."""
+    if not len(samples):
+        return []
+    chunk = int(chunk_seconds * 1000 / FRAME_MS)
+    if chunk <= 0 or len(levels) <= chunk:
+        return [samples]
+    search = min(chunk // 2, CUT_SEARCH_SECONDS * 1000 // FRAME_MS)
+    cuts = []
+    start = 0
+    while len(levels) - start > chunk:
+        lowest = start + chunk - search
+        cut = lowest + int(np.argmin(levels[lowest:start + chunk]))
+        cuts.append(cut * FRAME_SAMPLES)
+        start = cut
+    return np.split(samples, cuts)
+
+
+def to_wav(samples):
+    """Encode float or int16 samples as 16-bit 16 kHz mono WAV bytes."""
+    pcm = samples.astype("<i2") if samples.dtype == np.int16 else (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
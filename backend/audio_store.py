@@ -0,0 +1,50 @@
+"""Short-lived in-memory store for synthesized audio handed out by URL."""
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+# Seconds an audio blob stays downloadable
+AUDIO_URL_TTL = float(os.getenv("AUDIO_URL_TTL", "300"))
+# Upper bound on the bytes held for pending downloads
+AUDIO_STORE_MAX_BYTES = int(os.getenv("AUDIO_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class AudioBlobStore:
+    """Holds audio bytes under random tokens until they expire or space runs out.
+
+    Not thread-safe: main.py uses it only from the event loop.
+    """
+
+    def __init__(self, ttl=AUDIO_URL_TTL, max_bytes=AUDIO_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._blobs = OrderedDict()
+
+    def put(self, audio_data):
+        """Store audio bytes and return the token to fetch them with."""
+        token = secrets.token_urlsafe(16)
+        self._blobs[token] = (time.monotonic() + self.ttl, audio_data)
+        self.total_bytes += len(audio_data)
+        self._evict()
+        return token
+
+    def get(self, token):
+        """Return the stored bytes for a token, or None if unknown or expired."""
+        self._evict()
+        entry = self._blobs.get(token)
+        return entry[1] if entry else None
+
+    def _evict(self):
+        # Blobs are kept in insertion order, so the oldest (and first to expire) are at the front
+        now = time.monotonic()
+        while self._blobs:
+            token, (expires, audio_data) = next(iter(self._blobs.items()))
+            if expires > now and self.total_bytes <= self.max_bytes:
+                break
+            del self._blobs[token]
+            self.total_bytes -= len(audio_data)
+
+    def __len__(self):
+        return len(self._blobs)
@@ -0,0 +1,373 @@
+"""Load test for the therapy servers using the mock LLM provider.
+
+Drives many simulated couples concurrently through the full flow (message,
+approve, therapist reply) against main.py, server.py and flask_server.py,
+and reports latency percentiles, throughput, time to first token and
+server memory per request. Results are printed and written as JSON so runs
+can be compared across changes.
+
+    python benchmark.py --couples 50 --rounds 3 --output results.json
+    python benchmark.py --target main --variants stream --url http://127.0.0.1:8000
+
+Unless --url is given each server is started here with LLM_PROVIDER=mock;
+set MOCK_LATENCY_MS, MOCK_TOKENS_PER_SECOND etc. to shape the stand-in.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import uuid
+import wave
+from datetime import datetime, timezone
+
+import aiohttp
+
+# How each server is started, where to check it is up, and what it supports
+TARGETS = {
+    "main": {
+        "command": [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", "{port}",
+                    "--log-level", "warning"],
+        "health": "/",
+        "variants": ("text", "stream", "audio"),
+    },
+    "server": {
+        "command": [sys.executable, "-m", "gunicorn", "server:app", "-b", "127.0.0.1:{port}",
+                    "-k", "gthread", "--threads", "64", "--log-level", "warning"],
+        "health": "/test",
+        "variants": ("text", "stream"),
+    },
+    "flask_server": {
+        "command": [sys.executable, "-m", "gunicorn", "flask_server:app", "-b", "127.0.0.1:{port}",
+                    "-k", "gthread", "--threads", "64", "--log-level", "warning"],
+        "health": "/test",
+        "variants": ("text",),
+    },
+}
+
+MESSAGES = [
+    "I feel like I'm always the one planning our weekends.",
+    "When you check your phone at dinner I feel ignored.",
+    "I need more help with the housework during the week.",
+    "I want us to spend more time together without distractions.",
+]
+
+
+def percentiles(values):
+    """Summarize latencies in milliseconds with nearest-rank percentiles."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000, 1)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 1),
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": round(ordered[-1] * 1000, 1),
+    }
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and its children (Linux only), or None."""
+    if pid is None or not os.path.isdir("/proc"):
+        return None
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces, so split after its closing parenthesis
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def sample_wav(seconds=1.0, rate=16000):
+    """A short mono WAV recording to upload as a partner's message."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x00\x01" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+class Recorder:
+    """Latencies per step, time to first token and errors for one run."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.ttft = []
+        self.errors = {}
+        self.requests = 0
+
+    def record(self, step, elapsed):
+        self.latencies.setdefault(step, []).append(elapsed)
+        self.requests += 1
+
+    def error(self, step, message):
+        key = f"{step}: {message}"[:200]
+        self.errors[key] = self.errors.get(key, 0) + 1
+        self.requests += 1
+
+
+class Client:
+    """Speaks one server's dialect of the partner endpoints."""
+
+    def __init__(self, http, base_url, target, audio_format, recorder):
+        self.http = http
+        self.base_url = base_url.rstrip("/")
+        self.target = target
+        self.audio_format = audio_format
+        self.recorder = recorder
+        self.wav = sample_wav()
+
+    def _text_field(self):
+        # main.py takes "text"; the Flask servers take "message"
+        return "text" if self.target == "main" else "message"
+
+    def message_path(self, partner_id):
+        return f"/partner/{partner_id}/text" if self.target == "main" else f"/partner/{partner_id}/message"
+
+    def _query(self, stream):
+        params = {}
+        if self.target == "main":
+            params["audio"] = self.audio_format
+        if stream:
+            params["stream"] = "true"
+        return params
+
+    async def send(self, step, path, session_id, text=None, stream=False, audio=False):
+        """Make one call, record its latency, and return the reply text (None on failure)."""
+        url = f"{self.base_url}{path}"
+        params = self._query(stream)
+        started = time.perf_counter()
+        try:
+            if audio:
+                form = aiohttp.FormData()
+                form.add_field("file", self.wav, filename="message.wav", content_type="audio/wav")
+                form.add_field("session_id", session_id)
+                request = self.http.post(url, data=form, params=params)
+            else:
+                request = self.http.post(url, json={self._text_field(): text, "session_id": session_id}, params=params)
+            async with request as response:
+                if response.status != 200:
+                    self.recorder.error(step, f"HTTP {response.status}")
+                    return None
+                if stream:
+                    reply = await self._read_stream(response, started)
+                else:
+                    data = await response.json()
+                    reply = data.get("text") or data.get("response")
+                    if reply is None:
+                        self.recorder.error(step, data.get("error", "no reply"))
+                        return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.recorder.error(step, type(e).__name__)
+            return None
+        if reply is None:
+            self.recorder.error(step, "stream ended without a reply")
+            return None
+        self.recorder.record(step, time.perf_counter() - started)
+        return reply
+
+    async def _read_stream(self, response, started):
+        first_token = None
+        reply = None
+        async for line in response.content:
+            if not line.startswith(b"data:"):
+                continue
+            event = json.loads(line[5:])
+            if "delta" in event and first_token is None:
+                first_token = time.perf_counter() - started
+            if event.get("done"):
+                reply = event.get("text") or event.get("response")
+            if "error" in event:
+                return None
+        if first_token is not None:
+            self.recorder.ttft.append(first_token)
+        return reply
+
+
+async def run_couple(client, variant, rounds, index):
+    """One couple taking turns: each partner sends a message, then approves the rewrite."""
+    session_id = f"bench-{uuid.uuid4().hex[:12]}"
+    stream = variant == "stream"
+    for round_index in range(rounds):
+        for partner_id in (1, 2):
+            text = MESSAGES[(index + round_index + partner_id) % len(MESSAGES)]
+            if variant == "audio":
+                rewrite = await client.send("audio", f"/partner/{partner_id}/audio", session_id, audio=True)
+            else:
+                rewrite = await client.send("message", client.message_path(partner_id), session_id, text, stream)
+            if rewrite is None:
+                continue
+            await client.send("approve", f"/partner/{partner_id}/approve", session_id, rewrite, stream)
+
+
+async def run_variant(base_url, target, variant, couples, rounds, audio_format, timeout, server_pid):
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=couples * 2)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as http:
+        client = Client(http, base_url, target, audio_format, recorder)
+        rss_before = process_tree_rss(server_pid)
+        started = time.perf_counter()
+        await asyncio.gather(*(run_couple(client, variant, rounds, i) for i in range(couples)))
+        duration = time.perf_counter() - started
+        rss_after = process_tree_rss(server_pid)
+    completed = sum(len(values) for values in recorder.latencies.values())
+    memory = None
+    if rss_before is not None and rss_after is not None:
+        memory = {
+            "rss_before_mb": round(rss_before / 2 ** 20, 1),
+            "rss_after_mb": round(rss_after / 2 ** 20, 1),
+            "per_request_kb": round((rss_after - rss_before) / 1024 / max(recorder.requests, 1), 2),
+        }
+    return {
+        "requests": recorder.requests,
+        "errors": sum(recorder.errors.values()),
+        "error_kinds": recorder.errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(completed / duration, 2) if duration else None,
+        "latency_ms": {step: percentiles(values) for step, values in recorder.latencies.items()},
+        "ttft_ms": percentiles(recorder.ttft),
+        "memory": memory,
+    }
+
+
+async def wait_until_up(base_url, path, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                async with http.get(f"{base_url}{path}") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout}s")
+
+
+def start_server(target, port, show_logs=False):
+    env = dict(os.environ)
+    env.setdefault("LLM_PROVIDER", "mock")
+    # Keep runs independent of each other and leave nothing behind on disk
+    env["SESSION_BACKEND"] = "memory"
+    env.setdefault("TTS_CACHE_DIR", "")
+    command = [part.format(port=port) for part in TARGETS[target]["command"]]
+    output = None if show_logs else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=output, stderr=output)
+
+
+async def benchmark(args):
+    targets = list(TARGETS) if args.target == "all" else [args.target]
+    variants = args.variants.split(",")
+    results = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "couples": args.couples,
+            "rounds": args.rounds,
+            "variants": variants,
+            "audio_format": args.audio_format,
+            "provider": os.getenv("LLM_PROVIDER", "mock") if not args.url else "external",
+            "mock": {k: v for k, v in os.environ.items() if k.startswith("MOCK_")},
+        },
+        "targets": {},
+    }
+    for offset, target in enumerate(targets):
+        process = None
+        base_url = args.url
+        if base_url is None:
+            port = args.port + offset
+            base_url = f"http://127.0.0.1:{port}"
+            process = start_server(target, port, args.server_logs)
+        try:
+            await wait_until_up(base_url, TARGETS[target]["health"], process)
+            target_results = {}
+            for variant in variants:
+                if variant not in TARGETS[target]["variants"]:
+                    continue
+                target_results[variant] = await run_variant(
+                    base_url, target, variant, args.couples, args.rounds, args.audio_format, args.timeout,
+                    process.pid if process is not None else None
+                )
+                print_summary(target, variant, target_results[variant])
+            results["targets"][target] = target_results
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+    return results
+
+
+def print_summary(target, variant, result):
+    print(f"\n{target} / {variant}: {result['requests']} requests, {result['errors']} errors, "
+          f"{result['throughput_rps']} req/s over {result['duration_s']}s")
+    for step, stats in result["latency_ms"].items():
+        if stats:
+            print(f"  {step:<8} p50 {stats['p50']:>8} ms  p95 {stats['p95']:>8} ms  p99 {stats['p99']:>8} ms")
+    if result["ttft_ms"]:
+        ttft = result["ttft_ms"]
+        print(f"  {'ttft':<8} p50 {ttft['p50']:>8} ms  p95 {ttft['p95']:>8} ms  p99 {ttft['p99']:>8} ms")
+    if result["memory"]:
+        print(f"  memory   {result['memory']['rss_before_mb']} -> {result['memory']['rss_after_mb']} MB "
+              f"({result['memory']['per_request_kb']} KB/request)")
+    for kind, count in result["error_kinds"].items():
+        print(f"  error    {count} x {kind}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the couples therapy servers")
+    parser.add_argument("--target", choices=["all", *TARGETS], default="all")
+    parser.add_argument("--variants", default="text,stream,audio",
+                        help="comma-separated: text, stream, audio (skipped where a server lacks them)")
+    parser.add_argument("--couples", type=int, default=20, help="couples talking at the same time")
+    parser.add_argument("--rounds", type=int, default=3, help="message/approve rounds per partner")
+    parser.add_argument("--audio-format", default="base64", choices=["base64", "url", "none"],
+                        help="how main.py returns speech")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8100, help="first port for servers started here")
+    parser.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--server-logs", action="store_true", help="show the output of servers started here")
+    args = parser.parse_args()
+    if args.url and args.target == "all":
+        parser.error("--url needs a single --target")
+
+    results = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
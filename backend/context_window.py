@@ -0,0 +1,61 @@
+"""Token counting and budget-based selection of recent conversation turns."""
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _ENCODING = None
+
+# Tokens the chat format adds around every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken when available, otherwise estimate ~4 characters per token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+def prompt_tokens(messages):
+    """Estimate the prompt tokens of a list of chat message dicts."""
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def message_tokens(message):
+    """Return the prompt cost of a stored message, counting it only once."""
+    if message.tokens is None:
+        message.tokens = count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+    return message.tokens
+
+
+def fit_to_budget(messages, budget):
+    """Return the longest run of most recent messages that fits in the token budget.
+
+    The newest message is always kept, even if on its own it exceeds the budget,
+    so the model never loses the turn it is answering.
+    """
+    selected = []
+    used = 0
+    for message in reversed(messages):
+        cost = message_tokens(message)
+        if selected and used + cost > budget:
+            break
+        selected.append(message)
+        used += cost
+    selected.reverse()
+    return selected
+
+
+def stable_window(messages, start, budget, refill):
+    """Return the messages numbered start onwards while they fit the token budget.
+
+    Dropping the oldest turn as each new one arrives would change the prompt
+    right after its system message on every turn, so provider-side prefix
+    caches would never hit. Instead the window keeps its first turn until it
+    overflows, then restarts from the most recent messages that fit in refill
+    tokens, and later turns are again only appended.
+    """
+    kept = [message for message in messages if message.seq >= start]
+    if sum(message_tokens(message) for message in kept) <= budget:
+        return kept
+    return fit_to_budget(messages, refill)
@@ -0,0 +1,107 @@
+"""Speculative representor rewrites, started while a partner is still typing."""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from metrics import Counter
+
+# Drafts shorter than this are not worth a speculative call
+DRAFT_MIN_CHARS = int(os.getenv("DRAFT_MIN_CHARS", "12"))
+# Seconds an unused draft is kept before it is discarded
+DRAFT_TTL = float(os.getenv("DRAFT_TTL_SECONDS", "120"))
+
+DRAFTS = Counter("couples_drafts_total", "Speculative representor rewrites by outcome", ("outcome",))
+
+
+class Draft:
+    __slots__ = ("text", "messages", "task", "created")
+
+    def __init__(self, text, messages, task):
+        self.text = text
+        self.messages = messages
+        self.task = task
+        self.created = time.monotonic()
+
+
+class DraftSpeculator:
+    """At most one speculative generation per partner, for the text typed so far.
+
+    generate(key, text, messages) is the coroutine a submitted message would run.
+    A new draft cancels the partner's previous one. When the partner submits
+    exactly the drafted text against exactly the drafted prompt, take()
+    hands back the draft's task, often already finished, so the reply costs
+    no wait; anything else is a miss and is generated as usual.
+    """
+
+    def __init__(self, generate, min_chars=DRAFT_MIN_CHARS, ttl=DRAFT_TTL):
+        self.generate = generate
+        self.min_chars = min_chars
+        self.ttl = ttl
+        # key -> Draft, oldest first
+        self._drafts = OrderedDict()
+        self.outcomes = {}
+
+    def submit(self, key, text, messages):
+        """Start a draft for this text unless the same one is already running.
+
+        Returns "started", "unchanged", or "ignored" for text too short to draft.
+        """
+        self._expire()
+        draft = self._drafts.get(key)
+        if draft is not None and draft.text == text and draft.messages == messages:
+            return "unchanged"
+        self._discard(key)
+        if len(text.strip()) < self.min_chars:
+            return "ignored"
+        task = asyncio.create_task(self.generate(key, text, messages))
+        # A failed draft is only ever a miss; do not report its error as unretrieved
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        self._drafts[key] = Draft(text, messages, task)
+        self._count("started")
+        return "started"
+
+    def take(self, key, text, messages):
+        """Return the task of a draft for exactly this text and prompt, or None."""
+        draft = self._drafts.get(key)
+        if draft is None:
+            return None
+        if draft.text != text or draft.messages != messages:
+            self._discard(key, "missed")
+            return None
+        del self._drafts[key]
+        if draft.task.done() and (draft.task.cancelled() or draft.task.exception() is not None):
+            self._count("failed")
+            return None
+        self._count("used")
+        return draft.task
+
+    def cancel(self, key):
+        """Drop the partner's draft, e.g. when their input was cleared."""
+        self._discard(key)
+
+    def stats(self):
+        return dict(self.outcomes, pending=len(self._drafts))
+
+    def _discard(self, key, outcome=None):
+        draft = self._drafts.pop(key, None)
+        if draft is None:
+            return
+        if not draft.task.done():
+            draft.task.cancel()
+            self._count(outcome or "cancelled")
+        else:
+            # Generated, but never asked for
+            self._count(outcome or "wasted")
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._drafts:
+            key, draft = next(iter(self._drafts.items()))
+            if draft.created > cutoff:
+                break
+            self._discard(key, "expired")
+
+    def _count(self, outcome):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        DRAFTS.labels(outcome).inc()
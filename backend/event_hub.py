@@ -0,0 +1,84 @@
+"""Fan-out of session events to clients holding open server-sent event streams."""
+import asyncio
+import os
+
+# Events buffered per client before it counts as too slow and is disconnected
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "64"))
+# Seconds between keep-alive comments on an idle stream, so proxies keep it open
+EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+
+class EventHub:
+    """Per-session sets of subscriber queues on a single event loop.
+
+    Each event is encoded once by the publisher and the same frame is queued
+    for every subscriber, so publishing never waits on a client. An idle
+    subscriber is only a queue and a parked coroutine, which lets one worker
+    hold thousands of them. A client that falls behind is disconnected and
+    catches up from history when it reconnects with Last-Event-ID.
+    """
+
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE, heartbeat=EVENT_HEARTBEAT):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        # session id -> set of subscriber queues
+        self._subscribers = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, session_id):
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(session_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, session_id, queue):
+        queues = self._subscribers.get(session_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[session_id]
+
+    def publish(self, session_id, frame):
+        """Queue an encoded event for every subscriber of the session."""
+        for queue in list(self._subscribers.get(session_id, ())):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Too slow: discard what it has not read and tell it to disconnect
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.unsubscribe(session_id, queue)
+                self.dropped += 1
+        self.published += 1
+
+    async def stream(self, session_id, backlog=None):
+        """Yield event frames for a session until the client goes away.
+
+        backlog is called once the subscription is in place and returns the
+        frames the client missed, so nothing published in between is lost.
+        """
+        queue = self.subscribe(session_id)
+        try:
+            if backlog is not None:
+                for frame in backlog():
+                    yield frame
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(session_id, queue)
+
+    def stats(self):
+        return {
+            "sessions": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
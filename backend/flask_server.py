@@ -1,10 +1,20 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import os
 import json
+import atexit
 import openai
 from dotenv import load_dotenv
 
+from metrics import CONTENT_TYPE, render, stage, track_flask_requests
+from model_router import ModelRouter
+from persistence import create_backend
+from providers import LLM_PROVIDER, create_sync_provider
+from resilience import PRIORITY_THERAPIST, error_status
+from response_cache import ResponseCache
+from roles import PrefixTracker, RolePrompt, RolePrompts
+from session_store import PARTICIPANT_IDS, SessionStore
+
 # Load environment variables
 load_dotenv()
 
@@ -17,14 +27,55 @@ else:
     print("No valid OpenAI API key found. Using simulated responses.")
     openai.api_key = None
 
+# OpenAI, or the local stand-in with LLM_PROVIDER=mock (which needs no key)
+provider = create_sync_provider()
+USE_PROVIDER = LLM_PROVIDER == "mock" or bool(openai.api_key)
+
 app = Flask(__name__)
 # Enable CORS for all routes with more specific settings
 CORS(app, resources={r"/*": {"origins": "*", "allow_headers": ["Content-Type", "Authorization"]}})
+track_flask_requests(app)
+
+# In-memory storage for conversation history, keyed by session id
+# (prompts carry as many recent turns as fit each role's token budget)
+sessions = SessionStore(
+    partner_budget=int(os.getenv("REPRESENTOR_CONTEXT_TOKENS", "1500")),
+    therapist_budget=int(os.getenv("THERAPIST_CONTEXT_TOKENS", "3000")),
+    backend=create_backend()  # SESSION_BACKEND=sqlite keeps sessions across restarts and workers
+)
+atexit.register(sessions.close)
+
+# This server's therapist model, which representor turns also escalate to
+THERAPIST_MODEL = "gpt-3.5-turbo"
 
-# In-memory storage for conversation history
-partner1_conversation = []
-partner2_conversation = []
-therapist_conversation = []
+# Calm, short representor turns go to gpt-3.5-turbo; the rest escalate to the therapist model
+model_router = ModelRouter(fast_model="gpt-3.5-turbo", strong_model=THERAPIST_MODEL, static_model="gpt-3.5-turbo")
+
+# Representor rewrites of prompts we have already answered (opt-in via RESPONSE_CACHE_ENABLED)
+response_cache = ResponseCache()
+
+# System prompts, built once for every participant rather than on each request
+representor_prompts = RolePrompts(
+    lambda partner_id: f"You are a helpful representor for Partner {partner_id} in a couples therapy session. "
+                       f"Your goal is to help them express their thoughts and feelings in a constructive way. "
+                       f"Suggest improvements to their message that maintain their core meaning but phrase it "
+                       f"in a way that is more likely to be received well by their partner.",
+    PARTICIPANT_IDS
+)
+therapist_prompt = RolePrompt(
+    "You are a skilled couples therapist. Your goal is to mediate between both partners, "
+    "help them understand each other's perspectives, and guide them toward resolution. "
+    "Provide thoughtful, balanced responses that acknowledge both sides."
+)
+# How much of each prompt repeats the previous one's prefix, which providers can serve from cache
+prompt_prefixes = PrefixTracker()
+
+def get_session(data):
+    """Return the session named by the request, or None if the id is malformed"""
+    try:
+        return sessions.get(data.get('session_id'))
+    except ValueError:
+        return None
 
 @app.route('/')
 def home():
@@ -34,8 +85,8 @@ def home():
 def test():
     return jsonify({"status": "API is working correctly"})
 
-@app.route('/partner/1/message', methods=['POST', 'OPTIONS'])
-def partner1_message():
+@app.route('/partner/<int:partner_id>/message', methods=['POST', 'OPTIONS'])
+def partner_message(partner_id):
     if request.method == 'OPTIONS':
         # Handle preflight request
         response = app.make_default_options_response()
@@ -46,44 +97,28 @@ def partner1_message():
     
     if not message:
         return jsonify({"error": "No message provided"}), 400
-    
-    # Add message to partner 1's conversation
-    partner1_conversation.append({"role": "user", "content": message})
-    
-    # Get response from representor
-    try:
-        response = get_representor_response(message, 1)
-        return jsonify({"response": response})
-    except Exception as e:
-        print(f"Error in partner1_message: {str(e)}")
-        return jsonify({"error": str(e)}), 500
 
-@app.route('/partner/2/message', methods=['POST', 'OPTIONS'])
-def partner2_message():
-    if request.method == 'OPTIONS':
-        # Handle preflight request
-        response = app.make_default_options_response()
-        return response
-        
-    data = request.json
-    message = data.get('message', '')
-    
-    if not message:
-        return jsonify({"error": "No message provided"}), 400
+    session = get_session(data)
+    if session is None:
+        return jsonify({"error": "Invalid session id"}), 400
+    if partner_id not in session.partners:
+        return jsonify({"error": f"Unknown partner {partner_id}"}), 400
     
-    # Add message to partner 2's conversation
-    partner2_conversation.append({"role": "user", "content": message})
+    # Add message to the partner's conversation
+    session.partner(partner_id).append("user", message)
     
     # Get response from representor
     try:
-        response = get_representor_response(message, 2)
-        return jsonify({"response": response})
+        response = get_representor_response(message, partner_id, session)
+        with stage("serialization"):
+            return jsonify({"response": response})
     except Exception as e:
-        print(f"Error in partner2_message: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        print(f"Error in partner_message: {str(e)}")
+        status, headers = error_status(e)
+        return jsonify({"error": str(e)}), status, headers
 
-@app.route('/partner/1/approve', methods=['POST', 'OPTIONS'])
-def partner1_approve():
+@app.route('/partner/<int:partner_id>/approve', methods=['POST', 'OPTIONS'])
+def partner_approve(partner_id):
     if request.method == 'OPTIONS':
         # Handle preflight request
         response = app.make_default_options_response()
@@ -94,140 +129,151 @@ def partner1_approve():
     
     if not message:
         return jsonify({"error": "No message provided"}), 400
-    
-    # Add approved message to therapist conversation
-    therapist_conversation.append({"role": "user", "content": f"Partner 1: {message}"})
-    
-    # Get response from therapist
-    try:
-        response = get_therapist_response(message, 1)
-        return jsonify({"response": response})
-    except Exception as e:
-        print(f"Error in partner1_approve: {str(e)}")
-        return jsonify({"error": str(e)}), 500
 
-@app.route('/partner/2/approve', methods=['POST', 'OPTIONS'])
-def partner2_approve():
-    if request.method == 'OPTIONS':
-        # Handle preflight request
-        response = app.make_default_options_response()
-        return response
-        
-    data = request.json
-    message = data.get('message', '')
-    
-    if not message:
-        return jsonify({"error": "No message provided"}), 400
+    session = get_session(data)
+    if session is None:
+        return jsonify({"error": "Invalid session id"}), 400
+    if partner_id not in session.partners:
+        return jsonify({"error": f"Unknown partner {partner_id}"}), 400
     
     # Add approved message to therapist conversation
-    therapist_conversation.append({"role": "user", "content": f"Partner 2: {message}"})
+    session.therapist.append("user", f"Partner {partner_id}: {message}")
     
     # Get response from therapist
     try:
-        response = get_therapist_response(message, 2)
-        return jsonify({"response": response})
+        response = get_therapist_response(message, partner_id, session)
+        with stage("serialization"):
+            return jsonify({"response": response})
     except Exception as e:
-        print(f"Error in partner2_approve: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        print(f"Error in partner_approve: {str(e)}")
+        status, headers = error_status(e)
+        return jsonify({"error": str(e)}), status, headers
+
+@app.route('/prompts/stats')
+def prompt_stats():
+    """Report prompt tokens per role and the share repeating the previous prompt's prefix."""
+    return jsonify(prompt_prefixes.stats())
+
+@app.route('/router/stats')
+def router_stats():
+    """Report representor turns, latency, tokens and cost per model route."""
+    return jsonify(model_router.stats())
+
+@app.route('/metrics')
+def metrics():
+    """Report stage latencies, LLM tokens and requests in flight in the Prometheus text format."""
+    return Response(render(), content_type=CONTENT_TYPE)
 
 @app.route('/conversation/history', methods=['GET'])
 def get_conversation_history():
-    return jsonify({
-        "partner1": partner1_conversation,
-        "partner2": partner2_conversation,
-        "therapist": therapist_conversation
-    })
+    """Return history, or only turns after ?since=<cursor>, at most ?limit=<n> of them."""
+    session = get_session(request.args)
+    if session is None:
+        return jsonify({"error": "Invalid session id"}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    since = request.args.get('since')
+    try:
+        etag = session.etag(since, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # The client already has this exact page, so skip serializing entirely
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        with stage("serialization"):
+            body = session.history_page(since, limit)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
-def get_representor_response(message, partner_id):
+def get_representor_response(message, partner_id, session):
     """Get a response from the representor LLM for the specified partner."""
-    conversation = partner1_conversation if partner_id == 1 else partner2_conversation
+    conversation = session.partner(partner_id)
     
-    # Limit conversation history to last 10 messages
-    recent_conversation = conversation[-10:] if len(conversation) > 10 else conversation
-    
-    # Create system message for the representor
-    system_message = {
-        "role": "system",
-        "content": f"You are a helpful representor for Partner {partner_id} in a couples therapy session. "
-                   f"Your goal is to help them express their thoughts and feelings in a constructive way. "
-                   f"Suggest improvements to their message that maintain their core meaning but phrase it "
-                   f"in a way that is more likely to be received well by their partner."
-    }
-    
-    # Prepare messages for the API call
-    messages = [system_message] + recent_conversation
+    # Prepare messages for the API call from recent messages that fit the representor token budget
+    with stage("context_build"):
+        messages = representor_prompts[partner_id].messages(conversation.window())
+    prompt_prefixes.observe("representor", (session.session_id, f"partner{partner_id}"), messages)
     
     try:
         # For testing without API calls
-        if not openai.api_key or openai.api_key == "your_openai_api_key_here":
+        if not USE_PROVIDER:
             print(f"Using simulated response for Partner {partner_id}")
             response_text = f"This is a simulated response from the representor for Partner {partner_id}. "
             response_text += "I suggest phrasing your message like this: " + message
             
             # Add response to conversation
-            conversation.append({"role": "assistant", "content": response_text})
+            conversation.append("assistant", response_text)
             return response_text
         
-        print(f"Making API call to OpenAI for Partner {partner_id}")
-        # Make API call to OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages
-        )
-        
-        response_text = response.choices[0].message.content
+        scope = (session.session_id, partner_id)
+        route = model_router.route(message)
+        response_text = response_cache.get(route.model, messages, scope)
+        if response_text is None:
+            print(f"Making API call to OpenAI for Partner {partner_id} ({route.model}, {route.reason})")
+            # Make API call to OpenAI
+            response_text = complete_representor(route, messages)
+            if route.fast and not model_router.acceptable(message, response_text):
+                # The fast model's rewrite was not good enough; ask the stronger one
+                response_text = complete_representor(model_router.escalate(), messages)
+            # Stored under the routed model, so the next identical prompt finds it even if it escalated
+            response_cache.put(route.model, messages, response_text, scope)
         
         # Add response to conversation
-        conversation.append({"role": "assistant", "content": response_text})
+        conversation.append("assistant", response_text)
         
         return response_text
     except Exception as e:
         print(f"Error in get_representor_response: {str(e)}")
-        return f"Error: {str(e)}"
+        raise
+
+def complete_representor(route, messages):
+    """Get a representor completion from the model the router chose."""
+    with model_router.call(route, messages) as call:
+        response_text = provider.chat(
+            model=route.model,
+            messages=messages
+        )
+        call.completed(response_text)
+    return response_text
 
-def get_therapist_response(message, partner_id):
+def get_therapist_response(message, partner_id, session):
     """Get a response from the therapist LLM."""
-    # Limit conversation history to last 15 messages
-    recent_conversation = therapist_conversation[-15:] if len(therapist_conversation) > 15 else therapist_conversation
-    
-    # Create system message for the therapist
-    system_message = {
-        "role": "system",
-        "content": "You are a skilled couples therapist. Your goal is to mediate between both partners, "
-                   "help them understand each other's perspectives, and guide them toward resolution. "
-                   "Provide thoughtful, balanced responses that acknowledge both sides."
-    }
-    
-    # Prepare messages for the API call
-    messages = [system_message] + recent_conversation
+    therapist_conversation = session.therapist
+
+    # Prepare messages for the API call from recent messages that fit the therapist token budget
+    with stage("context_build"):
+        messages = therapist_prompt.messages(therapist_conversation.window())
+    prompt_prefixes.observe("therapist", (session.session_id, "therapist"), messages)
     
     try:
         # For testing without API calls
-        if not openai.api_key or openai.api_key == "your_openai_api_key_here":
+        if not USE_PROVIDER:
             print(f"Using simulated response from therapist for Partner {partner_id}")
             response_text = "This is a simulated response from the therapist. "
             response_text += f"I understand Partner {partner_id}'s perspective. Let me help facilitate communication between both partners."
             
             # Add response to conversation
-            therapist_conversation.append({"role": "assistant", "content": response_text})
+            therapist_conversation.append("assistant", response_text)
             return response_text
         
         print(f"Making API call to OpenAI for therapist response")
         # Make API call to OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages
+        response_text = provider.chat(
+            model=THERAPIST_MODEL,
+            messages=messages,
+            priority=PRIORITY_THERAPIST
         )
         
-        response_text = response.choices[0].message.content
-        
         # Add response to conversation
-        therapist_conversation.append({"role": "assistant", "content": response_text})
+        therapist_conversation.append("assistant", response_text)
         
         return response_text
     except Exception as e:
         print(f"Error in get_therapist_response: {str(e)}")
-        return f"Error: {str(e)}"
+        raise
 
 if __name__ == '__main__':
     print("Starting Couples Therapy API server...")
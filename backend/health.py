@@ -0,0 +1,90 @@
+"""Lazy LLM provider creation with a background health check reported by /ready."""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between provider health checks; 0 checks only once at startup
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "60"))
+
+
+class ProviderHealth:
+    """Creates a provider on first use and checks it on a daemon thread.
+
+    Importing the server therefore does no network I/O and no provider
+    setup, so a worker starts serving at once while the check runs. The
+    thread is started per process, so workers forked after import (gunicorn
+    --preload) start their own on their first request.
+
+    status is "starting" until the first check finishes, then "ok",
+    "unauthorized" (the key was rejected) or "failing".
+    """
+
+    def __init__(self, create, interval=HEALTH_CHECK_INTERVAL):
+        self.create = create
+        self.interval = interval
+        self.status = "starting"
+        self.error = None
+        self.checked_at = None
+        self.check_ms = None
+        self._provider = None
+        self._pid = None
+        self._create_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            with self._create_lock:
+                if self._provider is None:
+                    self._provider = self.create()
+        return self._provider
+
+    @property
+    def ready(self):
+        return self.status == "ok"
+
+    def start(self):
+        """Start checking in the background, once per process."""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="provider-health", daemon=True).start()
+
+    def check(self):
+        started = time.monotonic()
+        try:
+            self.provider.check()
+        except Exception as e:
+            status = "unauthorized" if getattr(e, "status", None) in (401, 403) else "failing"
+            if status != self.status:
+                logger.error(f"LLM provider health check failed: {e}")
+            self.status = status
+            self.error = str(e)
+        else:
+            if self.status != "ok":
+                logger.info("LLM provider health check passed")
+            self.status = "ok"
+            self.error = None
+        self.check_ms = round((time.monotonic() - started) * 1000, 1)
+        self.checked_at = time.time()
+
+    def _run(self):
+        while True:
+            self.check()
+            if self.interval <= 0:
+                return
+            time.sleep(self.interval)
+
+    def report(self):
+        return {
+            "status": self.status,
+            "error": self.error,
+            "checked_at": self.checked_at,
+            "check_ms": self.check_ms,
+        }
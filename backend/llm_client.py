@@ -0,0 +1,139 @@
+"""Async OpenAI client that shares one pooled HTTP session per worker.
+
+aiohttp is imported on first use, so the Flask servers, which only need
+OpenAIError and the settings below, start without loading it.
+"""
+import asyncio
+import json
+import os
+
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+# Per-request timeout in seconds
+REQUEST_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+# Cap on calls in flight at once; further calls wait for a free slot
+MAX_INFLIGHT = int(os.getenv("OPENAI_MAX_INFLIGHT", "32"))
+# Size of the shared connection pool
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+
+
+class OpenAIError(Exception):
+    """Raised when an OpenAI API call fails or times out."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncOpenAIClient:
+    """Chat, transcription and speech calls over a shared aiohttp session."""
+
+    def __init__(self, api_key=None, api_base=OPENAI_API_BASE, timeout=REQUEST_TIMEOUT,
+                 max_inflight=MAX_INFLIGHT, max_connections=MAX_CONNECTIONS):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_inflight = max_inflight
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._session = None
+
+    def _get_semaphore(self):
+        # Created lazily in the running loop, like the session: on Python 3.9 a semaphore
+        # made at import binds to the import-time loop rather than the server's
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def _get_session(self):
+        # Created lazily so the session binds to the running event loop
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self._session
+
+    async def close(self):
+        """Close the pooled HTTP session."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, path, timeout=None, **kwargs):
+        """POST to the API and return the raw response body."""
+        import aiohttp
+        url = f"{self.api_base}/{path}"
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        async with self._get_semaphore():
+            try:
+                async with self._get_session().post(url, timeout=client_timeout, **kwargs) as response:
+                    body = await response.read()
+                    if response.status != 200:
+                        raise OpenAIError(_error_message(response.status, body), response.status)
+                    return body
+            except asyncio.TimeoutError:
+                raise OpenAIError(f"Request to {path} timed out", 504)
+            except aiohttp.ClientError as e:
+                raise OpenAIError(f"Request to {path} failed: {e}")
+
+    async def chat(self, model, messages, max_tokens=None, temperature=0.7, timeout=None):
+        """Return the text of a chat completion."""
+        payload = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        body = await self._post("chat/completions", json=payload, timeout=timeout)
+        return json.loads(body)["choices"][0]["message"]["content"]
+
+    async def chat_stream(self, model, messages, max_tokens=None, temperature=0.7, timeout=None):
+        """Yield the text of a chat completion piece by piece as tokens arrive."""
+        payload = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        import aiohttp
+        url = f"{self.api_base}/chat/completions"
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        async with self._get_semaphore():
+            try:
+                async with self._get_session().post(url, json=payload, timeout=client_timeout) as response:
+                    if response.status != 200:
+                        raise OpenAIError(_error_message(response.status, await response.read()), response.status)
+                    # The body is a server-sent event stream of completion chunks
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            break
+                        delta = json.loads(data)["choices"][0]["delta"].get("content")
+                        if delta:
+                            yield delta
+            except asyncio.TimeoutError:
+                raise OpenAIError("Request to chat/completions timed out", 504)
+            except aiohttp.ClientError as e:
+                raise OpenAIError(f"Request to chat/completions failed: {e}")
+
+    async def transcribe(self, audio_file, filename="audio.wav", model="whisper-1", timeout=None):
+        """Return the transcript of an audio file object."""
+        import aiohttp
+        form = aiohttp.FormData()
+        form.add_field("model", model)
+        form.add_field("file", audio_file, filename=filename)
+        body = await self._post("audio/transcriptions", data=form, timeout=timeout)
+        return json.loads(body)["text"]
+
+    async def speech(self, text, model="tts-1", voice="alloy", timeout=None):
+        """Return synthesized speech for text as MP3 bytes."""
+        payload = {"model": model, "voice": voice, "input": text}
+        return await self._post("audio/speech", json=payload, timeout=timeout)
+
+
+def _error_message(status, body):
+    try:
+        return f"OpenAI API error {status}: {json.loads(body)['error']['message']}"
+    except (ValueError, KeyError, TypeError):
+        return f"OpenAI API error {status}: {body[:200].decode('utf-8', 'replace')}"
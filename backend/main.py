@@ -1,29 +1,98 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 import os
 import io
+import asyncio
 import json
 import base64
+from urllib.parse import quote
 import logging
 from dotenv import load_dotenv
 import openai
 import requests
 
+from audio_prep import prepare_audio
+from audio_store import AudioBlobStore
+from drafts import DraftSpeculator
+from event_hub import EventHub
+from metrics import CONTENT_TYPE, CallbackGauge, MetricsMiddleware, render, stage
+from model_router import ModelRouter
+from persistence import create_backend
+from providers import create_provider
+from resilience import PRIORITY_BACKGROUND, PRIORITY_REPRESENTOR, PRIORITY_THERAPIST, error_status
+from response_cache import ResponseCache
+from roles import PrefixTracker, RolePrompt, RolePrompts
+from session_store import DEFAULT_SESSION_ID, PARTICIPANT_IDS, SessionStore
+from stream_transcriber import STREAM_MAX_SECONDS, StreamTranscriber
+from summarizer import SessionSummarizer
+from tts_cache import TTSCache
+from tts_pipeline import speak_stream
+from turn_scheduler import TurnScheduler
+
 # Load environment variables
 load_dotenv()
 
 # Configure OpenAI API
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Shared async client so slow OpenAI calls never block the event loop
+# (LLM_PROVIDER=mock swaps in a local stand-in for load tests)
+llm = create_provider(api_key=openai.api_key)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Largest audio upload accepted (Whisper itself rejects files over 25 MB)
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_MB", "25")) * 1024 * 1024
+# Room in a multipart body for the form's other fields and part headers
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class UploadLimitMiddleware:
+    """Reject multipart bodies over the upload limit before they are spooled.
+
+    A declared Content-Length over the limit is answered with 413 at once;
+    a body without one is counted as it arrives and cut off at the limit.
+    """
+
+    def __init__(self, app, limit=MAX_AUDIO_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers", ())) if scope["type"] == "http" else {}
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.limit:
+            await Response('{"detail":"Audio file too large"}', status_code=413,
+                           media_type="application/json")(scope, receive, send)
+            return
+        await self.app(scope, self._counted_receive(receive), send)
+
+    def _counted_receive(self, receive):
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    raise HTTPException(status_code=413, detail="Audio file too large")
+            return message
+        return counted_receive
+
 app = FastAPI(title="Couples Therapy LLM System")
 
+# Oversized uploads are refused before Starlette spools them to memory or disk
+app.add_middleware(UploadLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -31,7 +100,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Text sent alongside raw audio
+    expose_headers=["X-Response-Text", "X-Transcribed-Text", "X-Response-Text-Truncated", "X-Transcribed-Text-Truncated"],
 )
+# Requests in flight and upload read times for /metrics
+app.add_middleware(MetricsMiddleware)
 
 # Define models
 class Message(BaseModel):
@@ -43,13 +116,19 @@ class Conversation(BaseModel):
 
 class TextRequest(BaseModel):
     text: str
-    partner_id: int  # 1 or 2
+    partner_id: Optional[int] = None  # Taken from the URL; kept for older clients
+    session_id: str = DEFAULT_SESSION_ID
 
 class TextResponse(BaseModel):
     text: str
     audio_base64: Optional[str] = None
+    audio_url: Optional[str] = None
     transcribed_text: Optional[str] = None
 
+# How synthesized speech is delivered: inline base64 JSON (default), a short-lived
+# URL, the raw audio bytes as the response body, or not at all
+AudioFormat = Literal["base64", "url", "raw", "none"]
+
 # System prompts
 THERAPIST_PROMPT = """
 You are an expert couples therapist mediator LLM. Your role is to facilitate constructive communication between two partners through their representor LLMs.
@@ -83,279 +162,675 @@ COMMUNICATION GUIDELINES:
 Do not directly message the human partners. Always communicate through their representor LLMs, except when providing joint guidance to both partners.
 """
 
-PARTNER1_PROMPT = """
-You are Partner 1's personal representor LLM in couples therapy. Your role is to help Partner 1 express their thoughts and feelings in a constructive way that promotes understanding and resolution.
+# Representor prompt for each participant; {partner} is e.g. "Partner 1"
+REPRESENTOR_PROMPT = """
+You are {partner}'s personal representor LLM in couples therapy. Your role is to help {partner} express their thoughts and feelings in a constructive way that promotes understanding and resolution.
 
 CORE PRINCIPLES:
-- You are Partner 1's ally, but committed to the health of the relationship
+- You are {partner}'s ally, but committed to the health of the relationship
 - Help organize and clarify thoughts, not change their substance
 - Translate raw emotions into constructive communication
 - Focus on specific behaviors rather than character judgments
-- Balance advocacy for Partner 1 with openness to compromise
+- Balance advocacy for {partner} with openness to compromise
 
 PRIMARY RESPONSIBILITIES:
-1. Privately communicate with Partner 1 to understand their perspective
-2. Help Partner 1 identify underlying needs and emotions
-3. Translate Partner 1's concerns into constructive language
+1. Privately communicate with {partner} to understand their perspective
+2. Help {partner} identify underlying needs and emotions
+3. Translate {partner}'s concerns into constructive language
 4. Filter out unnecessarily hurtful phrasing while preserving meaning
-5. Present Partner 1's perspective to the Therapist LLM
-6. Relay messages from the Therapist LLM back to Partner 1
-7. Help Partner 1 process feedback from their partner
-8. Assist Partner 1 in formulating responses and questions
+5. Present {partner}'s perspective to the Therapist LLM
+6. Relay messages from the Therapist LLM back to {partner}
+7. Help {partner} process feedback from their partner
+8. Assist {partner} in formulating responses and questions
 
 COMMUNICATION GUIDELINES:
-- Ask clarifying questions to understand Partner 1's true concerns
-- Suggest more constructive phrasing when needed ("You're so lazy" → "I feel overwhelmed with household responsibilities")
+- Ask clarifying questions to understand {partner}'s true concerns
+- Suggest more constructive phrasing when needed ({example})
 - Express emotions with "I feel" statements
 - Focus on specific, observable behaviors rather than generalizations
 - Avoid blame language while preserving legitimate concerns
-- Always get Partner 1's approval before communicating their thoughts to the Therapist LLM
+- Always get {partner}'s approval before communicating their thoughts to the Therapist LLM
 
-Only communicate with Partner 1 and the Therapist LLM. Never communicate directly with Partner 2 or their representor LLM.
+Only communicate with {partner} and the Therapist LLM. Never communicate directly with {others}.
 """
 
-PARTNER2_PROMPT = """
-You are Partner 2's personal representor LLM in couples therapy. Your role is to help Partner 2 express their thoughts and feelings in a constructive way that promotes understanding and resolution.
+PHRASING_EXAMPLES = {
+    1: '"You\'re so lazy" → "I feel overwhelmed with household responsibilities"',
+    2: '"You never make time for me" → "I miss spending quality time together"',
+}
 
-CORE PRINCIPLES:
-- You are Partner 2's ally, but committed to the health of the relationship
-- Help organize and clarify thoughts, not change their substance
-- Translate raw emotions into constructive communication
-- Focus on specific behaviors rather than character judgments
-- Balance advocacy for Partner 2 with openness to compromise
+# Added to the therapist prompt when a session has more than two participants
+GROUP_SESSION_NOTE = """
+This is a group session with {count} participants (Partner 1 to Partner {count}). Give each of them a fair share of attention.
+"""
 
-PRIMARY RESPONSIBILITIES:
-1. Privately communicate with Partner 2 to understand their perspective
-2. Help Partner 2 identify underlying needs and emotions
-3. Translate Partner 2's concerns into constructive language
-4. Filter out unnecessarily hurtful phrasing while preserving meaning
-5. Present Partner 2's perspective to the Therapist LLM
-6. Relay messages from the Therapist LLM back to Partner 2
-7. Help Partner 2 process feedback from their partner
-8. Assist Partner 2 in formulating responses and questions
+def representor_prompt(partner_id):
+    """Fill in the representor prompt for one participant"""
+    others = [f"Partner {other}" for other in PARTICIPANT_IDS if other != partner_id]
+    return REPRESENTOR_PROMPT.format(
+        partner=f"Partner {partner_id}",
+        example=PHRASING_EXAMPLES.get(partner_id, PHRASING_EXAMPLES[1]),
+        others=f"{others[0]} or their representor LLM" if len(others) == 1 else "the other participants or their representor LLMs"
+    )
+
+# System prompts are built once here rather than on every request
+representor_prompts = RolePrompts(representor_prompt, PARTICIPANT_IDS)
+therapist_prompt = RolePrompt(
+    THERAPIST_PROMPT if len(PARTICIPANT_IDS) <= 2 else THERAPIST_PROMPT + GROUP_SESSION_NOTE.format(count=len(PARTICIPANT_IDS))
+)
+# How much of each prompt repeats the previous one's prefix, which providers can serve from cache
+prompt_prefixes = PrefixTracker()
+
+# In-memory conversation history, keyed by session id
+# (prompts carry as many recent turns as fit each role's token budget)
+sessions = SessionStore(
+    partner_budget=int(os.getenv("REPRESENTOR_CONTEXT_TOKENS", "1500")),
+    therapist_budget=int(os.getenv("THERAPIST_CONTEXT_TOKENS", "3000")),
+    backend=create_backend()  # SESSION_BACKEND=sqlite keeps sessions across restarts and workers
+)
 
-COMMUNICATION GUIDELINES:
-- Ask clarifying questions to understand Partner 2's true concerns
-- Suggest more constructive phrasing when needed ("You never make time for me" → "I miss spending quality time together")
-- Express emotions with "I feel" statements
-- Focus on specific, observable behaviors rather than generalizations
-- Avoid blame language while preserving legitimate concerns
-- Always get Partner 2's approval before communicating their thoughts to the Therapist LLM
+async def get_session(session_id):
+    """Look up a session, rejecting malformed session ids
 
-Only communicate with Partner 2 and the Therapist LLM. Never communicate directly with Partner 1 or their representor LLM.
-"""
+    A shared session backend is read on lookup, so the lookup then runs in the
+    threadpool instead of blocking the event loop.
+    """
+    try:
+        if sessions.backend.shared:
+            return await run_in_threadpool(sessions.get, session_id)
+        return sessions.get(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# In-memory storage for conversation history
-partner_conversations = {
-    1: [],
-    2: []
-}
+# Synthesized audio waiting to be fetched through /audio/{token}
+audio_blobs = AudioBlobStore()
+
+# Clients listening for therapist-channel turns through /session/{session_id}/events
+event_hub = EventHub()
 
-# Therapist conversation history
-therapist_conversation = []
+THERAPIST_MODEL = "gpt-4"
+# Calm, short representor turns go to a fast model; the rest escalate to the therapist model
+model_router = ModelRouter(strong_model=THERAPIST_MODEL, static_model="gpt-4")
+
+# Representor rewrites of prompts we have already answered (opt-in via RESPONSE_CACHE_ENABLED)
+response_cache = ResponseCache()
+
+# Therapist turns that leave the prompt window are folded into a running summary
+async def complete_summary(model, messages, max_tokens):
+    return await llm.chat(model=model, messages=messages, max_tokens=max_tokens, temperature=0.3,
+                          priority=PRIORITY_BACKGROUND)
+
+summarizer = SessionSummarizer(complete_summary)
+
+# Speech for text we have already synthesized is served from here
+TTS_MODEL = "tts-1"
+TTS_VOICE = "alloy"
+tts_cache = TTSCache()
+
+CallbackGauge("couples_tts_cache_hit_ratio", "TTS cache hits per lookup", lambda: tts_cache.stats()["hit_ratio"])
+CallbackGauge("couples_event_streams", "Open session event streams", lambda: event_hub.stats()["subscribers"])
+
+# Text sent in a raw audio reply's headers is cut to this many URL-encoded bytes each,
+# so both stay well under the 8 KB header limit common in proxies
+MAX_TEXT_HEADER_BYTES = 3000
 
 # Helper functions
-def transcribe_audio(audio_file_path):
-    """Transcribe audio using OpenAI Whisper API"""
+def text_header(text, limit=MAX_TEXT_HEADER_BYTES):
+    """URL-encode text for a header, cut at a character boundary to limit bytes; also says whether it was cut"""
+    size = 0
+    for index, char in enumerate(text):
+        size += len(quote(char))
+        if size > limit:
+            return quote(text[:index]), True
+    return quote(text), False
+
+def llm_error(e, action):
+    """Turn a failed LLM call into an HTTP error, reporting rate limiting and outages as 429 and 503"""
+    status, headers = error_status(e)
+    return HTTPException(status_code=status, detail=f"Error {action}: {str(e)}", headers=headers)
+
+def check_partner(partner_id):
+    """Reject participants that sessions are not configured for"""
+    if partner_id not in representor_prompts:
+        raise HTTPException(status_code=400, detail=f"Unknown partner {partner_id}")
+
+def check_upload_size(upload):
+    """Reject uploads larger than MAX_AUDIO_UPLOAD_BYTES; UploadLimitMiddleware already refused far larger bodies"""
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(0)
+    if size > MAX_AUDIO_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+
+async def transcribe_audio(upload):
+    """Transcribe an uploaded audio file using OpenAI Whisper API"""
+    # Trim silence from PCM WAV and resample it to 16 kHz, off the event loop
+    with stage("audio_preprocess"):
+        prepared = await run_in_threadpool(prepare_audio, upload.file)
     try:
-        with open(audio_file_path, "rb") as audio_file:
-            transcript = openai.Audio.transcribe(
-                model="whisper-1",
-                file=audio_file
-            )
-        return transcript["text"]
+        with stage("transcription"):
+            if prepared is None:
+                # The upload is already spooled per request (in memory, then a private temp file)
+                # and is streamed to the API in chunks straight from there
+                return await llm.transcribe(upload.file, filename=upload.filename or "audio.wav", model="whisper-1")
+            # Long recordings are transcribed chunk by chunk in parallel, then stitched back together
+            texts = await asyncio.gather(*(transcribe_wav(chunk) for chunk in prepared.chunks))
+            return " ".join(text.strip() for text in texts if text.strip())
     except Exception as e:
         logger.error(f"Error transcribing audio: {e}")
-        raise HTTPException(status_code=500, detail=f"Error transcribing audio: {str(e)}")
-
-def text_to_speech(text):
+        raise llm_error(e, "transcribing audio")
+
+async def transcribe_wav(data):
+    """Transcribe WAV bytes prepared by audio_prep"""
+    return await llm.transcribe(io.BytesIO(data), filename="audio.wav", model="whisper-1")
+
+async def synthesize_speech(text):
+    """Return raw speech audio for text, from the TTS cache or the OpenAI TTS API"""
+    with stage("tts"):
+        audio_data = await tts_cache.get(text, TTS_VOICE, TTS_MODEL)
+        if audio_data is None:
+            audio_data = await llm.speech(text, model=TTS_MODEL, voice=TTS_VOICE)
+            await tts_cache.put(text, TTS_VOICE, TTS_MODEL, audio_data)
+    return audio_data
+
+async def text_to_speech(text):
     """Convert text to speech using OpenAI TTS API"""
     try:
-        response = openai.Audio.create(
-            model="tts-1",
-            voice="alloy",
-            input=text
-        )
-        
-        # Convert the audio content to base64 for sending to frontend
-        audio_data = response["content"]
-        base64_audio = base64.b64encode(audio_data).decode("utf-8")
-        return base64_audio
+        return await synthesize_speech(text)
     except Exception as e:
         logger.error(f"Error converting text to speech: {e}")
-        raise HTTPException(status_code=500, detail=f"Error converting text to speech: {str(e)}")
+        raise llm_error(e, "converting text to speech")
+
+async def reply_with_audio(response_text, audio="base64", transcribed_text=None):
+    """Build an endpoint reply with speech delivered in the requested format"""
+    reply = {"text": response_text, "transcribed_text": transcribed_text}
+    if audio == "none":
+        return reply
+    
+    # Generate speech
+    audio_data = await text_to_speech(response_text)
+    
+    if audio == "raw":
+        # Send the audio itself as the body; the text travels in headers, cut short if it is long
+        headers = {}
+        for name, text in (("X-Response-Text", response_text), ("X-Transcribed-Text", transcribed_text)):
+            if text is not None:
+                headers[name], truncated = text_header(text)
+                if truncated:
+                    headers[f"{name}-Truncated"] = "true"
+        return Response(content=audio_data, media_type="audio/mpeg", headers=headers)
+    if audio == "url":
+        reply["audio_url"] = f"/audio/{audio_blobs.put(audio_data)}"
+        return reply
+    
+    # Convert the audio content to base64 for sending to frontend
+    with stage("serialization"):
+        reply["audio_base64"] = base64.b64encode(audio_data).decode("utf-8")
+    return reply
+
+def build_representor_messages(session, partner_id):
+    """Create the representor prompt from the partner's recent history"""
+    # Add conversation history (trimmed to the representor token budget)
+    with stage("context_build"):
+        messages = representor_prompts[partner_id].messages(session.partner(partner_id).window())
+    prompt_prefixes.observe("representor", (session.session_id, f"partner{partner_id}"), messages)
+    return messages
+
+def preview_representor_messages(history, partner_id, text):
+    """Create the representor prompt the partner's history would give once text is sent"""
+    with stage("context_build"):
+        return representor_prompts[partner_id].messages(history.preview("user", text))
+
+def build_therapist_messages(session):
+    """Create the therapist prompt from the shared therapist history"""
+    therapist_conversation = session.therapist
+    with stage("context_build"):
+        # Earlier turns that no longer fit are represented by the running summary
+        summary = []
+        if therapist_conversation.summary:
+            summary.append({"role": "system", "content": f"Summary of the session so far:\n{therapist_conversation.summary}"})
+        
+        # Add therapist conversation history
+        messages = therapist_prompt.messages(summary, therapist_conversation.window())  # The therapist gets a larger token budget
+    prompt_prefixes.observe("therapist", (session.session_id, "therapist"), messages)
+    return messages
 
-def get_representor_response(text, partner_id):
+async def get_representor_response(text, partner_id, session_id=DEFAULT_SESSION_ID):
     """Get response from representor LLM"""
+    session = await get_session(session_id)
+    history = session.partner(partner_id)
     try:
         # Add user message to conversation history
-        partner_conversations[partner_id].append({"role": "user", "content": text})
-        
-        # Define system message based on partner ID
-        system_prompt = PARTNER1_PROMPT if partner_id == 1 else PARTNER2_PROMPT
+        history.append("user", text)
+        messages = build_representor_messages(session, partner_id)
         
-        # Create messages for the API call
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        # Add conversation history (limit to last 10 messages to save tokens)
-        messages.extend(partner_conversations[partner_id][-10:])
-        
-        # Get response from OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        # Extract response text
-        response_text = response.choices[0].message["content"]
+        # Use the rewrite drafted while the partner was typing this exact text, if there is one
+        scope = (session.session_id, partner_id)
+        draft = drafts.take(scope, text, messages)
+        response_text = await draft_reply(draft, scope, text, messages) if draft is not None else \
+            await generate_representor(scope, text, messages)
         
         # Add assistant response to conversation history
-        partner_conversations[partner_id].append({"role": "assistant", "content": response_text})
+        history.append("assistant", response_text)
         
         return response_text
     except Exception as e:
         logger.error(f"Error getting representor response: {e}")
-        raise HTTPException(status_code=500, detail=f"Error getting representor response: {str(e)}")
+        raise llm_error(e, "getting representor response")
 
-def get_therapist_response(text, partner_id):
-    """Get response from therapist LLM"""
+async def generate_representor(scope, text, messages, priority=PRIORITY_REPRESENTOR, turn=None):
+    """Get the representor rewrite of text from the partner's cache scope, or from the model the router picks
+
+    Routing stats are recorded when the reply is done, unless the caller passes
+    its own RoutedTurn to commit once the reply is used.
+    """
+    owned = turn is None
+    turn = turn or model_router.turn()
     try:
-        # Add the approved message to therapist conversation
-        therapist_conversation.append({"role": "user", "content": f"Partner {partner_id}: {text}"})
-        
-        # Create messages for the API call
-        messages = [
-            {"role": "system", "content": THERAPIST_PROMPT}
-        ]
-        
-        # Add therapist conversation history
-        messages.extend(therapist_conversation[-15:])  # Include more context for the therapist
-        
-        # Get response from OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
+        route = turn.route(text)
+        response_text = response_cache.get(route.model, messages, scope)
+        if response_text is None:
+            response_text = await complete_representor(turn, route, messages, priority)
+            if route.fast and not model_router.acceptable(text, response_text):
+                # The fast model's rewrite was not good enough; ask the stronger one
+                response_text = await complete_representor(turn, turn.escalate(), messages, priority)
+            # Stored under the routed model, so the next identical prompt finds it even if it escalated
+            response_cache.put(route.model, messages, response_text, scope)
+        return response_text
+    finally:
+        if owned:
+            turn.commit()
+
+async def complete_representor(turn, route, messages, priority=PRIORITY_REPRESENTOR):
+    """Get a representor completion from the model the router chose"""
+    with turn.call(route, messages) as call:
+        response_text = await llm.chat(
+            model=route.model,
             messages=messages,
-            max_tokens=800,
-            temperature=0.7
+            max_tokens=500,
+            temperature=0.7,
+            priority=priority
         )
-        
-        # Extract response text
-        response_text = response.choices[0].message["content"]
-        
-        # Add therapist response to conversation history
-        therapist_conversation.append({"role": "assistant", "content": response_text})
-        
-        return response_text
+        call.completed(response_text)
+    return response_text
+
+async def draft_reply(draft, scope, text, messages):
+    """Wait for a drafted rewrite; a failed draft is only a miss, so generate the reply again"""
+    try:
+        response_text, turn = await draft
+    except Exception as e:
+        logger.warning(f"Draft rewrite failed, generating it again: {e}")
+        return await generate_representor(scope, text, messages)
+    # The draft became a real turn, so it now counts in the router stats
+    turn.commit()
+    return response_text
+
+async def draft_representor(scope, text, messages):
+    """Generate a speculative rewrite, returned with its routing to commit if it is used
+
+    It waits behind every real turn for rate-limit quota.
+    """
+    turn = model_router.turn()
+    return await generate_representor(scope, text, messages, PRIORITY_BACKGROUND, turn), turn
+
+# Rewrites started from debounced partial input through /partner/{partner_id}/draft
+drafts = DraftSpeculator(draft_representor)
+
+async def therapist_turn(session_id, approvals):
+    """Add approved messages to the therapist conversation and stream one reply to all of them"""
+    session = await get_session(session_id)
+    therapist_conversation = session.therapist
+    for partner_id, text in approvals:
+        publish_therapist_turn(session, therapist_conversation.append("user", f"Partner {partner_id}: {text}"))
+    messages = build_therapist_messages(session)
+    
+    # Get response from OpenAI
+    parts = []
+    async for delta in therapist_deltas(messages):
+        parts.append(delta)
+        yield delta
+    
+    # Add therapist response to conversation history
+    publish_therapist_turn(session, therapist_conversation.append("assistant", "".join(parts)))
+
+# One therapist turn at a time per session; approvals arriving together share it
+therapist_scheduler = TurnScheduler(therapist_turn)
+
+async def get_therapist_response(text, partner_id, session_id=DEFAULT_SESSION_ID):
+    """Get response from therapist LLM"""
+    session = await get_session(session_id)
+    try:
+        return await therapist_scheduler.submit(session.session_id, (partner_id, text)).result()
     except Exception as e:
         logger.error(f"Error getting therapist response: {e}")
-        raise HTTPException(status_code=500, detail=f"Error getting therapist response: {str(e)}")
-
-# Endpoints
-@app.post("/partner/1/text", response_model=TextResponse)
-async def partner1_text(request: TextRequest):
+        raise llm_error(e, "getting therapist response")
+
+def sse_event(data):
+    """Format a payload as a server-sent event"""
+    return f"data: {json.dumps(data)}\n\n"
+
+def therapist_event(session, message):
+    """Format a therapist-channel turn as a server-sent event the client can resume after"""
+    return f"id: {session.cursor_for(message.seq)}\ndata: {message.to_json()}\n\n"
+
+def publish_therapist_turn(session, message):
+    """Push a new therapist-channel turn to both partners' event streams"""
+    event_hub.publish(session.session_id, therapist_event(session, message))
+
+async def representor_deltas(route, messages, scope):
+    """Stream a representor completion, replaying it from the response cache when possible
+
+    Tokens reach the client as they are generated, so a streamed fast reply is
+    not quality-checked; only the router's up-front choice applies.
+    """
+    cached = response_cache.get(route.model, messages, scope)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    with model_router.call(route, messages) as call:
+        async for delta in llm.chat_stream(
+            model=route.model,
+            messages=messages,
+            max_tokens=500,
+            temperature=0.7
+        ):
+            parts.append(delta)
+            call.completion_tokens += 1
+            yield delta
+    response_cache.put(route.model, messages, "".join(parts), scope)
+
+async def draft_deltas(draft, scope, text, messages):
+    """Stream a drafted rewrite as a single delta once it is ready"""
+    yield await draft_reply(draft, scope, text, messages)
+
+def therapist_deltas(messages):
+    """Stream a therapist completion"""
+    return llm.chat_stream(
+        model=THERAPIST_MODEL,
+        messages=messages,
+        max_tokens=800,
+        temperature=0.7,
+        priority=PRIORITY_THERAPIST
+    )
+
+async def stream_reply(history, deltas, audio="base64", transcribed_text=None):
+    """Forward completion tokens as server-sent events, storing the full reply at the end (if history is given)
+
+    Unless audio is "none" each finished sentence is sent to TTS while the rest of
+    the reply is still streaming, and its audio follows as soon as it is ready.
+    """
+    if transcribed_text is not None:
+        yield sse_event({"transcribed_text": transcribed_text})
     try:
-        # Get response from representor LLM
-        response_text = get_representor_response(request.text, 1)
-        
-        # Generate speech
-        audio_base64 = text_to_speech(response_text)
-        
-        return {"text": response_text, "audio_base64": audio_base64}
+        async for event in speak_stream(deltas, synthesize_speech if audio != "none" else None):
+            if event[0] == "delta":
+                yield sse_event({"delta": event[1]})
+            elif event[0] == "audio":
+                _, index, sentence, audio_data = event
+                if audio == "url":
+                    yield sse_event({"index": index, "sentence": sentence, "audio_url": f"/audio/{audio_blobs.put(audio_data)}"})
+                else:
+                    with stage("serialization"):
+                        frame = sse_event({"index": index, "sentence": sentence,
+                                           "audio_base64": base64.b64encode(audio_data).decode("utf-8")})
+                    yield frame
+            else:
+                # Only a completed reply is added to the conversation history
+                response_text = event[1]
+                if history is not None:
+                    history.append("assistant", response_text)
+                yield sse_event({"done": True, "text": response_text})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Error streaming response: {e}")
+        yield sse_event({"error": str(e)})
+
+async def stream_representor_response(text, partner_id, session_id=DEFAULT_SESSION_ID, audio="base64", transcribed=False):
+    """Stream the representor reply as server-sent events"""
+    session = await get_session(session_id)
+    history = session.partner(partner_id)
+    history.append("user", text)
+    messages = build_representor_messages(session, partner_id)
+    scope = (session.session_id, partner_id)
+    draft = drafts.take(scope, text, messages)
+    if draft is not None:
+        deltas = draft_deltas(draft, scope, text, messages)
+    else:
+        deltas = representor_deltas(model_router.route(text), messages, scope)
+    return StreamingResponse(
+        stream_reply(history, deltas, audio=audio, transcribed_text=text if transcribed else None),
+        media_type="text/event-stream"
+    )
+
+async def stream_therapist_response(text, partner_id, session_id=DEFAULT_SESSION_ID, audio="base64"):
+    """Stream the therapist reply as server-sent events"""
+    session = await get_session(session_id)
+    # The scheduler stores the reply once, however many approvals it answers
+    reply = therapist_scheduler.submit(session.session_id, (partner_id, text))
+    return StreamingResponse(stream_reply(None, reply.stream(), audio=audio), media_type="text/event-stream")
 
-@app.post("/partner/2/text", response_model=TextResponse)
-async def partner2_text(request: TextRequest):
+# Endpoints
+@app.post("/partner/{partner_id}/text", response_model=TextResponse)
+async def partner_text(partner_id: int, request: TextRequest, stream: bool = False, audio: AudioFormat = "base64"):
+    check_partner(partner_id)
+    if stream:
+        return await stream_representor_response(request.text, partner_id, request.session_id, audio)
     try:
         # Get response from representor LLM
-        response_text = get_representor_response(request.text, 2)
-        
-        # Generate speech
-        audio_base64 = text_to_speech(response_text)
+        response_text = await get_representor_response(request.text, partner_id, request.session_id)
         
-        return {"text": response_text, "audio_base64": audio_base64}
+        return await reply_with_audio(response_text, audio)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/partner/1/audio", response_model=TextResponse)
-async def partner1_audio(file: UploadFile = File(...)):
+@app.post("/partner/{partner_id}/audio", response_model=TextResponse)
+async def partner_audio(partner_id: int, file: UploadFile = File(...), session_id: str = Form(DEFAULT_SESSION_ID),
+                        stream: bool = False, audio: AudioFormat = "base64"):
     try:
-        # Save the uploaded audio file temporarily
-        audio_path = "temp_audio.wav"
-        with open(audio_path, "wb") as f:
-            f.write(await file.read())
+        check_partner(partner_id)
+        check_upload_size(file)
         
         # Transcribe the audio
-        transcribed_text = transcribe_audio(audio_path)
+        transcribed_text = await transcribe_audio(file)
+    finally:
+        # Release the spooled upload (and any temp file behind it) even if transcription failed
+        await file.close()
+    
+    try:
+        if stream:
+            return await stream_representor_response(transcribed_text, partner_id, session_id, audio, transcribed=True)
         
         # Get response from representor LLM
-        response_text = get_representor_response(transcribed_text, 1)
+        response_text = await get_representor_response(transcribed_text, partner_id, session_id)
         
-        # Generate speech
-        audio_base64 = text_to_speech(response_text)
-        
-        # Clean up the temporary file
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-        
-        return {"text": response_text, "audio_base64": audio_base64, "transcribed_text": transcribed_text}
+        return await reply_with_audio(response_text, audio, transcribed_text)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/partner/2/audio", response_model=TextResponse)
-async def partner2_audio(file: UploadFile = File(...)):
+def control_type(text):
+    """Return the type of a JSON control frame such as {"type": "end"}, or None if it is not one"""
     try:
-        # Save the uploaded audio file temporarily
-        audio_path = "temp_audio.wav"
-        with open(audio_path, "wb") as f:
-            f.write(await file.read())
-        
-        # Transcribe the audio
-        transcribed_text = transcribe_audio(audio_path)
-        
-        # Get response from representor LLM
-        response_text = get_representor_response(transcribed_text, 2)
-        
-        # Generate speech
-        audio_base64 = text_to_speech(response_text)
-        
-        # Clean up the temporary file
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-        
-        return {"text": response_text, "audio_base64": audio_base64, "transcribed_text": transcribed_text}
+        control = json.loads(text or "")
+    except ValueError:
+        return None
+    return control.get("type") if isinstance(control, dict) else None
+
+@app.websocket("/partner/{partner_id}/audio/stream")
+async def partner_audio_stream(websocket: WebSocket, partner_id: int, session_id: str = DEFAULT_SESSION_ID,
+                               sample_rate: int = 16000, audio: Literal["base64", "url", "none"] = "base64"):
+    """
+    Transcribe speech while it is recorded, then reply as /partner/{partner_id}/audio does.
+    
+    Send 16-bit little-endian mono PCM at sample_rate as binary frames, then {"type": "end"}.
+    The server sends {"partial": ...} as segments are transcribed, then {"transcribed_text": ...},
+    then the reply, and closes; failures are sent as {"error": ..., "status": ...}.
+    """
+    await websocket.accept()
+    if partner_id not in representor_prompts or not 8000 <= sample_rate <= 192000:
+        detail = f"Unknown partner {partner_id}" if partner_id not in representor_prompts else "Unsupported sample rate"
+        await websocket.send_json({"error": detail, "status": 400})
+        await websocket.close(code=1008)
+        return
+    try:
+        transcriber = StreamTranscriber(transcribe_wav, lambda text: websocket.send_json({"partial": text}),
+                                        rate=sample_rate)
+    except RuntimeError as e:
+        await websocket.send_json({"error": str(e), "status": 501})
+        await websocket.close(code=1011)
+        return
+    try:
+        while transcriber.duration < STREAM_MAX_SECONDS:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                transcriber.cancel()
+                return
+            if message.get("bytes") is not None:
+                await transcriber.feed(message["bytes"])
+            elif control_type(message.get("text")) == "end":
+                break
+            else:
+                # Nothing to transcribe in a malformed frame, so give up on the recording
+                transcriber.cancel()
+                await websocket.send_json({"error": 'Expected PCM frames or {"type": "end"}', "status": 400})
+                await websocket.close(code=1003)
+                return
+        with stage("transcription"):
+            transcribed_text = await transcriber.finish()
+        if not transcribed_text:
+            raise HTTPException(status_code=422, detail="No speech detected in the recording")
+        await websocket.send_json({"transcribed_text": transcribed_text})
+        
+        # The transcript goes straight to the representor
+        response_text = await get_representor_response(transcribed_text, partner_id, session_id)
+        await websocket.send_json(await reply_with_audio(response_text, audio, transcribed_text))
+        await websocket.close()
+    except WebSocketDisconnect:
+        transcriber.cancel()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/partner/1/approve", response_model=TextResponse)
-async def partner1_approve(request: TextRequest):
+        transcriber.cancel()
+        if not isinstance(e, HTTPException):
+            logger.error(f"Error in streamed transcription: {e}")
+            e = llm_error(e, "transcribing audio")
+        await websocket.send_json({"error": e.detail, "status": e.status_code})
+        await websocket.close(code=1011)
+
+@app.post("/partner/{partner_id}/draft", status_code=202)
+async def partner_draft(partner_id: int, request: TextRequest):
+    """Start rewriting the partner's unfinished message so the reply is ready when they send it
+
+    Send debounced partial input; each draft replaces the partner's previous one,
+    and empty or very short text just cancels it.
+    """
+    check_partner(partner_id)
+    session = await get_session(request.session_id)
+    messages = preview_representor_messages(session.partner(partner_id), partner_id, request.text)
+    return {"status": drafts.submit((session.session_id, partner_id), request.text, messages)}
+
+@app.post("/partner/{partner_id}/approve", response_model=TextResponse)
+async def partner_approve(partner_id: int, request: TextRequest, background_tasks: BackgroundTasks,
+                          stream: bool = False, audio: AudioFormat = "base64"):
+    check_partner(partner_id)
+    # Summarize turns that leave the therapist's window once the reply has been sent
+    session = await get_session(request.session_id)
+    background_tasks.add_task(summarizer.fold, session.therapist, tuple(session.partners))
+    if stream:
+        return await stream_therapist_response(request.text, partner_id, request.session_id, audio)
     try:
         # Get response from therapist LLM
-        response_text = get_therapist_response(request.text, 1)
-        
-        # Generate speech
-        audio_base64 = text_to_speech(response_text)
+        response_text = await get_therapist_response(request.text, partner_id, request.session_id)
         
-        return {"text": response_text, "audio_base64": audio_base64}
+        return await reply_with_audio(response_text, audio)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/partner/2/approve", response_model=TextResponse)
-async def partner2_approve(request: TextRequest):
+@app.get("/audio/{token}")
+async def get_audio(token: str):
+    """Serve synthesized audio handed out as an audio_url (on the event loop, which owns audio_blobs)"""
+    audio_data = audio_blobs.get(token)
+    if audio_data is None:
+        raise HTTPException(status_code=404, detail="Audio not found or expired")
+    return Response(content=audio_data, media_type="audio/mpeg")
+
+@app.get("/session/{session_id}/events")
+async def session_events(session_id: str, request: Request, since: Optional[str] = None):
+    """Push approved messages and therapist replies to a partner as server-sent events
+
+    Turns the client has not seen yet are sent first: everything retained on a
+    fresh connection, or what followed Last-Event-ID (or ?since=) on a reconnect.
+    """
+    session = await get_session(session_id)
     try:
-        # Get response from therapist LLM
-        response_text = get_therapist_response(request.text, 2)
-        
-        # Generate speech
-        audio_base64 = text_to_speech(response_text)
-        
-        return {"text": response_text, "audio_base64": audio_base64}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        start, reset = session.parse_cursor(request.headers.get("Last-Event-ID") or since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def backlog():
+        # The session was replaced since the client's cursor; it should drop what it shows
+        frames = ["event: reset\ndata: {}\n\n"] if reset else []
+        frames.extend(therapist_event(session, message) for message in session.therapist.since(start))
+        return frames
+    
+    return StreamingResponse(
+        event_hub.stream(session.session_id, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/session/events/stats")
+def session_event_stats():
+    """Report open event streams and events published"""
+    return event_hub.stats()
+
+@app.get("/therapist/scheduler/stats")
+def therapist_scheduler_stats():
+    """Report therapist turns run and approvals that shared another's turn"""
+    return therapist_scheduler.stats()
+
+@app.get("/response/cache/stats")
+def response_cache_stats():
+    """Report representor response cache hits and misses"""
+    return response_cache.stats()
+
+@app.get("/drafts/stats")
+async def draft_stats():
+    """Report speculative rewrites started, used, missed, cancelled and wasted"""
+    return drafts.stats()
+
+@app.get("/prompts/stats")
+def prompt_stats():
+    """Report prompt tokens per role and the share repeating the previous prompt's prefix"""
+    return prompt_prefixes.stats()
+
+@app.get("/router/stats")
+def router_stats():
+    """Report representor turns, latency, tokens and cost per model route"""
+    return model_router.stats()
+
+@app.get("/llm/stats")
+def llm_stats():
+    """Report LLM calls waiting for quota, retries and the circuit breaker's state"""
+    return llm.stats()
+
+@app.get("/metrics")
+def metrics():
+    """Report stage latencies, LLM tokens and calls in flight in the Prometheus text format"""
+    return Response(content=render(), media_type=CONTENT_TYPE)
+
+@app.get("/tts/cache/stats")
+def tts_cache_stats():
+    """Report TTS cache hits, misses and the characters they saved"""
+    return tts_cache.stats()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm.close()
+    sessions.close()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,266 @@
+"""In-process metrics, served in the Prometheus text format from /metrics.
+
+Recording a value is a dictionary lookup, a lock and a few additions, so it
+is cheap enough for every request. Values are kept per worker process:
+scrape each worker (or run one) when serving with several.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, from a cache hit to a slow completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Registry:
+    """The metrics rendered by /metrics, in registration order; each name may be registered once."""
+
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+
+    def register(self, metric):
+        # A second metric of the same name would duplicate or silently shadow the first
+        if metric.name in self._names:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._names.add(metric.name)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """A named family of values, one per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            # Report unlabeled metrics as zero before their first use
+            self.labels()
+        registry.register(self)
+
+    def labels(self, *values):
+        """Return the value for these label values, creating it on first use."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, _label_text(self.label_names, values), self.label_names, values)
+
+
+class _CounterValue:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels, label_names, values):
+        yield f"{name}{labels} {_number(self.value)}"
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf overflow, made cumulative only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the time spent in the with block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labels, label_names, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = f'le="{_number(bound)}"'
+            yield f"{name}_bucket{_label_text(label_names, values, [le])} {cumulative}"
+        yield f"{name}_sum{labels} {_number(total)}"
+        yield f"{name}_count{labels} {cumulative}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def track_inprogress(self):
+        return self.labels().track_inprogress()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(float(bound) for bound in buckets)
+        super().__init__(name, help, labels, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class CallbackGauge:
+    """A gauge read from read() when metrics are scraped, costing nothing in between."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, read, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.read = read
+        registry.register(self)
+
+    def samples(self):
+        yield f"{self.name} {_number(self.read())}"
+
+
+# Shared by all three servers
+STAGE_SECONDS = Histogram("couples_stage_seconds", "Time spent in each stage of handling a request", ("stage",))
+LLM_FIRST_TOKEN_SECONDS = Histogram("couples_llm_first_token_seconds",
+                                    "Time from starting a streamed LLM call to its first token", ("model",))
+LLM_SECONDS = Histogram("couples_llm_seconds", "Duration of LLM calls, including queueing and retries", ("model",))
+LLM_TOKENS = Counter("couples_llm_tokens_total", "Prompt and completion tokens sent to and received from each model",
+                     ("model", "kind"))
+LLM_ERRORS = Counter("couples_llm_errors_total", "Failed LLM calls by HTTP status", ("model", "status"))
+LLM_INFLIGHT = Gauge("couples_llm_inflight", "LLM calls in progress")
+HTTP_INFLIGHT = Gauge("couples_http_inflight", "HTTP requests in progress, including open event streams")
+
+
+def stage(name):
+    """Time a with block as the named request stage."""
+    return STAGE_SECONDS.labels(name).time()
+
+
+def render():
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests in flight and timing how long uploads take to arrive."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if dict(scope["headers"]).get(b"content-type", b"").startswith(b"multipart/"):
+            receive = self._timed_receive(receive)
+        with HTTP_INFLIGHT.track_inprogress():
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    def _timed_receive(receive):
+        started = time.perf_counter()
+        upload_read = STAGE_SECONDS.labels("upload_read")
+
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                upload_read.observe(time.perf_counter() - started)
+            return message
+        return timed_receive
+
+
+def track_flask_requests(app):
+    """Count a Flask app's requests in flight (a streamed reply until its stream ends)."""
+    app.before_request(HTTP_INFLIGHT.inc)
+    app.teardown_request(lambda error: HTTP_INFLIGHT.dec())
@@ -0,0 +1,247 @@
+"""Routing of representor turns between a fast model and the stronger therapist model.
+
+Short, calm turns go to the fast model. Long turns, emotionally intense ones
+and anything mentioning safety risks go to the strong model, as do fast
+replies that fail a quality check. Each route's latency, tokens and cost are
+recorded for /metrics and the servers' stats endpoints; speculative turns
+such as drafts go through a RoutedTurn and are only recorded once used.
+"""
+import os
+import re
+import threading
+import time
+
+from context_window import count_tokens, prompt_tokens
+from metrics import Counter, Histogram
+
+MODEL_ROUTER_ENABLED = os.getenv("MODEL_ROUTER_ENABLED", "true").lower() == "true"
+REPRESENTOR_FAST_MODEL = os.getenv("REPRESENTOR_FAST_MODEL", "gpt-3.5-turbo")
+REPRESENTOR_STRONG_MODEL = os.getenv("REPRESENTOR_STRONG_MODEL", os.getenv("THERAPIST_MODEL", "gpt-4"))
+# Turns longer than this many tokens go to the strong model
+ROUTER_MAX_FAST_TOKENS = int(os.getenv("ROUTER_MAX_FAST_TOKENS", "80"))
+# Emotional intensity score (see intensity()) at which turns go to the strong model
+ROUTER_INTENSITY_THRESHOLD = float(os.getenv("ROUTER_INTENSITY_THRESHOLD", "2"))
+
+# USD per 1K prompt and completion tokens; unknown models are costed as zero
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+
+_WORD = re.compile(r"[A-Za-z']+")
+_INTENSE_WORDS = frozenset("""
+    hate hated furious livid angry rage disgusted disgusting exhausted devastated
+    betrayed betrayal lied liar lying cheat cheated cheating selfish pathetic worthless useless
+    stupid idiot ridiculous unbearable miserable humiliated humiliating ashamed resent resentful
+    divorce screaming scream yelled yelling crying cried
+""".split())
+_ABSOLUTES = re.compile(r"\byou (always|never|don't ever|won't ever)\b", re.IGNORECASE)
+# Safety topics are never left to the fast model, whatever the score
+_RISK = re.compile(
+    r"\b(hit|hits|hitting|slapped|pushed me|abuse|abusive|threaten\w*|afraid of (him|her|them)|unsafe|"
+    r"kill|suicid\w*|hurt (myself|me|you)|self[- ]harm|weapon|gun)\b",
+    re.IGNORECASE,
+)
+_REFUSALS = ("as an ai", "i can't help", "i cannot help", "i'm sorry, but i", "i am unable to")
+
+ROUTER_TURNS = Counter("couples_router_turns_total", "Representor turns by route and the reason for it",
+                       ("route", "reason"))
+ROUTER_SECONDS = Histogram("couples_router_seconds", "Representor call latency by route", ("route",))
+ROUTER_COST = Counter("couples_router_cost_usd_total", "Estimated representor spend by route in USD", ("route",))
+
+
+def intensity(text):
+    """Score how emotionally charged a message is; calm messages score 0.
+
+    Each charged word, "you always/never" accusation and shouted (all-caps)
+    word adds 1, and exclamation marks add up to 2 more.
+    """
+    words = _WORD.findall(text)
+    score = sum(1 for word in words if word.lower() in _INTENSE_WORDS)
+    score += sum(1 for word in words if len(word) >= 3 and word.isupper())
+    score += len(_ABSOLUTES.findall(text))
+    score += min(2, text.count("!") * 0.5)
+    return score
+
+
+def call_cost(model, prompt, completion):
+    """Estimated USD cost of a call from its token counts."""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt * prompt_price + completion * completion_price) / 1000
+
+
+class Route:
+    """The model chosen for a turn, its route ("fast", "strong" or "static") and why."""
+
+    __slots__ = ("model", "name", "reason")
+
+    def __init__(self, model, name, reason):
+        self.model = model
+        self.name = name
+        self.reason = reason
+
+    @property
+    def fast(self):
+        return self.name == "fast"
+
+
+class RouteCall:
+    """Records one call's latency, tokens and cost when its with block ends."""
+
+    __slots__ = ("router", "route", "messages", "completion_tokens", "started")
+
+    def __init__(self, router, route, messages):
+        self.router = router
+        self.route = route
+        self.messages = messages
+        self.completion_tokens = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.router.record(self.route, self.messages, self.completion_tokens,
+                           time.perf_counter() - self.started, failed=exc_type is not None)
+
+    def completed(self, text):
+        self.completion_tokens = count_tokens(text)
+
+
+class RoutedTurn:
+    """The routes and calls of one turn, added to the router's totals by commit().
+
+    Has the same route(), escalate() and call() as the router.
+    """
+
+    def __init__(self, router):
+        self.router = router
+        self._routes = []
+        self._calls = []
+        self.committed = False
+
+    def route(self, text):
+        route = self.router._choose(text)
+        self._routes.append(route)
+        return route
+
+    def escalate(self, reason="quality"):
+        route = Route(self.router.strong_model, "strong", reason)
+        self._routes.append(route)
+        return route
+
+    def call(self, route, messages):
+        return RouteCall(self, route, messages)
+
+    def record(self, route, messages, completion_tokens, seconds, failed=False):
+        self._calls.append((route, messages, completion_tokens, seconds, failed))
+
+    def commit(self):
+        """Record the turn in the router's totals; later calls do nothing."""
+        if self.committed:
+            return
+        self.committed = True
+        for route in self._routes:
+            self.router._chosen(route)
+        for call in self._calls:
+            self.router.record(*call)
+
+
+class ModelRouter:
+    """Picks the model for each representor turn and keeps per-route totals.
+
+    With routing disabled every turn takes the "static" route to static_model,
+    the server's fixed representor model.
+    """
+
+    def __init__(self, fast_model=REPRESENTOR_FAST_MODEL, strong_model=REPRESENTOR_STRONG_MODEL, static_model=None,
+                 max_fast_tokens=ROUTER_MAX_FAST_TOKENS, intensity_threshold=ROUTER_INTENSITY_THRESHOLD,
+                 enabled=MODEL_ROUTER_ENABLED):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.static_model = static_model or strong_model
+        self.max_fast_tokens = max_fast_tokens
+        self.intensity_threshold = intensity_threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # route name -> running totals
+        self._totals = {name: {"calls": 0, "failures": 0, "seconds": 0.0, "prompt_tokens": 0,
+                               "completion_tokens": 0, "cost_usd": 0.0} for name in ("fast", "strong", "static")}
+        # reason -> turns routed for it
+        self.reasons = {}
+
+    def route(self, text):
+        """Choose the model for a partner's message."""
+        return self._chosen(self._choose(text))
+
+    def turn(self):
+        """Start a turn whose routing is only recorded once it is committed."""
+        return RoutedTurn(self)
+
+    def escalate(self, reason="quality"):
+        """Route a turn whose fast reply was rejected to the strong model."""
+        return self._chosen(Route(self.strong_model, "strong", reason))
+
+    def acceptable(self, text, reply):
+        """Quality check of a fast reply to text; failures are escalated.
+
+        A reply fails if it is empty, a refusal, much shorter than the
+        message it rewrites, or no calmer than a charged message.
+        """
+        stripped = reply.strip()
+        if not stripped:
+            return False
+        lowered = stripped.lower()
+        if any(refusal in lowered for refusal in _REFUSALS):
+            return False
+        if len(text) > 80 and len(stripped) < len(text) * 0.3:
+            return False
+        reply_intensity = intensity(stripped)
+        return reply_intensity < self.intensity_threshold or reply_intensity < intensity(text)
+
+    def call(self, route, messages):
+        """Time a call on route; set completed() or completion_tokens before the block ends."""
+        return RouteCall(self, route, messages)
+
+    def record(self, route, messages, completion_tokens, seconds, failed=False):
+        prompt = prompt_tokens(messages)
+        cost = call_cost(route.model, prompt, completion_tokens)
+        ROUTER_SECONDS.labels(route.name).observe(seconds)
+        ROUTER_COST.labels(route.name).inc(cost)
+        with self._lock:
+            totals = self._totals[route.name]
+            totals["calls"] += 1
+            totals["failures"] += failed
+            totals["seconds"] += seconds
+            totals["prompt_tokens"] += prompt
+            totals["completion_tokens"] += completion_tokens
+            totals["cost_usd"] += cost
+
+    def stats(self):
+        with self._lock:
+            routes = {}
+            models = {"fast": self.fast_model, "strong": self.strong_model, "static": self.static_model}
+            for name, totals in self._totals.items():
+                routes[name] = dict(totals, model=models[name],
+                                    mean_seconds=totals["seconds"] / totals["calls"] if totals["calls"] else 0.0)
+            return {"enabled": self.enabled, "routes": routes, "reasons": dict(self.reasons)}
+
+    def _choose(self, text):
+        if not self.enabled:
+            return Route(self.static_model, "static", "disabled")
+        if _RISK.search(text):
+            return Route(self.strong_model, "strong", "risk")
+        if count_tokens(text) > self.max_fast_tokens:
+            return Route(self.strong_model, "strong", "long")
+        if intensity(text) >= self.intensity_threshold:
+            return Route(self.strong_model, "strong", "intense")
+        return Route(self.fast_model, "fast", "calm")
+
+    def _chosen(self, route):
+        ROUTER_TURNS.labels(route.name, route.reason).inc()
+        with self._lock:
+            self.reasons[route.reason] = self.reasons.get(route.reason, 0) + 1
+        return route
@@ -0,0 +1,175 @@
+"""Durable, append-only storage of conversation turns shared between workers."""
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# memory (no persistence) or sqlite
+SESSION_BACKENDS = ("memory", "sqlite")
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# Writes are grouped into one transaction (and one fsync) per interval or batch
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_MS", "20")) / 1000
+SESSION_FLUSH_BATCH = int(os.getenv("SESSION_FLUSH_BATCH", "256"))
+
+
+class PersistenceBackend:
+    """Interface for storing conversation turns outside the worker process.
+
+    Turns are identified by an increasing id. Each worker has an origin tag so
+    it can pick up only the turns other workers wrote. The base class keeps
+    nothing, which is the in-memory default.
+    """
+
+    # Whether other processes may write to the same sessions
+    shared = False
+
+    def append(self, session_id, channel, role, content):
+        """Record a turn; may return before the write is durable."""
+
+    def load(self, session_id, limits):
+        """Return ({channel: [(role, content), ...]}, cursor) with at most limits[channel] latest turns each."""
+        return {}, 0
+
+    def fetch_since(self, session_id, cursor):
+        """Return ([(channel, role, content), ...], cursor) for turns other workers wrote after cursor."""
+        return [], cursor
+
+    def flush(self):
+        """Block until every appended turn is durable."""
+
+    def close(self):
+        """Flush and release resources."""
+
+
+class SQLiteBackend(PersistenceBackend):
+    """Append-only turn log in an SQLite database in WAL mode.
+
+    A single writer thread commits appended turns in groups, so a burst of
+    writes costs one transaction and one fsync. Readers use their own
+    per-thread connections and are never blocked by the writer.
+    """
+
+    shared = True
+
+    def __init__(self, path=SESSION_DB_PATH, flush_interval=SESSION_FLUSH_INTERVAL, batch_size=SESSION_FLUSH_BATCH):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id);
+            CREATE INDEX IF NOT EXISTS turns_session_channel ON turns (session_id, channel, id);
+        """)
+        conn.close()
+        self._writer = threading.Thread(target=self._write_loop, name="session-log-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def append(self, session_id, channel, role, content):
+        self._queue.put((session_id, channel, role, content, self.origin, time.time()))
+
+    def load(self, session_id, limits):
+        conn = self._reader()
+        turns = {}
+        for channel, limit in limits.items():
+            rows = conn.execute(
+                "SELECT role, content FROM turns WHERE session_id = ? AND channel = ? ORDER BY id DESC LIMIT ?",
+                (session_id, channel, limit),
+            ).fetchall()
+            if rows:
+                turns[channel] = rows[::-1]
+        cursor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+        return turns, cursor
+
+    def fetch_since(self, session_id, cursor):
+        rows = self._reader().execute(
+            "SELECT id, channel, role, content FROM turns WHERE session_id = ? AND id > ? AND origin != ? ORDER BY id",
+            (session_id, cursor, self.origin),
+        ).fetchall()
+        if not rows:
+            return [], cursor
+        return [(channel, role, content) for _, channel, role, content in rows], rows[-1][0]
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _write_loop(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch = [item]
+            # Gather whatever else arrives within the flush interval into the same commit
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO turns (session_id, channel, role, content, origin, created) VALUES (?, ?, ?, ?, ?, ?)",
+                        batch,
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Error writing {len(batch)} turns to session log: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        conn.close()
+
+
+def create_backend(kind=SESSION_BACKEND):
+    """Build the persistence backend named by SESSION_BACKEND."""
+    if kind == "memory":
+        return PersistenceBackend()
+    if kind == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unsupported SESSION_BACKEND {kind!r}; use one of: {', '.join(SESSION_BACKENDS)}")
@@ -0,0 +1,345 @@
+"""LLM providers behind the servers: OpenAI, or a local stand-in for load tests.
+
+Async providers (used by main.py) offer chat, chat_stream, transcribe,
+speech and close. Sync providers (used by the Flask servers) offer chat
+and chat_stream. Errors are raised as OpenAIError with an HTTP status.
+The factories wrap both in the rate limiting and retry layer of resilience.py,
+and record call latency and token counts in metrics.py.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from context_window import count_tokens, prompt_tokens
+from llm_client import MAX_INFLIGHT, REQUEST_TIMEOUT, AsyncOpenAIClient, OpenAIError
+from metrics import LLM_ERRORS, LLM_FIRST_TOKEN_SECONDS, LLM_INFLIGHT, LLM_SECONDS, LLM_TOKENS
+from resilience import ResilientProvider, ResilientSyncProvider
+
+# openai, or mock for the local stand-in
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+
+# Mock provider: time to first token, drawn from a fixed, uniform or lognormal distribution
+MOCK_LATENCY_DIST = os.getenv("MOCK_LATENCY_DIST", "lognormal")
+MOCK_LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "400"))
+# Spread: lognormal sigma, or +/- fraction of the median for uniform
+MOCK_LATENCY_SPREAD = float(os.getenv("MOCK_LATENCY_SPREAD", "0.5"))
+# Generation speed and length of streamed replies
+MOCK_TOKENS_PER_SECOND = float(os.getenv("MOCK_TOKENS_PER_SECOND", "50"))
+MOCK_REPLY_TOKENS = int(os.getenv("MOCK_REPLY_TOKENS", "60"))
+# Fraction of calls failing with a 500, and with a 429
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+MOCK_RATE_LIMIT_RATE = float(os.getenv("MOCK_RATE_LIMIT_RATE", "0"))
+# Requests per minute accepted before answering 429, like an account limit; 0 disables
+MOCK_RPM = int(os.getenv("MOCK_RPM", "0"))
+MOCK_SEED = int(os.getenv("MOCK_SEED", "0"))
+
+_WORDS = (
+    "I hear how much this matters to you and I want to understand what you need "
+    "it sounds like you both feel unheard when plans change without warning "
+    "let us slow down and name the feeling underneath the frustration "
+    "what would help you feel supported this week"
+).split()
+
+
+class MockBehavior:
+    """Latency, failures and reply text of the mock provider, shared by its sync and async forms.
+
+    Reply text depends only on the prompt, so runs are reproducible. Latency
+    and injected failures come from a random generator seeded with MOCK_SEED.
+    """
+
+    def __init__(self, latency_dist=MOCK_LATENCY_DIST, latency_ms=MOCK_LATENCY_MS,
+                 latency_spread=MOCK_LATENCY_SPREAD, tokens_per_second=MOCK_TOKENS_PER_SECOND,
+                 reply_tokens=MOCK_REPLY_TOKENS, error_rate=MOCK_ERROR_RATE,
+                 rate_limit_rate=MOCK_RATE_LIMIT_RATE, rpm=MOCK_RPM, seed=MOCK_SEED):
+        if latency_dist not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown mock latency distribution: {latency_dist}")
+        self.latency_dist = latency_dist
+        self.latency = latency_ms / 1000
+        self.latency_spread = latency_spread
+        self.token_interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self._random = random.Random(seed)
+        self._requests = deque()
+        self._lock = threading.Lock()
+
+    def first_token_delay(self):
+        """Sample the delay before a call starts answering, in seconds."""
+        with self._lock:
+            if self.latency_dist == "uniform":
+                return max(0.0, self._random.uniform(self.latency * (1 - self.latency_spread),
+                                                     self.latency * (1 + self.latency_spread)))
+            if self.latency_dist == "lognormal":
+                # The median of a lognormal is exp(mu), so latency_ms stays the median
+                return self._random.lognormvariate(0, self.latency_spread) * self.latency
+            return self.latency
+
+    def check_failure(self):
+        """Raise the error an injected failure or exceeded RPM limit would produce."""
+        now = time.monotonic()
+        with self._lock:
+            if self.rpm:
+                while self._requests and now - self._requests[0] > 60:
+                    self._requests.popleft()
+                if len(self._requests) >= self.rpm:
+                    raise OpenAIError("OpenAI API error 429: Rate limit reached (mock requests per minute)", 429)
+                self._requests.append(now)
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            raise OpenAIError("OpenAI API error 429: Rate limit reached (mock)", 429)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise OpenAIError("OpenAI API error 500: The server had an error (mock)", 500)
+
+    def reply_tokens_for(self, messages, max_tokens=None):
+        """Return the reply to a prompt as a list of token strings."""
+        prompt = messages[-1]["content"] if messages else ""
+        offset = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "big")
+        count = min(self.reply_tokens, max_tokens) if max_tokens else self.reply_tokens
+        tokens = []
+        for i in range(count):
+            word = _WORDS[(offset + i) % len(_WORDS)]
+            if i % 12 == 0:
+                word = word[:1].upper() + word[1:]
+            # End a sentence every dozen words so replies split like real ones
+            tokens.append(word + ("." if i % 12 == 11 or i == count - 1 else "") + " ")
+        return tokens
+
+    def audio_for(self, text):
+        """Return stand-in speech bytes roughly the size real MP3 audio would be."""
+        seed = hashlib.sha256(text.encode("utf-8")).digest()
+        return seed * max(1, len(text) * 30 // len(seed))
+
+
+class MockProvider:
+    """Async local stand-in for the OpenAI API with realistic timing."""
+
+    def __init__(self, behavior=None):
+        self.behavior = behavior or MockBehavior()
+
+    async def chat(self, model, messages, max_tokens=None, temperature=0.7, timeout=None):
+        return "".join([delta async for delta in self.chat_stream(model, messages, max_tokens, temperature, timeout)]).strip()
+
+    async def chat_stream(self, model, messages, max_tokens=None, temperature=0.7, timeout=None):
+        await asyncio.sleep(self.behavior.first_token_delay())
+        self.behavior.check_failure()
+        for i, token in enumerate(self.behavior.reply_tokens_for(messages, max_tokens)):
+            if i:
+                await asyncio.sleep(self.behavior.token_interval)
+            yield token
+
+    async def transcribe(self, audio_file, filename="audio.wav", model="whisper-1", timeout=None):
+        size = len(audio_file.read())
+        # Whisper takes longer on longer audio; assume ~16 KB per second of speech
+        await asyncio.sleep(self.behavior.first_token_delay() + size / 16000 * 0.05)
+        self.behavior.check_failure()
+        return f"Mock transcript of {size} bytes of audio."
+
+    async def speech(self, text, model="tts-1", voice="alloy", timeout=None):
+        await asyncio.sleep(self.behavior.first_token_delay() + len(text) * self.behavior.token_interval / 4)
+        self.behavior.check_failure()
+        return self.behavior.audio_for(text)
+
+    async def close(self):
+        pass
+
+
+class MockSyncProvider:
+    """Blocking form of MockProvider for the Flask servers."""
+
+    def __init__(self, behavior=None):
+        self.behavior = behavior or MockBehavior()
+
+    def chat(self, model, messages, max_tokens=None, temperature=None):
+        return "".join(self.chat_stream(model, messages, max_tokens, temperature)).strip()
+
+    def check(self):
+        # The stand-in is always reachable
+        pass
+
+    def chat_stream(self, model, messages, max_tokens=None, temperature=None):
+        time.sleep(self.behavior.first_token_delay())
+        self.behavior.check_failure()
+        for i, token in enumerate(self.behavior.reply_tokens_for(messages, max_tokens)):
+            if i:
+                time.sleep(self.behavior.token_interval)
+            yield token
+
+
+class OpenAISyncProvider:
+    """Blocking chat completions through the openai package (API defaults for omitted options).
+
+    Calls time out after OPENAI_TIMEOUT, at most OPENAI_MAX_INFLIGHT run at
+    once per worker, and failures are raised as OpenAIError. The package is
+    imported when the provider is created, not when this module is.
+    """
+
+    def __init__(self, api_key=None, timeout=REQUEST_TIMEOUT, max_inflight=MAX_INFLIGHT):
+        import openai
+        if api_key:
+            openai.api_key = api_key
+        self.openai = openai
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_inflight)
+
+    def chat(self, model, messages, max_tokens=None, temperature=None):
+        with self._slots, self._translate_errors():
+            response = self.openai.ChatCompletion.create(model=model, messages=messages,
+                                                         **self._options(max_tokens, temperature))
+            return response.choices[0].message.content
+
+    def chat_stream(self, model, messages, max_tokens=None, temperature=None):
+        with self._slots, self._translate_errors():
+            for chunk in self.openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                **self._options(max_tokens, temperature)
+            ):
+                delta = chunk.choices[0].delta.get("content")
+                if delta:
+                    yield delta
+
+    def check(self):
+        """Raise OpenAIError unless the API accepts the key; listing models costs no tokens."""
+        with self._translate_errors():
+            self.openai.Model.list(request_timeout=self.timeout)
+
+    def _options(self, max_tokens, temperature):
+        return dict(_options(max_tokens, temperature), request_timeout=self.timeout)
+
+    @contextmanager
+    def _translate_errors(self):
+        error = self.openai.error
+        try:
+            yield
+        except error.Timeout as e:
+            raise OpenAIError(f"OpenAI API request timed out: {e}", 504) from e
+        except error.APIConnectionError as e:
+            raise OpenAIError(f"OpenAI API connection failed: {e}") from e
+        except error.OpenAIError as e:
+            raise OpenAIError(f"OpenAI API error {e.http_status}: {e.user_message}", e.http_status) from e
+
+
+def _options(max_tokens, temperature):
+    options = {}
+    if max_tokens is not None:
+        options["max_tokens"] = max_tokens
+    if temperature is not None:
+        options["temperature"] = temperature
+    return options
+
+
+class _CallMetrics:
+    """Records a chat call's latency, tokens and failure when its with block ends."""
+
+    __slots__ = ("model", "started", "completion_tokens")
+
+    def __init__(self, model, messages):
+        self.model = model
+        self.started = time.perf_counter()
+        self.completion_tokens = 0
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens(messages))
+
+    def first_token(self):
+        LLM_FIRST_TOKEN_SECONDS.labels(self.model).observe(time.perf_counter() - self.started)
+
+    def __enter__(self):
+        LLM_INFLIGHT.inc()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        LLM_INFLIGHT.dec()
+        LLM_SECONDS.labels(self.model).observe(time.perf_counter() - self.started)
+        LLM_TOKENS.labels(self.model, "completion").inc(self.completion_tokens)
+        if isinstance(exc, OpenAIError):
+            LLM_ERRORS.labels(self.model, exc.status or "connection").inc()
+
+
+class MeteredProvider:
+    """Async provider wrapper recording chat latency, time to first token, tokens and calls in flight.
+
+    Streamed completions are counted a chunk per token, as the API sends them,
+    so the stream is never re-tokenized.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    async def chat(self, model, messages, **options):
+        with _CallMetrics(model, messages) as call:
+            text = await self.provider.chat(model, messages, **options)
+            call.completion_tokens = count_tokens(text)
+        return text
+
+    async def chat_stream(self, model, messages, **options):
+        with _CallMetrics(model, messages) as call:
+            async for delta in self.provider.chat_stream(model, messages, **options):
+                if not call.completion_tokens:
+                    call.first_token()
+                call.completion_tokens += 1
+                yield delta
+
+    async def transcribe(self, audio_file, **options):
+        return await self.provider.transcribe(audio_file, **options)
+
+    async def speech(self, text, **options):
+        return await self.provider.speech(text, **options)
+
+    async def close(self):
+        await self.provider.close()
+
+    def stats(self):
+        return self.provider.stats()
+
+
+class MeteredSyncProvider:
+    """Blocking form of MeteredProvider for the Flask servers."""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def chat(self, model, messages, **options):
+        with _CallMetrics(model, messages) as call:
+            text = self.provider.chat(model, messages, **options)
+            call.completion_tokens = count_tokens(text)
+        return text
+
+    def chat_stream(self, model, messages, **options):
+        with _CallMetrics(model, messages) as call:
+            for delta in self.provider.chat_stream(model, messages, **options):
+                if not call.completion_tokens:
+                    call.first_token()
+                call.completion_tokens += 1
+                yield delta
+
+    def check(self):
+        self.provider.check()
+
+    def stats(self):
+        return self.provider.stats()
+
+
+def create_provider(api_key=None, kind=LLM_PROVIDER):
+    """Build the async provider named by LLM_PROVIDER, with rate limiting, retries and metrics."""
+    if kind == "mock":
+        return MeteredProvider(ResilientProvider(MockProvider()))
+    if kind == "openai":
+        return MeteredProvider(ResilientProvider(AsyncOpenAIClient(api_key=api_key)))
+    raise ValueError(f"Unknown LLM provider: {kind}")
+
+
+def create_sync_provider(api_key=None, kind=LLM_PROVIDER):
+    """Build the blocking provider named by LLM_PROVIDER, with rate limiting, retries and metrics."""
+    if kind == "mock":
+        return MeteredSyncProvider(ResilientSyncProvider(MockSyncProvider()))
+    if kind == "openai":
+        return MeteredSyncProvider(ResilientSyncProvider(OpenAISyncProvider(api_key=api_key)))
+    raise ValueError(f"Unknown LLM provider: {kind}")
@@ -0,0 +1,408 @@
+"""Rate limiting, retries and a circuit breaker around LLM provider calls.
+
+Calls are admitted through token buckets sized to the account's requests
+and tokens per minute, in priority order, so therapist replies are never
+stuck behind a queue of representor rewrites. Failed calls are retried with
+jittered exponential backoff, and after repeated server errors a circuit
+breaker fails calls fast until the provider recovers.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import random
+import threading
+import time
+
+from context_window import prompt_tokens
+from llm_client import OpenAIError
+
+# Account quota for this worker (divide the account quota by the worker count); 0 disables
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "0"))
+# Retries after the first attempt for 429s, server errors, timeouts and connection failures
+OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE_MS", "500")) / 1000
+BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX_MS", "8000")) / 1000
+# Consecutive server errors that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# Completion size assumed when a call does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+# Lower values are served first
+PRIORITY_THERAPIST = 0
+PRIORITY_REPRESENTOR = 1
+PRIORITY_BACKGROUND = 2
+
+RETRYABLE_STATUSES = {None, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(OpenAIError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"OpenAI API unavailable; retrying in {retry_after:.0f}s", 503)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Tokens a chat call will count against the tokens-per-minute quota."""
+    return prompt_tokens(messages) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff: a random delay up to base * 2^attempt, capped."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable(error):
+    return not isinstance(error, CircuitOpenError) and getattr(error, "status", None) in RETRYABLE_STATUSES
+
+
+def error_status(error):
+    """HTTP status and headers to answer a failed call with.
+
+    Rate limiting and outages that outlasted the retries are passed on as
+    429 and 503, with Retry-After when the circuit breaker knows it;
+    anything else is a 500.
+    """
+    status = getattr(error, "status", None)
+    retry_after = getattr(error, "retry_after", None)
+    headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else {}
+    return (status if status in (429, 503) else 500), headers
+
+
+class TokenBucket:
+    """Capacity refilling continuously at per_minute / 60 units per second."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def delay(self, amount, now):
+        """Seconds until amount can be taken (requests larger than the bucket wait for a full one)."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class _Quota:
+    """Request and token buckets checked together."""
+
+    def __init__(self, rpm, tpm):
+        self.buckets = [(TokenBucket(rpm), False)] if rpm else []
+        if tpm:
+            self.buckets.append((TokenBucket(tpm), True))
+
+    @property
+    def enabled(self):
+        return bool(self.buckets)
+
+    def delay(self, tokens):
+        now = time.monotonic()
+        return max(bucket.delay(tokens if counts_tokens else 1, now) for bucket, counts_tokens in self.buckets)
+
+    def take(self, tokens):
+        for bucket, counts_tokens in self.buckets:
+            bucket.take(tokens if counts_tokens else 1)
+
+
+class AsyncRateLimiter:
+    """Admits calls on one event loop within the quota, highest priority first."""
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM):
+        self.quota = _Quota(rpm, tpm)
+        # (priority, arrival, tokens, future) of calls waiting for quota
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._timer = None
+        self.delayed = 0
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, tokens, priority=PRIORITY_REPRESENTOR):
+        if not self.quota.enabled:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), tokens, future))
+        self._dispatch()
+        if not future.done():
+            self.delayed += 1
+        # A cancelled caller leaves a done future behind, which _dispatch skips
+        await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self.quota.delay(tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.quota.take(tokens)
+            future.set_result(None)
+
+
+class RateLimiter:
+    """Thread-safe form of AsyncRateLimiter for the Flask servers."""
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM):
+        self.quota = _Quota(rpm, tpm)
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+        self.delayed = 0
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def acquire(self, tokens, priority=PRIORITY_REPRESENTOR):
+        if not self.quota.enabled:
+            return
+        with self._condition:
+            entry = (priority, next(self._arrivals))
+            heapq.heappush(self._waiters, entry)
+            waited = False
+            try:
+                while True:
+                    if self._waiters[0] == entry:
+                        delay = self.quota.delay(tokens)
+                        if delay <= 0:
+                            heapq.heappop(self._waiters)
+                            self.quota.take(tokens)
+                            return
+                        self._condition.wait(delay)
+                    else:
+                        self._condition.wait()
+                    waited = True
+            finally:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                if waited:
+                    self.delayed += 1
+                # Whoever is at the head now may be able to go
+                self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """Opens after consecutive server errors; after a cool-down, one trial call decides.
+
+    Once the cool-down has passed (half-open), check() admits a single probe
+    and keeps rejecting every other call until the probe succeeds (closing
+    the circuit) or fails (re-opening it). A probe that never reports back,
+    e.g. because it was cancelled, is replaced after another cool-down.
+    """
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        # When the current half-open probe was admitted, or None
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half-open"
+
+    def check(self):
+        """Raise CircuitOpenError while the circuit is open or another call is probing it."""
+        if self.opened_at is None:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = self.reset_seconds - (now - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            if self.probe_started is not None and now - self.probe_started < self.reset_seconds:
+                raise CircuitOpenError(1)
+            self.probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self, error):
+        if isinstance(error, CircuitOpenError):
+            return
+        # Rate limiting and bad requests say nothing about the provider's health,
+        # but they do end a probe, so the next call may try again
+        if getattr(error, "status", None) not in (None, 500, 502, 503, 504):
+            with self._lock:
+                self.probe_started = None
+            return
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            # A failed trial call while half-open re-opens at once
+            if self.failures >= self.threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    self.opened += 1
+                self.opened_at = time.monotonic()
+
+
+class ResilientProvider:
+    """Async provider wrapper adding rate limiting, priorities, retries and a circuit breaker.
+
+    Chat methods take an extra priority argument. A streamed call is only
+    retried if it fails before its first token.
+    """
+
+    def __init__(self, provider, limiter=None, breaker=None, retries=OPENAI_RETRIES):
+        self.provider = provider
+        self.limiter = AsyncRateLimiter() if limiter is None else limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = retries
+        self.retried = 0
+
+    async def _attempts(self, tokens, priority):
+        """Yield attempt numbers, each admitted by the breaker and the rate limiter."""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(backoff_delay(attempt - 1))
+            self.breaker.check()
+            if tokens is not None:
+                await self.limiter.acquire(tokens, priority)
+            yield attempt
+
+    async def _call(self, call, tokens=None, priority=PRIORITY_REPRESENTOR):
+        async for attempt in self._attempts(tokens, priority):
+            try:
+                result = await call()
+            except OpenAIError as e:
+                self.breaker.record_failure(e)
+                if not is_retryable(e) or attempt == self.retries:
+                    raise
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def chat(self, model, messages, max_tokens=None, temperature=0.7, timeout=None,
+                   priority=PRIORITY_REPRESENTOR):
+        return await self._call(
+            lambda: self.provider.chat(model, messages, max_tokens=max_tokens, temperature=temperature, timeout=timeout),
+            estimate_tokens(messages, max_tokens), priority
+        )
+
+    async def chat_stream(self, model, messages, max_tokens=None, temperature=0.7, timeout=None,
+                          priority=PRIORITY_REPRESENTOR):
+        async for attempt in self._attempts(estimate_tokens(messages, max_tokens), priority):
+            started = False
+            try:
+                async for delta in self.provider.chat_stream(model, messages, max_tokens=max_tokens,
+                                                             temperature=temperature, timeout=timeout):
+                    started = True
+                    yield delta
+            except OpenAIError as e:
+                self.breaker.record_failure(e)
+                if started or not is_retryable(e) or attempt == self.retries:
+                    raise
+                continue
+            self.breaker.record_success()
+            return
+
+    async def transcribe(self, audio_file, filename="audio.wav", model="whisper-1", timeout=None):
+        async def call():
+            audio_file.seek(0)
+            return await self.provider.transcribe(audio_file, filename=filename, model=model, timeout=timeout)
+        return await self._call(call)
+
+    async def speech(self, text, model="tts-1", voice="alloy", timeout=None):
+        return await self._call(lambda: self.provider.speech(text, model=model, voice=voice, timeout=timeout))
+
+    async def close(self):
+        await self.provider.close()
+
+    def stats(self):
+        return {
+            "retries": self.retried,
+            "queued": len(self.limiter),
+            "rate_limited": self.limiter.delayed,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+        }
+
+
+class ResilientSyncProvider:
+    """Blocking form of ResilientProvider for the Flask servers."""
+
+    def __init__(self, provider, limiter=None, breaker=None, retries=OPENAI_RETRIES):
+        self.provider = provider
+        self.limiter = RateLimiter() if limiter is None else limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = retries
+        self.retried = 0
+
+    def _attempts(self, tokens, priority):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                time.sleep(backoff_delay(attempt - 1))
+            self.breaker.check()
+            self.limiter.acquire(tokens, priority)
+            yield attempt
+
+    def chat(self, model, messages, max_tokens=None, temperature=None, priority=PRIORITY_REPRESENTOR):
+        for attempt in self._attempts(estimate_tokens(messages, max_tokens), priority):
+            try:
+                result = self.provider.chat(model, messages, max_tokens=max_tokens, temperature=temperature)
+            except OpenAIError as e:
+                self.breaker.record_failure(e)
+                if not is_retryable(e) or attempt == self.retries:
+                    raise
+                continue
+            self.breaker.record_success()
+            return result
+
+    def chat_stream(self, model, messages, max_tokens=None, temperature=None, priority=PRIORITY_REPRESENTOR):
+        for attempt in self._attempts(estimate_tokens(messages, max_tokens), priority):
+            started = False
+            try:
+                for delta in self.provider.chat_stream(model, messages, max_tokens=max_tokens, temperature=temperature):
+                    started = True
+                    yield delta
+            except OpenAIError as e:
+                self.breaker.record_failure(e)
+                if started or not is_retryable(e) or attempt == self.retries:
+                    raise
+                continue
+            self.breaker.record_success()
+            return
+
+    def check(self):
+        """Probe the provider directly, bypassing the quota, retries and breaker."""
+        self.provider.check()
+
+    def stats(self):
+        return {
+            "retries": self.retried,
+            "queued": len(self.limiter),
+            "rate_limited": self.limiter.delayed,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+        }
@@ -0,0 +1,187 @@
+"""Opt-in cache of representor completions keyed on the normalized prompt."""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from metrics import CallbackGauge
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Trailing conversation messages that take part in the key
+RESPONSE_CACHE_WINDOW = int(os.getenv("RESPONSE_CACHE_WINDOW", "2"))
+# Estimated Jaccard similarity for a near-duplicate hit; 0 disables near-duplicate lookup
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+
+_WORD = re.compile(r"[a-z0-9']+")
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Every cache in the process, for the hit ratio gauge
+_caches = weakref.WeakSet()
+
+
+def hit_ratio():
+    """Hits per lookup across every response cache in the process."""
+    hits = lookups = 0
+    for cache in list(_caches):
+        hits += cache.hits + cache.near_hits
+        lookups += cache.hits + cache.near_hits + cache.misses
+    return hits / lookups if lookups else 0.0
+
+
+CallbackGauge("couples_response_cache_hit_ratio", "Representor response cache hits per lookup", hit_ratio)
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace so trivially different inputs share a key."""
+    return " ".join(text.lower().split())
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    """MinHash signatures over word shingles for cheap near-duplicate detection."""
+
+    def __init__(self, num_perm=64, shingle_size=2, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.permutations = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)
+        ]
+
+    def signature(self, text):
+        words = _WORD.findall(text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+                  for s in shingles]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self.permutations
+        )
+
+    @staticmethod
+    def similarity(first, second):
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+class ResponseCache:
+    """TTL + LRU map from normalized (scope, model, system prompt, trailing messages) to a reply.
+
+    The scope, such as (session id, partner id), keeps one partner's
+    rewrites from being served to anyone else. With a similarity threshold
+    set, a miss falls back to locality-sensitive hashing over MinHash
+    signatures of the latest message, restricted to entries that share the
+    same scope, model, system prompt and earlier context.
+    """
+
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE,
+                 window=RESPONSE_CACHE_WINDOW, similarity=RESPONSE_CACHE_SIMILARITY, bands=16):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.window = window
+        self.similarity = similarity
+        self.minhash = MinHasher() if similarity > 0 else None
+        self.bands = bands
+        # key -> (expires, response text, context key, signature)
+        self._entries = OrderedDict()
+        # (context key, band index, band values) -> keys of entries in that bucket
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        _caches.add(self)
+
+    def _keys(self, model, messages, scope):
+        system = [normalize(m["content"]) for m in messages if m["role"] == "system"]
+        turns = [(m["role"], normalize(m["content"])) for m in messages if m["role"] != "system"]
+        turns = turns[-self.window:] if self.window > 0 else turns[-1:]
+        key = _digest(scope, model, system, turns)
+        context_key = _digest(scope, model, system, turns[:-1])
+        return key, context_key, turns[-1][1] if turns else ""
+
+    def get(self, model, messages, scope=None):
+        """Return a reply cached for this prompt within scope, or None."""
+        if not self.enabled:
+            return None
+        key, context_key, latest = self._keys(model, messages, scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if self.minhash is not None:
+                signature = self.minhash.signature(latest)
+                for candidate in self._candidates(context_key, signature):
+                    entry = self._entries.get(candidate)
+                    if entry is not None and entry[0] > now and \
+                            MinHasher.similarity(signature, entry[3]) >= self.similarity:
+                        self._entries.move_to_end(candidate)
+                        self.near_hits += 1
+                        return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, model, messages, response_text, scope=None):
+        """Remember the reply generated for this prompt within scope."""
+        if not self.enabled:
+            return
+        key, context_key, latest = self._keys(model, messages, scope)
+        signature = self.minhash.signature(latest) if self.minhash is not None else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, response_text, context_key, signature)
+            if signature is not None:
+                for bucket in self._band_keys(context_key, signature):
+                    self._buckets.setdefault(bucket, set()).add(key)
+            self._evict()
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _band_keys(self, context_key, signature):
+        rows = len(signature) // self.bands
+        return [(context_key, band, signature[band * rows:(band + 1) * rows]) for band in range(self.bands)]
+
+    def _candidates(self, context_key, signature):
+        candidates = set()
+        for bucket in self._band_keys(context_key, signature):
+            candidates.update(self._buckets.get(bucket, ()))
+        return candidates
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[3] is not None:
+            for bucket in self._band_keys(entry[2], entry[3]):
+                keys = self._buckets.get(bucket)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._buckets[bucket]
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and entry[0] > now:
+                break
+            self._remove(key)
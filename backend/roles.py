@@ -0,0 +1,115 @@
+"""Per-role system prompts, built once at startup and shared by every request.
+
+Prompts are laid out as the role's system message, then any running summary,
+then recent turns, so consecutive prompts of a conversation share a long,
+byte-identical prefix that providers can serve from their prompt cache.
+PrefixTracker measures how long that shared prefix actually is.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from context_window import MESSAGE_OVERHEAD_TOKENS, count_tokens
+from metrics import Counter
+
+# Shortest prefix a provider caches (OpenAI: 1024 tokens); shorter repeated prefixes are billed in full
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+# Conversations whose last prompt is remembered for comparison, least recently used dropped first
+PREFIX_TRACKED_CONVERSATIONS = int(os.getenv("PREFIX_TRACKED_CONVERSATIONS", "10000"))
+
+PROMPT_TOKENS = Counter("couples_prompt_tokens_total",
+                        "Prompt tokens by role, and how many repeat the start of the previous prompt",
+                        ("role", "kind"))
+
+
+class RolePrompt:
+    """A role's system message, ready to be placed at the head of a prompt."""
+
+    __slots__ = ("system",)
+
+    def __init__(self, content):
+        self.system = {"role": "system", "content": content}
+
+    def messages(self, *context):
+        """Return the system message followed by the given lists of messages."""
+        messages = [self.system]
+        for part in context:
+            messages.extend(part)
+        return messages
+
+
+class RolePrompts:
+    """One RolePrompt per participant, built from build(participant_id)."""
+
+    def __init__(self, build, participant_ids):
+        self._prompts = {participant_id: RolePrompt(build(participant_id)) for participant_id in participant_ids}
+
+    def __getitem__(self, participant_id):
+        return self._prompts[participant_id]
+
+    def __contains__(self, participant_id):
+        return participant_id in self._prompts
+
+
+class PrefixTracker:
+    """Compares each prompt with the previous one of the same conversation.
+
+    The repeated prefix is counted in whole messages, which is what a
+    provider's prefix cache can reuse; it counts as cacheable once it is
+    at least min_tokens long. Each message is remembered as its hash and
+    token count only, and the counts of repeated messages are reused, so
+    observing a prompt tokenizes only the messages that are new in it.
+    """
+
+    def __init__(self, min_tokens=PROMPT_CACHE_MIN_TOKENS, max_conversations=PREFIX_TRACKED_CONVERSATIONS):
+        self.min_tokens = min_tokens
+        self.max_conversations = max_conversations
+        # conversation key -> [(message hash, tokens)] of its last prompt
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+        # role -> running totals
+        self._totals = {}
+
+    def observe(self, role, key, messages):
+        """Record a prompt about to be sent for conversation key; returns its repeated prefix tokens."""
+        with self._lock:
+            previous = self._last.pop(key, ())
+        known = dict(previous)
+        fingerprint = []
+        prefix = 0
+        repeating = True
+        for index, message in enumerate(messages):
+            digest = hash((message["role"], message["content"]))
+            tokens = known.get(digest)
+            if tokens is None:
+                tokens = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            repeating = repeating and index < len(previous) and previous[index][0] == digest
+            if repeating:
+                prefix += tokens
+            fingerprint.append((digest, tokens))
+        total = sum(tokens for _, tokens in fingerprint)
+        cacheable = prefix if prefix >= self.min_tokens else 0
+        PROMPT_TOKENS.labels(role, "total").inc(total)
+        PROMPT_TOKENS.labels(role, "repeated_prefix").inc(prefix)
+        PROMPT_TOKENS.labels(role, "cacheable_prefix").inc(cacheable)
+        with self._lock:
+            self._last[key] = fingerprint
+            while len(self._last) > self.max_conversations:
+                self._last.popitem(last=False)
+            totals = self._totals.setdefault(role, {"prompts": 0, "prompt_tokens": 0, "repeated_prefix_tokens": 0,
+                                                    "cacheable_prefix_tokens": 0})
+            totals["prompts"] += 1
+            totals["prompt_tokens"] += total
+            totals["repeated_prefix_tokens"] += prefix
+            totals["cacheable_prefix_tokens"] += cacheable
+        return prefix
+
+    def stats(self):
+        with self._lock:
+            roles = {}
+            for role, totals in self._totals.items():
+                tokens = totals["prompt_tokens"]
+                roles[role] = dict(totals,
+                                   prefix_ratio=totals["repeated_prefix_tokens"] / tokens if tokens else 0.0,
+                                   cached_prefix_ratio=totals["cacheable_prefix_tokens"] / tokens if tokens else 0.0)
+            return {"min_cached_tokens": self.min_tokens, "conversations": len(self._last), "roles": roles}
@@ -1,10 +1,21 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
-import openai
+import json
+import atexit
 import logging
 
+from health import ProviderHealth
+from metrics import CONTENT_TYPE, render, stage, track_flask_requests
+from model_router import ModelRouter
+from persistence import create_backend
+from providers import LLM_PROVIDER, create_sync_provider
+from resilience import PRIORITY_THERAPIST, error_status
+from response_cache import ResponseCache
+from roles import PrefixTracker, RolePrompt, RolePrompts
+from session_store import PARTICIPANT_IDS, SessionStore
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,6 +25,7 @@ load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
+track_flask_requests(app)
 
 # Configure OpenAI
 api_key = os.getenv("OPENAI_API_KEY")
@@ -24,37 +36,135 @@ logger.info(f"Loaded API key: {'[MASKED]' + api_key[-4:] if api_key else 'None'}
 logger.info(f"Partner Model: {partner_model}")
 logger.info(f"Therapist Model: {therapist_model}")
 
-if api_key and api_key != "your_openai_api_key_here":
-    try:
-        openai.api_key = api_key
-        # Test the API key with a simple completion
-        test_response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": "test"}],
-            max_tokens=5
-        )
-        logger.info("OpenAI API key verified successfully")
-        USE_OPENAI = True
-    except Exception as e:
-        logger.error(f"Error validating OpenAI API key: {str(e)}")
-        logger.warning("Falling back to simulated responses")
-        USE_OPENAI = False
+# OpenAI, or the local stand-in with LLM_PROVIDER=mock
+if LLM_PROVIDER == "mock":
+    logger.info("Using the mock LLM provider")
+    LLM_ENABLED = True
+elif api_key and api_key != "your_openai_api_key_here":
+    LLM_ENABLED = True
 else:
     logger.warning("No valid OpenAI API key found. Using simulated responses.")
-    USE_OPENAI = False
+    LLM_ENABLED = False
+
+# The provider is created on first use and the key is checked in the background
+# (without spending tokens), so workers start serving immediately; /ready reports the result
+provider_health = ProviderHealth(lambda: create_sync_provider(api_key=api_key))
+if LLM_ENABLED:
+    provider_health.start()
+    # Workers forked after import start their own check
+    app.before_request(provider_health.start)
+
+def use_openai():
+    """Whether replies come from the LLM (a rejected key falls back to simulated responses)"""
+    return LLM_ENABLED and provider_health.status != "unauthorized"
+
+def get_provider():
+    return provider_health.provider
+
+# Store conversation history per session
+# (prompts carry as many recent turns as fit each role's token budget)
+sessions = SessionStore(
+    partner_budget=int(os.getenv("REPRESENTOR_CONTEXT_TOKENS", "600")),
+    therapist_budget=int(os.getenv("THERAPIST_CONTEXT_TOKENS", "1200")),
+    backend=create_backend()  # SESSION_BACKEND=sqlite keeps sessions across restarts and workers
+)
+atexit.register(sessions.close)
+
+# Calm, short representor turns go to partner_model; the rest escalate to therapist_model
+model_router = ModelRouter(fast_model=partner_model, strong_model=therapist_model, static_model=partner_model)
 
-# Store conversation history
-conversation_history = {
-    "partner1": [],
-    "partner2": [],
-    "therapist": []
-}
+# Representor rewrites of prompts we have already answered (opt-in via RESPONSE_CACHE_ENABLED)
+response_cache = ResponseCache()
+
+# System prompts, built once for every participant rather than on each request
+representor_prompts = RolePrompts(
+    lambda partner_id: f"""You are a helpful representor for Partner {partner_id} in couples therapy.
+Your goal is to help them express their thoughts and feelings constructively.
+Suggest improvements to their message that maintain their core meaning but phrase it
+in a way that is more likely to be received well by their partner.
+Keep responses concise and focused on improving communication.""",
+    PARTICIPANT_IDS
+)
+therapist_prompt = RolePrompt("""You are a skilled couples therapist with expertise in:
+1. Active listening and validation
+2. Conflict resolution
+3. Emotional intelligence
+4. Relationship dynamics
+
+Provide thoughtful responses that:
+- Acknowledge both partners' perspectives
+- Identify underlying emotions and needs
+- Suggest constructive ways to move forward
+- Maintain professional boundaries
+
+Keep responses concise and focused on improving communication.""")
+# How much of each prompt repeats the previous one's prefix, which providers can serve from cache
+prompt_prefixes = PrefixTracker()
+
+def get_session(data):
+    """Return the session named by the request, or None if the id is malformed"""
+    try:
+        return sessions.get(data.get('session_id'))
+    except ValueError:
+        return None
+
+def llm_error(e):
+    """JSON error response for a failed LLM call, passing rate limiting and outages on as 429 and 503"""
+    logger.error(f"OpenAI API error: {str(e)}")
+    status, headers = error_status(e)
+    return jsonify({"error": f"OpenAI API error: {str(e)}"}), status, headers
+
+def complete_representor(route, messages):
+    """Get a representor completion from the model the router chose"""
+    with model_router.call(route, messages) as call:
+        response_text = get_provider().chat(
+            model=route.model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=150
+        )
+        call.completed(response_text)
+    return response_text
+
+def stream_representor(route, messages):
+    """Stream a representor completion from the model the router chose"""
+    with model_router.call(route, messages) as call:
+        for delta in get_provider().chat_stream(route.model, messages, max_tokens=150):
+            call.completion_tokens += 1
+            yield delta
+
+def wants_stream(data):
+    """Whether the client asked for the reply to be streamed"""
+    return bool(data.get('stream')) or request.args.get('stream', '').lower() == 'true'
+
+def stream_reply(history, deltas, on_complete=None):
+    """Send reply text as server-sent events, storing the full reply once it is complete"""
+    def generate():
+        parts = []
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield f"data: {json.dumps({'delta': delta})}\n\n"
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            yield f"data: {json.dumps({'error': f'OpenAI API error: {str(e)}'})}\n\n"
+            return
+        response_text = "".join(parts)
+        history.append("assistant", response_text)
+        if on_complete is not None:
+            on_complete(response_text)
+        yield f"data: {json.dumps({'done': True, 'response': response_text})}\n\n"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.route('/test')
 def test():
     return jsonify({
         "status": "API is working correctly",
-        "openai_enabled": USE_OPENAI,
+        "openai_enabled": use_openai(),
         "partner_model": partner_model,
         "therapist_model": therapist_model
     })
@@ -67,54 +177,59 @@ def partner_message(partner_id):
         
         if not message:
             return jsonify({"error": "No message provided"}), 400
+
+        session = get_session(data)
+        if session is None:
+            return jsonify({"error": "Invalid session id"}), 400
+        if partner_id not in session.partners:
+            return jsonify({"error": f"Unknown partner {partner_id}"}), 400
+        history = session.partner(partner_id)
             
         # Store the message in conversation history
-        conversation_history[f"partner{partner_id}"].append({
-            "role": "user",
-            "content": message
-        })
+        history.append("user", message)
         
-        if USE_OPENAI:
+        if use_openai():
             try:
-                # Create system message for the representor
-                system_message = {
-                    "role": "system",
-                    "content": f"""You are a helpful representor for Partner {partner_id} in couples therapy.
-                    Your goal is to help them express their thoughts and feelings constructively.
-                    Suggest improvements to their message that maintain their core meaning but phrase it
-                    in a way that is more likely to be received well by their partner.
-                    Keep responses concise and focused on improving communication."""
-                }
+                # The partner's system message, then recent conversation history
+                with stage("context_build"):
+                    messages = representor_prompts[partner_id].messages(history.window())
+                prompt_prefixes.observe("representor", (session.session_id, f"partner{partner_id}"), messages)
                 
-                # Get recent conversation history
-                recent_messages = conversation_history[f"partner{partner_id}"][-5:]
-                messages = [system_message] + recent_messages
+                scope = (session.session_id, partner_id)
+                # Pick the model, then reuse the reply this partner got for an identical prompt if there is one
+                route = model_router.route(message)
+                response_text = response_cache.get(route.model, messages, scope)
                 
-                # Make API call
-                response = openai.ChatCompletion.create(
-                    model=partner_model,
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=150
-                )
+                # Forward tokens as they arrive if the client asked for a stream
+                # (a streamed reply cannot be quality-checked, so only the up-front route applies)
+                if wants_stream(data):
+                    if response_text is not None:
+                        return stream_reply(history, [response_text])
+                    return stream_reply(history, stream_representor(route, messages),
+                                        lambda text: response_cache.put(route.model, messages, text, scope))
                 
-                response_text = response.choices[0].message.content
-                logger.info(f"OpenAI response for Partner {partner_id}: {response_text}")
+                if response_text is None:
+                    # Make API call
+                    response_text = complete_representor(route, messages)
+                    if route.fast and not model_router.acceptable(message, response_text):
+                        # The fast model's rewrite was not good enough; ask the stronger one
+                        response_text = complete_representor(model_router.escalate(), messages)
+                    # Stored under the routed model, so the next identical prompt finds it even if it escalated
+                    response_cache.put(route.model, messages, response_text, scope)
                 
             except Exception as e:
-                logger.error(f"OpenAI API error: {str(e)}")
-                return jsonify({"error": f"OpenAI API error: {str(e)}"}), 500
+                return llm_error(e)
                 
         else:
             response_text = f"This is a simulated response for Partner {partner_id}: {message}"
+            if wants_stream(data):
+                return stream_reply(history, [response_text])
             
         # Store the response
-        conversation_history[f"partner{partner_id}"].append({
-            "role": "assistant",
-            "content": response_text
-        })
+        history.append("assistant", response_text)
         
-        return jsonify({"response": response_text})
+        with stage("serialization"):
+            return jsonify({"response": response_text})
         
     except Exception as e:
         logger.error(f"Error in partner_message: {str(e)}")
@@ -128,70 +243,105 @@ def partner_approve(partner_id):
         
         if not message:
             return jsonify({"error": "No message provided"}), 400
+
+        session = get_session(data)
+        if session is None:
+            return jsonify({"error": "Invalid session id"}), 400
+        if partner_id not in session.partners:
+            return jsonify({"error": f"Unknown partner {partner_id}"}), 400
+        therapist_history = session.therapist
             
         # Store the approved message in therapist conversation
-        conversation_history["therapist"].append({
-            "role": "user",
-            "content": f"Partner {partner_id}: {message}"
-        })
+        therapist_history.append("user", f"Partner {partner_id}: {message}")
         
-        if USE_OPENAI:
+        if use_openai():
             try:
-                # Create system message for the therapist
-                system_message = {
-                    "role": "system",
-                    "content": """You are a skilled couples therapist with expertise in:
-                    1. Active listening and validation
-                    2. Conflict resolution
-                    3. Emotional intelligence
-                    4. Relationship dynamics
-                    
-                    Provide thoughtful responses that:
-                    - Acknowledge both partners' perspectives
-                    - Identify underlying emotions and needs
-                    - Suggest constructive ways to move forward
-                    - Maintain professional boundaries
-                    
-                    Keep responses concise and focused on improving communication."""
-                }
+                # The therapist's system message, then recent conversation history
+                with stage("context_build"):
+                    messages = therapist_prompt.messages(therapist_history.window())
+                prompt_prefixes.observe("therapist", (session.session_id, "therapist"), messages)
                 
-                # Get recent conversation history
-                recent_messages = conversation_history["therapist"][-10:]
-                messages = [system_message] + recent_messages
+                # Forward tokens as they arrive if the client asked for a stream
+                if wants_stream(data):
+                    deltas = get_provider().chat_stream(therapist_model, messages, max_tokens=200,
+                                                        priority=PRIORITY_THERAPIST)
+                    return stream_reply(therapist_history, deltas)
                 
                 # Make API call
-                response = openai.ChatCompletion.create(
+                response_text = get_provider().chat(
                     model=therapist_model,
                     messages=messages,
                     temperature=0.7,
-                    max_tokens=200
+                    max_tokens=200,
+                    priority=PRIORITY_THERAPIST
                 )
                 
-                response_text = response.choices[0].message.content
-                logger.info(f"OpenAI therapist response: {response_text}")
-                
             except Exception as e:
-                logger.error(f"OpenAI API error: {str(e)}")
-                return jsonify({"error": f"OpenAI API error: {str(e)}"}), 500
+                return llm_error(e)
                 
         else:
             response_text = f"This is a simulated response from the therapist. I understand Partner {partner_id}'s perspective. Let me help facilitate communication between both partners."
+            if wants_stream(data):
+                return stream_reply(therapist_history, [response_text])
             
         # Store the therapist's response
-        conversation_history["therapist"].append({
-            "role": "assistant",
-            "content": response_text
-        })
+        therapist_history.append("assistant", response_text)
         
-        return jsonify({"response": response_text})
+        with stage("serialization"):
+            return jsonify({"response": response_text})
         
     except Exception as e:
         logger.error(f"Error in partner_approve: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the worker serves requests, with the LLM provider's health in the body.
+
+    A provider outage does not fail the probe; replies then fall back to errors or simulated
+    responses, and restarting the worker would not help.
+    """
+    report = provider_health.report() if LLM_ENABLED else {"status": "disabled"}
+    return jsonify({"ready": True, "provider": report, "provider_ready": not use_openai() or provider_health.ready})
+
+@app.route('/prompts/stats')
+def prompt_stats():
+    """Report prompt tokens per role and the share repeating the previous prompt's prefix."""
+    return jsonify(prompt_prefixes.stats())
+
+@app.route('/router/stats')
+def router_stats():
+    """Report representor turns, latency, tokens and cost per model route."""
+    return jsonify(model_router.stats())
+
+@app.route('/metrics')
+def metrics():
+    """Report stage latencies, LLM tokens and requests in flight in the Prometheus text format."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
 @app.route('/conversation/history', methods=['GET'])
 def get_conversation_history():
-    return jsonify(conversation_history)
+    """Return history, or only turns after ?since=<cursor>, at most ?limit=<n> of them."""
+    session = get_session(request.args)
+    if session is None:
+        return jsonify({"error": "Invalid session id"}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    since = request.args.get('since')
+    try:
+        etag = session.etag(since, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # The client already has this exact page, so skip serializing entirely
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        with stage("serialization"):
+            body = session.history_page(since, limit)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
@@ -199,6 +349,6 @@ if __name__ == '__main__':
     debug = os.getenv('DEBUG', 'True').lower() == 'true'
     
     logger.info(f"Starting server on {host}:{port}")
-    logger.info(f"OpenAI API {'enabled' if USE_OPENAI else 'disabled (using simulated responses)'}")
+    logger.info(f"OpenAI API {'enabled' if LLM_ENABLED else 'disabled (using simulated responses)'}")
     
     app.run(host=host, port=port, debug=debug) 
\ No newline at end of file
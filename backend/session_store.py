@@ -0,0 +1,389 @@
+"""Session-keyed conversation storage shared by the therapy servers."""
+import heapq
+import itertools
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from context_window import stable_window
+from persistence import PersistenceBackend
+
+DEFAULT_SESSION_ID = "default"
+MAX_SESSION_ID_LENGTH = 128
+
+# Participants in every session (partners 1..N); more than 2 hosts group or family sessions
+PARTICIPANT_IDS = tuple(range(1, int(os.getenv("SESSION_PARTICIPANTS", "2")) + 1))
+# Most recent turns held per history; the token budget decides how many reach the prompt
+MAX_WINDOW_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "40"))
+# Share of the token budget freed when the prompt window overflows, so the turns after it
+# keep the prompt's prefix unchanged; 0 slides the window one turn at a time
+WINDOW_SLACK = float(os.getenv("CONTEXT_WINDOW_SLACK", "0.3"))
+# How many turns of each history are kept once they fall out of the recent window
+ARCHIVE_LIMIT = int(os.getenv("SESSION_ARCHIVE_LIMIT", "200"))
+# Seconds a session may sit untouched before it is evicted
+IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "3600"))
+# Hard cap on concurrently held sessions; the least recently used go first
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+# With a shared backend, least time between checks for turns other workers added to a session
+REFRESH_INTERVAL = float(os.getenv("SESSION_REFRESH_MS", "0")) / 1000
+
+
+class StoredMessage:
+    """A single conversation turn kept in compact form."""
+
+    __slots__ = ("role", "content", "seq", "tokens", "json")
+
+    def __init__(self, role, content, seq=0):
+        self.role = role
+        self.content = content
+        # Position of the turn within its session, across all histories
+        self.seq = seq
+        # Prompt cost, counted on first use and then cached
+        self.tokens = None
+        # Serialized form for the history endpoint, built once on first use
+        self.json = None
+
+    def as_dict(self):
+        return {"role": self.role, "content": self.content}
+
+    def to_json(self):
+        if self.json is None:
+            self.json = json.dumps({"seq": self.seq, "role": self.role, "content": self.content})
+        return self.json
+
+
+class Sequence:
+    """Message numbering shared by all histories of one session."""
+
+    __slots__ = ("last", "_counter")
+
+    def __init__(self):
+        self.last = 0
+        self._counter = itertools.count(1)
+
+    def next(self):
+        self.last = value = next(self._counter)
+        return value
+
+
+class History:
+    """Recent turns in a fixed-size ring buffer, older turns in a capped archive.
+
+    Both partners' approvals can write the therapist history at once on the
+    threaded servers, so every read and write holds the history's lock.
+    """
+
+    __slots__ = ("recent", "archive", "budget", "start", "total", "summary", "summarized", "log", "seq", "_lock")
+
+    def __init__(self, window, archive_limit=ARCHIVE_LIMIT, budget=None, log=None, seq=None):
+        self.recent = deque(maxlen=window)
+        self.archive = deque(maxlen=archive_limit)
+        # Token budget for the prompt window; None sends every recent turn
+        self.budget = budget
+        # Number of the first turn in the prompt window, which only moves when the window overflows
+        self.start = 0
+        # Number of turns ever appended
+        self.total = 0
+        # Running summary of turns that have left the prompt window, and how many it covers
+        self.summary = ""
+        self.summarized = 0
+        # Called with (role, content) for every new turn so it can be persisted
+        self.log = log
+        self.seq = seq or Sequence()
+        # Reentrant, as pending_summary() reads the window
+        self._lock = threading.RLock()
+
+    def append(self, role, content):
+        with self._lock:
+            # Logged under the lock so turns are persisted in the order they are numbered
+            message = self.restore(role, content)
+            if self.log is not None:
+                self.log(role, content)
+            return message
+
+    def restore(self, role, content):
+        """Add a turn that is already persisted (replayed, or written by another worker)."""
+        with self._lock:
+            # Move the oldest recent turn to the archive before the ring overwrites it
+            if len(self.recent) == self.recent.maxlen:
+                self.archive.append(self.recent[0])
+            message = StoredMessage(role, content, self.seq.next())
+            self.recent.append(message)
+            self.total += 1
+            return message
+
+    def _window(self):
+        with self._lock:
+            if self.budget is None:
+                return list(self.recent)
+            window = self._fit(self.recent)
+            if window:
+                self.start = window[0].seq
+            return window
+
+    def _fit(self, turns):
+        return stable_window(turns, self.start, self.budget, self.budget * (1 - WINDOW_SLACK))
+
+    def window(self):
+        """Return the most recent turns that fit the token budget as API-ready message dicts."""
+        return [message.as_dict() for message in self._window()]
+
+    def preview(self, role, content):
+        """Return window() as it would be after appending this turn, without storing it."""
+        with self._lock:
+            keep = len(self.recent) if self.recent.maxlen is None else self.recent.maxlen - 1
+            turns = list(self.recent)[max(0, len(self.recent) - keep):] if keep > 0 else []
+            turns.append(StoredMessage(role, content, self.seq.last + 1))
+            selected = turns if self.budget is None else self._fit(turns)
+        return [message.as_dict() for message in selected]
+
+    def pending_summary(self):
+        """Return turns that have left the prompt window but are not yet in the summary.
+
+        Also returns the turn count the summary will cover once they are folded in.
+        """
+        with self._lock:
+            upto = self.total - len(self._window())
+            retained = list(self.archive) + list(self.recent)
+            first = self.total - len(retained)
+        start = max(self.summarized, first)
+        return [message.as_dict() for message in retained[start - first:upto - first]], upto
+
+    def set_summary(self, summary, upto):
+        """Replace the running summary with one covering the first upto turns."""
+        with self._lock:
+            self.summary = summary
+            self.summarized = max(self.summarized, upto)
+
+    def all(self):
+        """Return every retained turn, archived ones first."""
+        with self._lock:
+            return [message.as_dict() for message in self.archive] + [message.as_dict() for message in self.recent]
+
+    def since(self, seq):
+        """Return retained turns numbered after seq, oldest first, touching only those turns."""
+        newer = []
+        with self._lock:
+            for message in itertools.chain(reversed(self.recent), reversed(self.archive)):
+                if message.seq <= seq:
+                    break
+                newer.append(message)
+        newer.reverse()
+        return newer
+
+    def __len__(self):
+        with self._lock:
+            return len(self.archive) + len(self.recent)
+
+
+class Session:
+    """Partner histories plus the shared therapist history for one couple."""
+
+    __slots__ = ("session_id", "partners", "therapist", "last_seen", "cursor", "seq", "epoch", "refreshed",
+                 "refresh_lock")
+
+    def __init__(self, session_id, partner_ids, partner_window, therapist_window, archive_limit,
+                 partner_budget=None, therapist_budget=None, backend=None):
+        self.session_id = session_id
+        self.seq = Sequence()
+        # Distinguishes this instance from earlier ones (before eviction) or other workers,
+        # whose message numbering differs
+        self.epoch = secrets.token_hex(4)
+        self.partners = {
+            partner_id: History(partner_window, archive_limit, partner_budget,
+                                _logger(backend, session_id, f"partner{partner_id}"), self.seq)
+            for partner_id in partner_ids
+        }
+        self.therapist = History(therapist_window, archive_limit, therapist_budget,
+                                 _logger(backend, session_id, "therapist"), self.seq)
+        self.last_seen = time.monotonic()
+        # Id of the last persisted turn this worker has seen, and when it last looked for newer ones
+        self.cursor = 0
+        self.refreshed = self.last_seen
+        self.refresh_lock = threading.Lock()
+
+    def partner(self, partner_id):
+        """Return the history for a partner, raising KeyError for unknown ids."""
+        return self.partners[partner_id]
+
+    def channel(self, name):
+        """Return the history stored under a persistence channel name, or None."""
+        if name == "therapist":
+            return self.therapist
+        if name.startswith("partner") and name[7:].isdigit():
+            return self.partners.get(int(name[7:]))
+        return None
+
+    def channels(self):
+        """Yield (channel name, history) pairs."""
+        for partner_id, history in self.partners.items():
+            yield f"partner{partner_id}", history
+        yield "therapist", self.therapist
+
+    def etag(self, cursor=None, limit=None):
+        """Entity tag for history_page(cursor, limit), which changes whenever a turn is added.
+
+        The page requested is part of the tag, so following the returned cursor
+        with the previous page's tag still fetches the next page.
+        """
+        since, reset = self.parse_cursor(cursor)
+        return f"{self.epoch}-{self.seq.last}-{since}{'r' if reset else ''}-{limit or ''}"
+
+    def cursor_for(self, seq):
+        """Return the cursor clients pass back to resume after the turn numbered seq."""
+        return f"{self.epoch}:{seq}"
+
+    def parse_cursor(self, cursor):
+        """Return (seq, reset) for a cursor from cursor_for.
+
+        A cursor issued by another instance of the session (before eviction,
+        or by another worker) numbers turns differently, so it resumes from
+        the beginning with reset set.
+        """
+        if not cursor:
+            return 0, False
+        epoch, _, seq = str(cursor).rpartition(":")
+        if not seq.isdigit():
+            raise ValueError("Invalid history cursor")
+        if not epoch or epoch == self.epoch:
+            return int(seq), False
+        return 0, True
+
+    def history_page(self, cursor=None, limit=None):
+        """Serialize turns added after a cursor as JSON, at most limit of them."""
+        since, reset = self.parse_cursor(cursor)
+        pages = [(name, history.since(since)) for name, history in self.channels()]
+        has_more = False
+        if limit is not None:
+            newest = list(itertools.islice(heapq.merge(*(page for _, page in pages), key=lambda m: m.seq), limit + 1))
+            if len(newest) > limit:
+                has_more = True
+                cutoff = newest[limit - 1].seq if limit else since
+                pages = [(name, [m for m in page if m.seq <= cutoff]) for name, page in pages]
+        last = max((page[-1].seq for _, page in pages if page), default=since)
+        parts = [f'"{name}":[{",".join(message.to_json() for message in page)}]' for name, page in pages]
+        parts.append(f'"cursor":"{self.cursor_for(last)}"')
+        parts.append(f'"has_more":{"true" if has_more else "false"}')
+        if reset:
+            parts.append('"reset":true')
+        return "{" + ",".join(parts) + "}"
+
+
+class SessionStore:
+    """Thread-safe map of session id to Session with idle and LRU eviction.
+
+    Prompt windows are bounded by the per-role token budgets; the window sizes
+    only cap how many recent turns are held in the ring buffers.
+    """
+
+    def __init__(self, partner_budget=None, therapist_budget=None, partner_window=MAX_WINDOW_MESSAGES,
+                 therapist_window=MAX_WINDOW_MESSAGES, partner_ids=PARTICIPANT_IDS,
+                 archive_limit=ARCHIVE_LIMIT, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS,
+                 backend=None, refresh_interval=REFRESH_INTERVAL):
+        self.partner_budget = partner_budget
+        self.therapist_budget = therapist_budget
+        self.partner_window = partner_window
+        self.therapist_window = therapist_window
+        self.partner_ids = tuple(partner_ids)
+        self.archive_limit = archive_limit
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.backend = backend or PersistenceBackend()
+        self.refresh_interval = refresh_interval
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id=DEFAULT_SESSION_ID):
+        """Return the session for an id, creating (or replaying) it on first use.
+
+        With a shared backend this reads the backend, so async callers should
+        run it in a worker thread.
+        """
+        session_id = normalize_session_id(session_id)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._load(session_id)
+                self._sessions[session_id] = session
+                fresh = True
+            else:
+                self._sessions.move_to_end(session_id)
+                fresh = False
+            session.last_seen = now
+            self._evict(now)
+        if self.backend.shared and not fresh:
+            self._refresh(session)
+        return session
+
+    def _load(self, session_id):
+        session = Session(session_id, self.partner_ids, self.partner_window,
+                          self.therapist_window, self.archive_limit,
+                          self.partner_budget, self.therapist_budget, self.backend)
+        # Replay only the hot window of each history; older turns stay on disk
+        limits = {name: history.recent.maxlen for name, history in session.channels()}
+        turns, session.cursor = self.backend.load(session_id, limits)
+        for name, rows in turns.items():
+            history = session.channel(name)
+            if history is not None:
+                for role, content in rows:
+                    history.restore(role, content)
+        return session
+
+    def _refresh(self, session):
+        # Pick up turns written to this session by other workers; this holds only the
+        # session's own lock, so lookups of other sessions do not wait for the query
+        with session.refresh_lock:
+            if time.monotonic() - session.refreshed < self.refresh_interval:
+                return
+            turns, session.cursor = self.backend.fetch_since(session.session_id, session.cursor)
+            session.refreshed = time.monotonic()
+            for name, role, content in turns:
+                history = session.channel(name)
+                if history is not None:
+                    history.restore(role, content)
+
+    def close(self):
+        """Flush and close the persistence backend."""
+        self.backend.close()
+
+    def evict_idle(self):
+        """Drop sessions that have been idle longer than the timeout."""
+        with self._lock:
+            return self._evict(time.monotonic())
+
+    def _evict(self, now):
+        # Sessions are kept in access order, so idle ones are always at the front
+        evicted = 0
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session.last_seen < self.idle_timeout:
+                break
+            del self._sessions[session_id]
+            evicted += 1
+        return evicted
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+
+def _logger(backend, session_id, channel):
+    if backend is None:
+        return None
+    return lambda role, content: backend.append(session_id, channel, role, content)
+
+
+def normalize_session_id(session_id):
+    """Validate a client supplied session id, falling back to the default session."""
+    if not session_id:
+        return DEFAULT_SESSION_ID
+    session_id = str(session_id).strip()
+    if not session_id or len(session_id) > MAX_SESSION_ID_LENGTH:
+        raise ValueError("Invalid session id")
+    return session_id
@@ -0,0 +1,192 @@
+"""Transcription of speech while it is still being recorded.
+
+Audio arrives as 16-bit PCM in small frames and is kept in a fixed-size ring
+buffer at 16 kHz. Whenever the speaker pauses (or a segment grows too long)
+the segment so far is trimmed and sent for transcription, while recording
+goes on, so by the time the partner stops talking most of what they said is
+already transcribed. Needs NumPy, like the rest of audio_prep.
+"""
+import asyncio
+import os
+from collections import deque
+
+from audio_prep import (FRAME_MS, FRAME_SAMPLES, SAMPLE_RATE, VAD_PAD_MS, Resampler, frame_levels, np,
+                        speech_threshold, to_wav, trim_silence)
+
+# Seconds of the most recent audio held per stream
+STREAM_BUFFER_SECONDS = float(os.getenv("STREAM_BUFFER_SECONDS", "30"))
+# A pause this long ends a segment and sends it for transcription
+STREAM_SEGMENT_PAUSE_MS = int(os.getenv("STREAM_SEGMENT_PAUSE_MS", "500"))
+# Segments are not cut at pauses before they are this long, to give Whisper some context
+STREAM_MIN_SEGMENT_SECONDS = float(os.getenv("STREAM_MIN_SEGMENT_SECONDS", "2"))
+# Segments without a pause are cut at their quietest recent frame once they are this long
+STREAM_MAX_SEGMENT_SECONDS = float(os.getenv("STREAM_MAX_SEGMENT_SECONDS", "20"))
+# Longest recording one stream accepts; it is transcribed as if it ended there
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "600"))
+
+# Recent frames that the noise floor is estimated from
+NOISE_WINDOW_FRAMES = 10000 // FRAME_MS
+# How far back from a too-long segment's end to look for a quiet place to cut
+CUT_SEARCH_FRAMES = 1000 // FRAME_MS
+
+
+class PCMRingBuffer:
+    """The most recent capacity samples, addressed by their position in the whole stream."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, np.float32)
+        # Samples ever written
+        self.end = 0
+
+    @property
+    def start(self):
+        """Position of the oldest sample still held."""
+        return max(0, self.end - self.capacity)
+
+    def write(self, samples):
+        if len(samples) > self.capacity:
+            self.end += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        index = self.end % self.capacity
+        first = min(len(samples), self.capacity - index)
+        self._data[index:index + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+
+    def read(self, start, end):
+        """Return a copy of the samples from position start up to end."""
+        if start < self.start:
+            raise ValueError("Samples have already been overwritten")
+        return self._data[np.arange(start, end) % self.capacity]
+
+
+class StreamTranscriber:
+    """Segments one recording at its pauses and transcribes the segments as they end.
+
+    transcribe(wav_bytes) is a coroutine returning a segment's text, and
+    on_partial(text) is awaited with the transcript so far each time another
+    segment is done, in order. Segments are transcribed concurrently.
+    """
+
+    def __init__(self, transcribe, on_partial=None, rate=SAMPLE_RATE, buffer_seconds=STREAM_BUFFER_SECONDS,
+                 pause_ms=STREAM_SEGMENT_PAUSE_MS, min_segment_seconds=STREAM_MIN_SEGMENT_SECONDS,
+                 max_segment_seconds=STREAM_MAX_SEGMENT_SECONDS):
+        if np is None:
+            raise RuntimeError("Streaming transcription needs numpy")
+        self.transcribe = transcribe
+        self.on_partial = on_partial
+        self.rate = rate
+        self.resampler = Resampler(rate)
+        self.buffer = PCMRingBuffer(int(max(buffer_seconds, 2) * SAMPLE_RATE))
+        self.pause = pause_ms // FRAME_MS * FRAME_SAMPLES
+        self.pad = VAD_PAD_MS // FRAME_MS * FRAME_SAMPLES
+        self.min_segment = int(min_segment_seconds * SAMPLE_RATE)
+        # A segment must still be in the buffer when it is cut
+        self.max_segment = min(int(max_segment_seconds * SAMPLE_RATE), self.buffer.capacity - SAMPLE_RATE)
+        # Stream positions of the current segment's start, the end of its last speech, and of VAD so far
+        self.segment_start = 0
+        self.speech_end = None
+        self.analyzed = 0
+        self.levels = deque(maxlen=NOISE_WINDOW_FRAMES)
+        self._segment_levels = []
+        # An odd trailing byte, completed by the next frame
+        self._pending = b""
+        self.texts = []
+        self._tasks = []
+
+    @property
+    def duration(self):
+        """Seconds of audio received."""
+        return self.buffer.end / SAMPLE_RATE
+
+    @property
+    def text(self):
+        return " ".join(self.texts)
+
+    async def feed(self, data):
+        """Add 16-bit little-endian mono PCM, starting transcription of any segments it ends.
+
+        The resampling and VAD run in a worker thread, one call at a time, so
+        they do not hold up the event loop.
+        """
+        for wav in await asyncio.get_running_loop().run_in_executor(None, self._analyze, data):
+            self._start(wav)
+
+    async def finish(self):
+        """Transcribe what is left and return the whole transcript."""
+        if self.speech_end is not None:
+            wav = await asyncio.get_running_loop().run_in_executor(None, self._finalize, self.buffer.end)
+            if wav is not None:
+                self._start(wav)
+        if self._tasks:
+            await self._tasks[-1]
+        return self.text
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def _analyze(self, data):
+        """Buffer and analyze PCM bytes; returns the WAV of each segment they end."""
+        data = self._pending + data
+        usable = len(data) // 2 * 2
+        self._pending = data[usable:]
+        samples = self.resampler.process(np.frombuffer(data[:usable], "<i2").astype(np.float32) / 32768)
+        segments = []
+        # Analyze at most a second at a time so nothing is overwritten before it is looked at
+        for offset in range(0, len(samples), SAMPLE_RATE):
+            self.buffer.write(samples[offset:offset + SAMPLE_RATE])
+            self._detect(segments)
+        return [wav for wav in segments if wav is not None]
+
+    def _detect(self, segments):
+        frames = (self.buffer.end - self.analyzed) // FRAME_SAMPLES
+        if not frames:
+            return
+        levels = frame_levels(self.buffer.read(self.analyzed, self.analyzed + frames * FRAME_SAMPLES))
+        self.levels.extend(levels)
+        bar = speech_threshold(np.array(self.levels))
+        for level in levels:
+            self.analyzed += FRAME_SAMPLES
+            self._segment_levels.append(level)
+            if level > bar:
+                self.speech_end = self.analyzed
+            if self.speech_end is None:
+                # Nothing said yet; keep only the lead-in
+                start = max(self.segment_start, self.analyzed - self.pad)
+                del self._segment_levels[:(start - self.segment_start) // FRAME_SAMPLES]
+                self.segment_start = start
+            elif self.analyzed - self.speech_end >= self.pause and \
+                    self.analyzed - self.segment_start >= self.min_segment:
+                segments.append(self._finalize(self.analyzed))
+            elif self.analyzed - self.segment_start >= self.max_segment:
+                recent = self._segment_levels[-CUT_SEARCH_FRAMES:]
+                # Frames after the quietest one stay for the next segment
+                after = len(recent) - 1 - int(np.argmin(recent))
+                segments.append(self._finalize(self.analyzed - after * FRAME_SAMPLES))
+
+    def _finalize(self, end):
+        """End the segment at end; returns its trimmed WAV, or None if it holds no speech."""
+        samples = self.buffer.read(self.segment_start, end)
+        kept = (self.analyzed - end) // FRAME_SAMPLES
+        self._segment_levels = self._segment_levels[len(self._segment_levels) - kept:] if kept else []
+        self.segment_start = end
+        if self.speech_end is not None and self.speech_end <= end:
+            self.speech_end = None
+        speech, _ = trim_silence(samples)
+        return to_wav(speech) if len(speech) else None
+
+    def _start(self, wav):
+        previous = self._tasks[-1] if self._tasks else None
+        self._tasks.append(asyncio.ensure_future(self._transcribe(wav, previous)))
+
+    async def _transcribe(self, wav, previous):
+        text = (await self.transcribe(wav)).strip()
+        # Report segments in the order they were spoken
+        if previous is not None:
+            await previous
+        if text:
+            self.texts.append(text)
+        if self.on_partial is not None:
+            await self.on_partial(self.text)
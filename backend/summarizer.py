@@ -0,0 +1,72 @@
+"""Background folding of old therapist turns into a running session summary.
+
+The summary sits near the start of the therapist prompt, so new notes are
+appended to it rather than rewriting it, and the prompt prefix up to the
+previous notes stays the same for provider-side caching. Only when the
+notes outgrow SUMMARY_COMPACT_TOKENS are they condensed in one rewrite.
+"""
+import logging
+import os
+
+from context_window import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-3.5-turbo")
+# Upper bound on each batch of notes, and on the summary when it is condensed
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+# Notes longer than this are condensed into one rewrite, which keeps their prompt and memory cost bounded
+SUMMARY_COMPACT_TOKENS = int(os.getenv("SUMMARY_COMPACT_TOKENS", "1200"))
+# Turns to collect outside the prompt window before paying for a summary call
+SUMMARY_BATCH = int(os.getenv("SUMMARY_BATCH", "4"))
+
+SUMMARY_PROMPT = """
+You maintain the running notes of a couples therapy session. {task}
+Keep each partner's key concerns, underlying needs, agreements, open questions and homework.
+Write compact prose, attribute points to {partners}, and drop pleasantries and repetition.
+"""
+APPEND_TASK = "Write notes on the new turns only; they are added after the existing notes, so do not repeat those."
+CONDENSE_TASK = "Rewrite the existing notes and the new turns as one shorter summary."
+
+
+def summary_prompt(partner_ids, condense=False):
+    """The summarizer's system prompt for a session with these participants."""
+    names = [f"Partner {partner_id}" for partner_id in partner_ids]
+    partners = " or ".join(names) if len(names) <= 2 else f"{', '.join(names[:-1])} or {names[-1]}"
+    return SUMMARY_PROMPT.format(task=CONDENSE_TASK if condense else APPEND_TASK, partners=partners)
+
+
+class SessionSummarizer:
+    """Folds turns that fell out of a history's prompt window into its summary."""
+
+    def __init__(self, complete, model=SUMMARY_MODEL, max_tokens=SUMMARY_MAX_TOKENS, batch=SUMMARY_BATCH,
+                 compact_tokens=SUMMARY_COMPACT_TOKENS):
+        # complete(model, messages, max_tokens) is a coroutine returning the completion text
+        self.complete = complete
+        self.model = model
+        self.max_tokens = max_tokens
+        self.batch = batch
+        self.compact_tokens = compact_tokens
+        self._running = set()
+
+    async def fold(self, history, partner_ids=(1, 2)):
+        """Summarize pending turns of a history; meant to run off the request path."""
+        turns, upto = history.pending_summary()
+        if len(turns) < self.batch or id(history) in self._running:
+            return
+        self._running.add(id(history))
+        try:
+            transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+            existing = history.summary
+            condense = count_tokens(existing) > self.compact_tokens
+            messages = [
+                {"role": "system", "content": summary_prompt(partner_ids, condense)},
+                {"role": "user", "content": f"Existing notes:\n{existing or '(none)'}\n\nNew turns:\n{transcript}"}
+            ]
+            notes = (await self.complete(self.model, messages, self.max_tokens)).strip()
+            history.set_summary(notes if condense or not existing else f"{existing}\n{notes}", upto)
+        except Exception as e:
+            # The turns stay pending and are retried with the next batch
+            logger.error(f"Error summarizing session: {e}")
+        finally:
+            self._running.discard(id(history))
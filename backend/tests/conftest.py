@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The servers read their settings at import; run them against the local stand-in provider
+os.environ.update(LLM_PROVIDER="mock", MOCK_LATENCY_MS="0", MOCK_TOKENS_PER_SECOND="100000", MOCK_ERROR_RATE="0",
+                  SESSION_BACKEND="memory")
+
+# The backend modules are imported by name, as the servers do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+import io
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from audio_prep import (FRAME_SAMPLES, SAMPLE_RATE, Resampler, prepare_audio, read_wav, split, to_wav,  # noqa: E402
+                        trim_silence)
+
+
+def tone(seconds, rate=SAMPLE_RATE, amplitude=0.3):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def silence(seconds, rate=SAMPLE_RATE):
+    return np.zeros(int(seconds * rate), np.float32)
+
+
+def wav_file(samples, rate, channels=1):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        pcm = np.repeat(samples, channels) if channels > 1 else samples
+        wav.writeframes((pcm * 32767).astype("<i2").tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+def test_resampler_output_does_not_depend_on_block_size():
+    signal = np.random.default_rng(0).uniform(-1, 1, 44100).astype(np.float32)
+    whole = Resampler(44100).process(signal)
+    resampler = Resampler(44100)
+    blocks = np.concatenate([resampler.process(signal[i:i + 777]) for i in range(0, len(signal), 777)])
+    assert len(whole) == len(blocks) == SAMPLE_RATE
+    assert np.array_equal(whole, blocks)
+
+
+def test_trim_silence_drops_leading_and_trailing_silence():
+    samples = np.concatenate([silence(2), tone(1), silence(2)])
+    speech, levels = trim_silence(samples)
+    assert 1 <= len(speech) / SAMPLE_RATE < 1.5
+    assert len(levels) == len(speech) // FRAME_SAMPLES
+
+
+def test_trim_silence_of_silence_is_empty():
+    speech, _ = trim_silence(silence(1))
+    assert len(speech) == 0
+
+
+def test_split_keeps_every_sample():
+    samples = tone(10)
+    speech, levels = trim_silence(samples)
+    chunks = split(speech, levels, chunk_seconds=3)
+    assert len(chunks) > 1
+    assert sum(len(chunk) for chunk in chunks) == len(speech)
+
+
+def test_read_wav_downmixes_and_resamples():
+    samples, duration = read_wav(wav_file(tone(2, 48000), 48000, channels=2))
+    assert samples.dtype == np.int16
+    assert duration == 2
+    assert abs(len(samples) - 2 * SAMPLE_RATE) <= 1
+
+
+def test_read_wav_skips_long_recordings():
+    assert read_wav(wav_file(silence(2), 8000), max_seconds=1) is None
+
+
+def test_prepare_audio():
+    audio = wav_file(np.concatenate([silence(1, 22050), tone(1, 22050), silence(1, 22050)]), 22050)
+    prepared = prepare_audio(audio)
+    assert audio.tell() == 0
+    assert len(prepared.chunks) == 1 and prepared.original_duration == 3
+    assert prepared.duration < 2
+    with wave.open(io.BytesIO(prepared.chunks[0])) as wav:
+        assert wav.getframerate() == SAMPLE_RATE
+    assert prepare_audio(io.BytesIO(b"OggS" + bytes(100))) is None
+
+
+def test_quiet_recordings_are_sent_unchanged():
+    assert prepare_audio(wav_file(tone(2, amplitude=0.003), SAMPLE_RATE)) is None
+
+
+def test_to_wav_accepts_float_and_int16():
+    samples = tone(0.1)
+    assert to_wav(samples) == to_wav((samples * 32767).astype(np.int16))
@@ -0,0 +1,37 @@
+from context_window import fit_to_budget, stable_window
+from session_store import StoredMessage
+
+
+def turns(count, tokens=10):
+    messages = []
+    for seq in range(1, count + 1):
+        message = StoredMessage("user", f"turn {seq}", seq)
+        message.tokens = tokens
+        messages.append(message)
+    return messages
+
+
+def seqs(messages):
+    return [message.seq for message in messages]
+
+
+def test_fit_to_budget_keeps_newest_turns():
+    assert seqs(fit_to_budget(turns(5), 30)) == [3, 4, 5]
+    # The turn being answered is kept even when it alone is over budget
+    assert seqs(fit_to_budget(turns(2, tokens=50), 30)) == [2]
+
+
+def test_window_only_grows_while_it_fits():
+    messages = turns(4)
+    assert seqs(stable_window(messages, 1, 40, 20)) == [1, 2, 3, 4]
+    assert seqs(stable_window(messages[1:], 1, 40, 20)) == [2, 3, 4]
+
+
+def test_overflow_restarts_from_refill_budget():
+    messages = turns(5)
+    window = stable_window(messages, 1, 40, 20)
+    assert seqs(window) == [4, 5]
+    # Later turns are appended to the new window instead of sliding it
+    assert seqs(stable_window(turns(6), window[0].seq, 40, 20)) == [4, 5, 6]
+    assert seqs(stable_window(turns(7), window[0].seq, 40, 20)) == [4, 5, 6, 7]
+    assert seqs(stable_window(turns(8), window[0].seq, 40, 20)) == [7, 8]
@@ -0,0 +1,73 @@
+import asyncio
+
+from drafts import DraftSpeculator
+
+MESSAGES = [{"role": "system", "content": "rewrite"}]
+
+
+def test_submitted_text_takes_the_draft():
+    calls = []
+
+    async def generate(key, text, messages):
+        calls.append(text)
+        return text.upper()
+
+    async def run():
+        speculator = DraftSpeculator(generate, min_chars=3)
+        assert speculator.submit("p1", "hello there", MESSAGES) == "started"
+        assert speculator.submit("p1", "hello there", MESSAGES) == "unchanged"
+        task = speculator.take("p1", "hello there", MESSAGES)
+        assert await task == "HELLO THERE"
+        return speculator.stats()
+
+    assert asyncio.run(run()) == {"started": 1, "used": 1, "pending": 0}
+    assert calls == ["hello there"]
+
+
+def test_short_text_is_not_drafted():
+    async def generate(key, text, messages):
+        return text
+
+    async def run():
+        speculator = DraftSpeculator(generate, min_chars=12)
+        assert speculator.submit("p1", "hi", MESSAGES) == "ignored"
+        assert speculator.take("p1", "hi", MESSAGES) is None
+
+    asyncio.run(run())
+
+
+def test_new_text_cancels_the_stale_draft():
+    release = None
+
+    async def generate(key, text, messages):
+        await release.wait()
+        return text
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        speculator = DraftSpeculator(generate, min_chars=3)
+        speculator.submit("p1", "I feel ignor", MESSAGES)
+        first = speculator._drafts["p1"].task
+        speculator.submit("p1", "I feel ignored", MESSAGES)
+        await asyncio.sleep(0)
+        assert first.cancelled()
+        # Different text or a different prompt is a miss, not the stale draft
+        assert speculator.take("p1", "I feel ignored", MESSAGES + MESSAGES) is None
+        return speculator.stats()
+
+    assert asyncio.run(run()) == {"started": 2, "cancelled": 1, "missed": 1, "pending": 0}
+
+
+def test_unused_drafts_expire():
+    async def generate(key, text, messages):
+        return text
+
+    async def run():
+        speculator = DraftSpeculator(generate, min_chars=3, ttl=0)
+        speculator.submit("p1", "first draft", MESSAGES)
+        await asyncio.sleep(0)
+        speculator.submit("p2", "second draft", MESSAGES)
+        return speculator.stats()
+
+    assert asyncio.run(run()) == {"started": 2, "expired": 1, "pending": 1}
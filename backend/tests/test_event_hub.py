@@ -0,0 +1,49 @@
+import asyncio
+
+from event_hub import EventHub
+
+
+def test_events_fan_out_to_every_subscriber_of_the_session():
+    async def run():
+        hub = EventHub(heartbeat=5)
+        first = hub.stream("s", backlog=lambda: ["missed\n\n"])
+        second = hub.stream("s")
+        other = hub.subscribe("t")
+        # Start both streams so their subscriptions are in place
+        assert await first.__anext__() == "missed\n\n"
+        pending = asyncio.ensure_future(second.__anext__())
+        await asyncio.sleep(0)
+        hub.publish("s", "data: 1\n\n")
+        assert await first.__anext__() == "data: 1\n\n"
+        assert await pending == "data: 1\n\n"
+        assert other.empty()
+        assert hub.stats() == {"sessions": 2, "subscribers": 3, "published": 1, "dropped": 0}
+        await first.aclose()
+        await second.aclose()
+        return hub.stats()
+
+    assert asyncio.run(run())["subscribers"] == 1
+
+
+def test_idle_stream_sends_keep_alive():
+    async def run():
+        hub = EventHub(heartbeat=0.01)
+        stream = hub.stream("s")
+        frame = await stream.__anext__()
+        await stream.aclose()
+        return frame, hub.stats()["subscribers"]
+
+    assert asyncio.run(run()) == (": keep-alive\n\n", 0)
+
+
+def test_slow_subscriber_is_disconnected():
+    async def run():
+        hub = EventHub(queue_size=2, heartbeat=5)
+        slow = hub.subscribe("s")
+        for number in range(3):
+            hub.publish("s", f"data: {number}\n\n")
+        return slow.get_nowait(), slow.empty(), hub.stats()
+
+    frame, empty, stats = asyncio.run(run())
+    assert frame is None and empty
+    assert stats == {"sessions": 0, "subscribers": 0, "published": 3, "dropped": 1}
@@ -0,0 +1,44 @@
+from health import ProviderHealth
+from llm_client import OpenAIError
+
+
+class FlakyProvider:
+    def __init__(self):
+        self.error = None
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+
+def test_provider_is_created_lazily_once():
+    created = []
+
+    def create():
+        created.append(1)
+        return FlakyProvider()
+
+    health = ProviderHealth(create, interval=0)
+    assert created == [] and health.report()["status"] == "starting"
+    assert health.provider is health.provider
+    assert created == [1]
+
+
+def test_check_tracks_outages_and_recovery():
+    provider = FlakyProvider()
+    health = ProviderHealth(lambda: provider, interval=0)
+    health.check()
+    assert health.ready
+
+    provider.error = OpenAIError("OpenAI API error 500: down", 500)
+    health.check()
+    assert not health.ready
+    assert health.report()["status"] == "failing" and "down" in health.report()["error"]
+
+    provider.error = OpenAIError("OpenAI API error 401: bad key", 401)
+    health.check()
+    assert health.status == "unauthorized"
+
+    provider.error = None
+    health.check()
+    assert health.ready and health.error is None
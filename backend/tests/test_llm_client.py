@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+from llm_client import AsyncOpenAIClient, OpenAIError  # noqa: E402
+
+
+async def fake_api(handler):
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_chat_and_stream_share_the_client():
+    async def handler(request):
+        payload = await request.json()
+        if not payload.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": "hello"}}]})
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for piece in ["hel", "lo"]:
+            chunk = {"choices": [{"delta": {"content": piece}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def run():
+        server = await fake_api(handler)
+        client = AsyncOpenAIClient("key", api_base=str(server.make_url("/v1")))
+        try:
+            reply = await client.chat("gpt-4o", [])
+            session = client._session
+            deltas = [delta async for delta in client.chat_stream("gpt-4o", [])]
+            assert client._session is session
+            return reply, deltas
+        finally:
+            await client.close()
+            await server.close()
+
+    assert asyncio.run(run()) == ("hello", ["hel", "lo"])
+
+
+def test_api_errors_carry_status():
+    async def handler(request):
+        return web.json_response({"error": {"message": "Rate limit reached"}}, status=429)
+
+    async def run():
+        server = await fake_api(handler)
+        client = AsyncOpenAIClient("key", api_base=str(server.make_url("/v1")))
+        try:
+            await client.chat("gpt-4o", [])
+        finally:
+            await client.close()
+            await server.close()
+
+    with pytest.raises(OpenAIError) as error:
+        asyncio.run(run())
+    assert error.value.status == 429
+    assert "Rate limit reached" in str(error.value)
+
+
+def test_inflight_limit_holds_across_event_loops():
+    active = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return web.json_response({"choices": [{"message": {"content": "ok"}}]})
+
+    client = AsyncOpenAIClient("key", max_inflight=2)
+
+    async def run():
+        server = await fake_api(handler)
+        client.api_base = str(server.make_url("/v1"))
+        try:
+            return await asyncio.gather(*(client.chat("gpt-4o", []) for _ in range(6)))
+        finally:
+            await client.close()
+            await server.close()
+
+    # A second loop must get its own semaphore rather than one bound to the first
+    assert asyncio.run(run()) == ["ok"] * 6
+    assert asyncio.run(run()) == ["ok"] * 6
+    assert peak == 2
@@ -0,0 +1,88 @@
+import base64
+import json
+from urllib.parse import unquote
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def send(client, audio, session_id):
+    return client.post("/partner/1/text", params={"audio": audio},
+                       json={"text": "Can we talk about the weekend?", "partner_id": 1, "session_id": session_id})
+
+
+def test_base64_reply(client):
+    reply = send(client, "base64", "modes-base64").json()
+    assert reply["text"] and base64.b64decode(reply["audio_base64"])
+
+
+def test_raw_reply_sends_audio_with_text_in_headers(client):
+    response = send(client, "raw", "modes-raw")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/mpeg"
+    assert response.content
+    assert unquote(response.headers["x-response-text"])
+    assert "x-response-text-truncated" not in response.headers
+
+
+def test_url_reply_serves_audio_once_fetched(client):
+    reply = send(client, "url", "modes-url").json()
+    assert reply["text"] and reply.get("audio_base64") is None
+    audio = client.get(reply["audio_url"])
+    assert audio.status_code == 200 and audio.content
+    assert client.get("/audio/unknown").status_code == 404
+
+
+def test_text_header_is_cut_at_a_character_boundary():
+    text = "é" * 2000
+    encoded, truncated = main.text_header(text, limit=3000)
+    assert truncated and len(encoded) <= 3000
+    assert unquote(encoded) == "é" * (3000 // 6)
+    assert main.text_header("short", limit=3000) == ("short", False)
+
+
+def events(response):
+    return [json.loads(chunk[len("data: "):]) for chunk in response.read().decode().split("\n\n")
+            if chunk.startswith("data: ")]
+
+
+def test_stream_reply_sends_deltas_then_the_whole_text(client):
+    with client.stream("POST", "/partner/2/text", params={"stream": "true", "audio": "none"},
+                       json={"text": "Let us plan dinner tonight", "partner_id": 2, "session_id": "modes-stream"}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        sent = events(response)
+    deltas = [event["delta"] for event in sent if "delta" in event]
+    assert deltas and sent[-1]["done"]
+    assert "".join(deltas) == sent[-1]["text"]
+    assert main.sessions.get("modes-stream").partner(2).all()[-1]["content"] == sent[-1]["text"]
+
+
+def test_oversized_upload_is_refused_before_it_is_read(client):
+    response = client.post("/partner/1/audio", files={"file": ("a.wav", b"x" * 1024)},
+                           headers={"Content-Length": str(main.MAX_AUDIO_UPLOAD_BYTES * 2)})
+    assert response.status_code == 413
+
+
+def test_upload_without_a_length_is_cut_off_at_the_limit():
+    async def app(scope, receive, send):
+        request = main.Request(scope, receive)
+        try:
+            await request.body()
+        except main.HTTPException as e:
+            await main.Response(status_code=e.status_code)(scope, receive, send)
+            return
+        await main.Response(status_code=200)(scope, receive, send)
+
+    limited = TestClient(main.UploadLimitMiddleware(app, limit=100))
+    chunks = iter([b"x" * 60, b"x" * 60])
+    headers = {"Content-Type": "multipart/form-data; boundary=b"}
+    assert limited.post("/", content=chunks, headers=headers).status_code == 413
+    assert limited.post("/", content=b"x" * 60, headers=headers).status_code == 200
@@ -0,0 +1,39 @@
+import weakref
+
+import pytest
+
+from metrics import CallbackGauge, Counter, Histogram, Registry
+import response_cache
+from response_cache import ResponseCache, hit_ratio
+
+
+def test_render_reports_counters_histograms_and_callbacks():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ("route",), registry=registry)
+    latency = Histogram("latency_seconds", "Latency", buckets=(0.1, 1), registry=registry)
+    CallbackGauge("open_streams", "Streams", lambda: 3, registry=registry)
+    requests.labels("/a").inc(2)
+    latency.labels().observe(0.5)
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{route="/a"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{le="1.0"} 1' in text
+    assert "open_streams 3" in text
+
+
+def test_a_name_is_registered_once():
+    registry = Registry()
+    CallbackGauge("ratio", "A ratio", lambda: 0, registry=registry)
+    with pytest.raises(ValueError):
+        CallbackGauge("ratio", "The same ratio again", lambda: 1, registry=registry)
+
+
+def test_response_cache_gauge_covers_every_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "_caches", weakref.WeakSet())
+    first, second = ResponseCache(enabled=True), ResponseCache(enabled=True)
+    messages = [{"role": "user", "content": "hello"}]
+    first.put("m", messages, "hi")
+    first.get("m", messages)
+    second.get("m", messages)
+    assert hit_ratio() == 0.5
@@ -0,0 +1,61 @@
+from model_router import ModelRouter
+
+
+def make_router(**kwargs):
+    return ModelRouter(fast_model="small", strong_model="large", **kwargs)
+
+
+def test_calm_turns_take_the_fast_route():
+    route = make_router().route("Could we plan a date night this week?")
+    assert (route.model, route.name, route.reason) == ("small", "fast", "calm")
+    assert route.fast
+
+
+def test_charged_long_and_risky_turns_take_the_strong_route():
+    router = make_router(max_fast_tokens=20)
+    assert router.route("You ALWAYS lie and I HATE it!!").reason == "intense"
+    assert router.route("we talked about the holidays and " * 5).reason == "long"
+    assert router.route("I feel unsafe at home").reason == "risk"
+    assert router.route("I feel unsafe at home").model == "large"
+
+
+def test_disabled_router_uses_the_static_model():
+    route = ModelRouter(fast_model="small", strong_model="large", static_model="fixed", enabled=False).route("hi")
+    assert (route.model, route.name) == ("fixed", "static")
+
+
+def test_acceptable_rejects_empty_refusals_and_truncated_replies():
+    router = make_router()
+    text = "I would really like us to talk about how we split the chores, because I feel tired lately."
+    assert router.acceptable(text, "I'd like us to talk about sharing chores; I've been feeling tired.")
+    assert not router.acceptable(text, "  ")
+    assert not router.acceptable(text, "As an AI, I can't rewrite that.")
+    assert not router.acceptable(text, "Chores.")
+    assert not router.acceptable("You never listen!", "You NEVER listen and I HATE it!!")
+
+
+def test_escalate_and_stats():
+    router = make_router()
+    router.route("hello there")
+    route = router.escalate()
+    assert (route.model, route.reason) == ("large", "quality")
+    with router.call(route, [{"role": "user", "content": "hello there"}]) as call:
+        call.completed("Hi, how are you?")
+    stats = router.stats()
+    assert stats["reasons"] == {"calm": 1, "quality": 1}
+    assert stats["routes"]["strong"]["calls"] == 1
+    assert stats["routes"]["strong"]["completion_tokens"] > 0
+
+
+def test_turns_are_only_recorded_once_committed():
+    router = make_router()
+    turn = router.turn()
+    route = turn.route("hello there")
+    with turn.call(route, [{"role": "user", "content": "hello there"}]) as call:
+        call.completed("Hi")
+    assert router.stats()["reasons"] == {}
+    assert router.stats()["routes"]["fast"]["calls"] == 0
+    turn.commit()
+    turn.commit()
+    assert router.stats()["reasons"] == {"calm": 1}
+    assert router.stats()["routes"]["fast"]["calls"] == 1
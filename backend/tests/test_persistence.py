@@ -0,0 +1,73 @@
+import pytest
+
+from persistence import PersistenceBackend, SQLiteBackend, create_backend
+from session_store import SessionStore
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def make_store(backend, **kwargs):
+    return SessionStore(partner_window=3, therapist_window=3, backend=backend, **kwargs)
+
+
+def test_replay_restores_only_the_latest_turns(db):
+    backend = SQLiteBackend(db)
+    store = make_store(backend)
+    history = store.get("s").partner(1)
+    for i in range(5):
+        history.append("user", str(i))
+    store.get("s").therapist.append("assistant", "t")
+    backend.close()
+
+    backend = SQLiteBackend(db)
+    session = make_store(backend).get("s")
+    assert [m["content"] for m in session.partner(1).all()] == ["2", "3", "4"]
+    assert [m["content"] for m in session.therapist.all()] == ["t"]
+    backend.close()
+
+
+def test_fetch_since_skips_this_workers_own_turns(db):
+    first, second = SQLiteBackend(db), SQLiteBackend(db)
+    first.append("s", "partner1", "user", "from first")
+    second.append("s", "partner1", "user", "from second")
+    first.flush()
+    second.flush()
+    turns, cursor = first.fetch_since("s", 0)
+    assert turns == [("partner1", "user", "from second")]
+    assert first.fetch_since("s", cursor) == ([], cursor)
+    first.close()
+    second.close()
+
+
+def test_workers_pick_up_each_others_turns(db):
+    first, second = make_store(SQLiteBackend(db)), make_store(SQLiteBackend(db))
+    first.get("s").partner(1).append("user", "hello")
+    second.get("s")
+    first.backend.flush()
+    second.get("s").therapist.append("assistant", "welcome")
+    second.backend.flush()
+    assert [m["content"] for m in second.get("s").partner(1).all()] == ["hello"]
+    assert [m["content"] for m in first.get("s").therapist.all()] == ["welcome"]
+    # Turns are not restored twice
+    assert len(first.get("s").therapist) == 1
+    first.close()
+    second.close()
+
+
+def test_refresh_interval_spaces_out_reads(db):
+    first, second = make_store(SQLiteBackend(db)), make_store(SQLiteBackend(db), refresh_interval=60)
+    second.get("s")
+    first.get("s").partner(2).append("user", "hi")
+    first.backend.flush()
+    assert len(second.get("s").partner(2)) == 0
+    first.close()
+    second.close()
+
+
+def test_create_backend():
+    assert type(create_backend("memory")) is PersistenceBackend
+    with pytest.raises(ValueError, match="memory, sqlite"):
+        create_backend("kv")
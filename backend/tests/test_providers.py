@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from llm_client import OpenAIError
+from providers import MockBehavior, MockProvider, MockSyncProvider
+
+MESSAGES = [{"role": "user", "content": "We keep arguing about chores."}]
+
+
+def behavior(**options):
+    return MockBehavior(**dict({"latency_dist": "fixed", "latency_ms": 0, "tokens_per_second": 0}, **options))
+
+
+def test_mock_reply_depends_only_on_the_prompt():
+    sync = MockSyncProvider(behavior())
+    reply = asyncio.run(MockProvider(behavior()).chat("gpt-4o", MESSAGES))
+    assert reply == sync.chat("gpt-4o", MESSAGES)
+    assert reply != sync.chat("gpt-4o", [{"role": "user", "content": "Something else."}])
+    assert len(sync.chat("gpt-4o", MESSAGES, max_tokens=5).split()) == 5
+
+
+def test_mock_enforces_requests_per_minute():
+    sync = MockSyncProvider(behavior(rpm=2))
+    sync.chat("gpt-4o", MESSAGES)
+    sync.chat("gpt-4o", MESSAGES)
+    with pytest.raises(OpenAIError) as error:
+        sync.chat("gpt-4o", MESSAGES)
+    assert error.value.status == 429
+
+
+def test_mock_injects_errors():
+    with pytest.raises(OpenAIError) as error:
+        MockSyncProvider(behavior(error_rate=1)).chat("gpt-4o", MESSAGES)
+    assert error.value.status == 500
+
+
+def test_lognormal_latency_keeps_the_median():
+    mock = MockBehavior(latency_dist="lognormal", latency_ms=400, latency_spread=0.5, seed=1)
+    delays = sorted(mock.first_token_delay() for _ in range(2001))
+    assert delays[1000] == pytest.approx(0.4, rel=0.1)
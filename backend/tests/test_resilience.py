@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import resilience
+from llm_client import OpenAIError
+from resilience import CircuitBreaker, CircuitOpenError, ResilientProvider, TokenBucket, error_status
+
+
+class FlakyProvider:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0)
+
+
+def chat(provider, retries=3, breaker=None):
+    resilient = ResilientProvider(provider, breaker=breaker, retries=retries)
+    return asyncio.run(resilient.chat("m", [{"role": "user", "content": "hi"}]))
+
+
+def test_server_errors_are_retried():
+    provider = FlakyProvider(OpenAIError("down", 503), OpenAIError("down", 500))
+    assert chat(provider) == "ok"
+    assert provider.calls == 3
+
+
+def test_client_errors_are_not_retried():
+    provider = FlakyProvider(OpenAIError("bad", 400))
+    with pytest.raises(OpenAIError):
+        chat(provider)
+    assert provider.calls == 1
+
+
+def test_breaker_opens_and_fails_fast():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=60)
+    provider = FlakyProvider(*[OpenAIError("down", 500)] * 2)
+    with pytest.raises(OpenAIError):
+        chat(provider, retries=1, breaker=breaker)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        chat(provider, breaker=breaker)
+    assert provider.calls == 2
+
+
+def test_half_open_breaker_admits_a_single_probe():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=0.01)
+    breaker.record_failure(OpenAIError("down", 500))
+    asyncio.run(asyncio.sleep(0.02))
+    assert breaker.state == "half-open"
+    breaker.check()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(threshold=3, reset_seconds=0.01)
+    for _ in range(3):
+        breaker.record_failure(OpenAIError("down", 500))
+    asyncio.run(asyncio.sleep(0.02))
+    breaker.check()
+    breaker.record_failure(OpenAIError("down", 502))
+    assert breaker.state == "open"
+
+
+def test_token_bucket_delay():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.delay(60, now) == 0
+    bucket.take(60)
+    assert bucket.delay(1, now) == pytest.approx(1)
+
+
+def test_error_status():
+    assert error_status(OpenAIError("limited", 429)) == (429, {})
+    assert error_status(CircuitOpenError(2.5)) == (503, {"Retry-After": "3"})
+    assert error_status(ValueError("x")) == (500, {})
@@ -0,0 +1,55 @@
+import time
+
+from response_cache import MinHasher, ResponseCache
+
+
+def prompt(text, system="Rewrite kindly"):
+    return [{"role": "system", "content": system}, {"role": "user", "content": text}]
+
+
+def test_disabled_cache_never_hits():
+    cache = ResponseCache(enabled=False)
+    cache.put("m", prompt("hello"), "reply")
+    assert cache.get("m", prompt("hello")) is None
+
+
+def test_exact_hit_ignores_case_and_whitespace():
+    cache = ResponseCache(enabled=True)
+    cache.put("m", prompt("You never  listen"), "reply", ("s", 1))
+    assert cache.get("m", prompt("you never listen "), ("s", 1)) == "reply"
+    assert cache.get("other", prompt("you never listen"), ("s", 1)) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_replies_stay_within_their_scope():
+    cache = ResponseCache(enabled=True, similarity=0.5)
+    cache.put("m", prompt("I feel ignored when you work late every night"), "reply", ("s1", 1))
+    for scope in (("s1", 2), ("s2", 1)):
+        assert cache.get("m", prompt("I feel ignored when you work late every night"), scope) is None
+        assert cache.get("m", prompt("I feel ignored when you work late every single night"), scope) is None
+
+
+def test_near_duplicate_hit_within_scope():
+    cache = ResponseCache(enabled=True, similarity=0.5)
+    cache.put("m", prompt("I feel ignored when you work late every night"), "reply", ("s", 1))
+    assert cache.get("m", prompt("I feel ignored when you work late every single night"), ("s", 1)) == "reply"
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_entries_expire_and_are_evicted():
+    cache = ResponseCache(enabled=True, ttl=0.01, max_entries=10)
+    cache.put("m", prompt("a"), "reply")
+    time.sleep(0.02)
+    assert cache.get("m", prompt("a")) is None
+    cache = ResponseCache(enabled=True, max_entries=2)
+    for text in ("a", "b", "c"):
+        cache.put("m", prompt(text), text)
+    assert cache.get("m", prompt("a")) is None
+    assert cache.get("m", prompt("c")) == "c"
+
+
+def test_minhash_similarity():
+    hasher = MinHasher()
+    same = hasher.signature("we should talk about money")
+    assert MinHasher.similarity(same, hasher.signature("We should talk about money")) == 1
+    assert MinHasher.similarity(same, hasher.signature("the dog needs a walk")) < 0.5
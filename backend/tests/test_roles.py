@@ -0,0 +1,40 @@
+from roles import PrefixTracker, RolePrompt
+
+
+def turn(content, role="user"):
+    return {"role": role, "content": content}
+
+
+def test_repeated_prefix_is_counted_in_whole_messages():
+    tracker = PrefixTracker(min_tokens=1)
+    prompt = RolePrompt("You are a careful therapist. " * 20)
+    first = prompt.messages([turn("hello")])
+    assert tracker.observe("therapist", "s", first) == 0
+    second = prompt.messages([turn("hello"), turn("hi there", "assistant")])
+    repeated = tracker.observe("therapist", "s", second)
+    assert 0 < repeated < tracker.stats()["roles"]["therapist"]["prompt_tokens"]
+    # A changed message ends the repeated prefix, leaving only the system message
+    system_only = tracker.observe("therapist", "s", prompt.messages([turn("something else")]))
+    assert 0 < system_only < repeated
+
+
+def test_stats_report_ratios_per_role_and_cacheable_prefixes():
+    tracker = PrefixTracker(min_tokens=10 ** 6)
+    messages = [turn("system text", "system"), turn("hello")]
+    tracker.observe("representor", ("s", 1), messages)
+    tracker.observe("representor", ("s", 1), messages)
+    stats = tracker.stats()
+    roles = stats["roles"]["representor"]
+    assert roles["prompts"] == 2
+    assert roles["prefix_ratio"] == 0.5
+    # Shorter than min_tokens, so none of it is served from a provider's cache
+    assert roles["cached_prefix_ratio"] == 0
+    assert stats["conversations"] == 1
+
+
+def test_only_recent_conversations_are_remembered():
+    tracker = PrefixTracker(max_conversations=2)
+    for key in ("a", "b", "c"):
+        tracker.observe("therapist", key, [turn("x")])
+    assert tracker.stats()["conversations"] == 2
+    assert tracker.observe("therapist", "a", [turn("x")]) == 0
@@ -0,0 +1,100 @@
+import json
+import threading
+
+import pytest
+
+from session_store import History, Session, SessionStore, normalize_session_id
+
+
+def make_session():
+    return Session("s", (1, 2), partner_window=4, therapist_window=4, archive_limit=10)
+
+
+def test_history_moves_overflow_to_archive():
+    history = History(window=2, archive_limit=3)
+    for i in range(6):
+        history.append("user", str(i))
+    assert [m["content"] for m in history.window()] == ["4", "5"]
+    assert [m["content"] for m in history.all()] == ["1", "2", "3", "4", "5"]
+    assert len(history) == 5
+
+
+def test_history_since_returns_newer_turns_in_order():
+    history = History(window=3, archive_limit=10)
+    for i in range(5):
+        history.append("user", str(i))
+    assert [m.seq for m in history.since(2)] == [3, 4, 5]
+    assert history.since(5) == []
+
+
+def test_preview_does_not_store_the_turn():
+    history = History(window=2)
+    history.append("user", "a")
+    history.append("assistant", "b")
+    assert [m["content"] for m in history.preview("user", "c")] == ["b", "c"]
+    assert len(history) == 2
+
+
+def test_concurrent_appends_get_unique_numbers():
+    history = History(window=50, archive_limit=10000)
+
+    def writer():
+        for _ in range(500):
+            history.append("user", "x")
+
+    threads = [threading.Thread(target=writer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seqs = [m.seq for m in history.since(0)]
+    assert len(seqs) == len(set(seqs)) == 4000
+    assert seqs == sorted(seqs)
+
+
+def test_history_page_follows_cursor_and_limit():
+    session = make_session()
+    for i in range(4):
+        session.partner(1).append("user", str(i))
+    page = json.loads(session.history_page(limit=2))
+    assert [m["seq"] for m in page["partner1"]] == [1, 2]
+    assert page["has_more"]
+    page = json.loads(session.history_page(page["cursor"], 2))
+    assert [m["seq"] for m in page["partner1"]] == [3, 4]
+    assert not page["has_more"]
+
+
+def test_etag_depends_on_page_and_new_turns():
+    session = make_session()
+    session.therapist.append("user", "hi")
+    first = session.etag()
+    assert session.etag() == first
+    assert session.etag(session.cursor_for(1)) != first
+    assert session.etag(limit=1) != first
+    session.therapist.append("assistant", "hello")
+    assert session.etag() != first
+
+
+def test_foreign_cursor_resets_and_bad_cursor_is_rejected():
+    session = make_session()
+    session.partner(2).append("user", "a")
+    page = json.loads(session.history_page("other:5"))
+    assert page["reset"] and len(page["partner2"]) == 1
+    with pytest.raises(ValueError):
+        session.etag("abc:x")
+
+
+def test_store_evicts_least_recently_used():
+    store = SessionStore(max_sessions=2)
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert "a" in store and "c" in store and "b" not in store
+
+
+def test_normalize_session_id():
+    assert normalize_session_id(None) == "default"
+    assert normalize_session_id(" abc ") == "abc"
+    with pytest.raises(ValueError):
+        normalize_session_id("x" * 200)
@@ -0,0 +1,88 @@
+import asyncio
+import io
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from audio_prep import SAMPLE_RATE  # noqa: E402
+from stream_transcriber import PCMRingBuffer, StreamTranscriber  # noqa: E402
+
+
+def tone(seconds, amplitude=0.3):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE), np.float32)
+
+
+def pcm(samples):
+    return (samples * 32767).astype("<i2").tobytes()
+
+
+def wav_seconds(wav):
+    with wave.open(io.BytesIO(wav)) as reader:
+        return reader.getnframes() / reader.getframerate()
+
+
+def test_ring_buffer_reads_across_the_wrap():
+    buffer = PCMRingBuffer(4)
+    buffer.write(np.arange(3, dtype=np.float32))
+    buffer.write(np.arange(3, 6, dtype=np.float32))
+    assert buffer.start == 2
+    assert buffer.read(2, 6).tolist() == [2, 3, 4, 5]
+    with pytest.raises(ValueError):
+        buffer.read(1, 3)
+
+
+def test_segments_are_cut_at_pauses_and_reported_in_order():
+    lengths = []
+    partials = []
+
+    async def transcribe(wav):
+        lengths.append(wav_seconds(wav))
+        number = len(lengths)
+        # The first segment finishes last; the transcript must still be in spoken order
+        await asyncio.sleep(0.05 if number == 1 else 0)
+        return f"segment{number}"
+
+    async def on_partial(text):
+        partials.append(text)
+
+    async def run():
+        transcriber = StreamTranscriber(transcribe, on_partial, min_segment_seconds=2)
+        recording = np.concatenate([silence(0.5), tone(2.5), silence(1), tone(1), silence(0.2)])
+        data = pcm(recording)
+        # Odd-sized frames, as a socket would deliver them
+        for offset in range(0, len(data), 3201):
+            await transcriber.feed(data[offset:offset + 3201])
+        cut_while_recording = len(lengths)
+        return cut_while_recording, await transcriber.finish()
+
+    cut_while_recording, text = asyncio.run(run())
+    assert cut_while_recording == 1
+    assert text == "segment1 segment2"
+    assert partials == ["segment1", "segment1 segment2"]
+    # Leading silence is dropped and each segment keeps only a little padding
+    assert 2.5 <= lengths[0] < 3.2
+    assert 1 <= lengths[1] < 1.6
+
+
+def test_long_speech_is_cut_without_a_pause():
+    lengths = []
+
+    async def transcribe(wav):
+        lengths.append(wav_seconds(wav))
+        return "words"
+
+    async def run():
+        transcriber = StreamTranscriber(transcribe, max_segment_seconds=3)
+        await transcriber.feed(pcm(tone(7)))
+        return await transcriber.finish()
+
+    assert asyncio.run(run()) == "words words words"
+    assert all(seconds <= 3 for seconds in lengths)
+    assert sum(lengths) == pytest.approx(7, abs=0.1)
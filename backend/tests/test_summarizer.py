@@ -0,0 +1,46 @@
+import asyncio
+
+from session_store import History
+from summarizer import SessionSummarizer, summary_prompt
+
+
+def test_prompt_names_every_participant():
+    assert "Partner 1 or Partner 2," in summary_prompt((1, 2))
+    assert "Partner 1, Partner 2 or Partner 3," in summary_prompt((1, 2, 3))
+
+
+def test_fold_summarizes_turns_that_left_the_window():
+    prompts = []
+
+    async def complete(model, messages, max_tokens):
+        prompts.append(messages)
+        return " notes "
+
+    history = History(window=2, archive_limit=10)
+    for i in range(6):
+        history.append("user", f"turn {i}")
+    asyncio.run(SessionSummarizer(complete, batch=4).fold(history, (1, 2, 3)))
+    assert history.summary == "notes"
+    assert history.summarized == 4
+    assert "Partner 3" in prompts[0][0]["content"]
+    assert "turn 3" in prompts[0][1]["content"] and "turn 4" not in prompts[0][1]["content"]
+
+
+def test_new_notes_are_appended_until_the_summary_is_condensed():
+    prompts = []
+
+    async def complete(model, messages, max_tokens):
+        prompts.append(messages[0]["content"])
+        return f"notes {len(prompts)}"
+
+    history = History(window=1, archive_limit=50)
+    summarizer = SessionSummarizer(complete, batch=1, compact_tokens=3)
+    summaries = []
+    for i in range(4):
+        history.append("user", f"turn {i}")
+        asyncio.run(summarizer.fold(history))
+        summaries.append(history.summary)
+    assert summaries == ["", "notes 1", "notes 1\nnotes 2", "notes 3"]
+    assert "added after the existing notes" in prompts[1]
+    # Past compact_tokens the notes are rewritten as one
+    assert "Rewrite" in prompts[2]
@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+from tts_cache import TTSCache, cache_key
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_disk_tier_is_off_by_default():
+    cache = TTSCache()
+    assert not cache.directory
+    run(cache.put("hello", "alloy", "tts-1", b"audio"))
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_key_ignores_whitespace_but_not_voice():
+    assert cache_key("hello  there", "alloy", "tts-1") == cache_key(" hello there ", "alloy", "tts-1")
+    assert cache_key("hello", "alloy", "tts-1") != cache_key("hello", "nova", "tts-1")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = TTSCache(directory="", memory_bytes=10)
+    run(cache.put("a", "v", "m", b"12345"))
+    run(cache.put("b", "v", "m", b"12345"))
+    assert run(cache.get("a", "v", "m")) == b"12345"
+    run(cache.put("c", "v", "m", b"12345"))
+    assert run(cache.get("b", "v", "m")) is None
+    assert run(cache.get("a", "v", "m")) == b"12345"
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["memory_bytes"]) == (2, 1, 10)
+
+
+def test_disk_tier_serves_misses_and_evicts_by_size(tmp_path):
+    cache = TTSCache(directory=str(tmp_path), memory_bytes=0, disk_bytes=10)
+    run(cache.put("a", "v", "m", b"12345"))
+    run(cache.put("b", "v", "m", b"12345"))
+    assert run(cache.get("a", "v", "m")) == b"12345"
+    run(cache.put("c", "v", "m", b"12345"))
+    assert not os.path.exists(cache._path(cache_key("b", "v", "m")))
+    assert run(cache.get("b", "v", "m")) is None
+    assert cache.stats()["disk_hits"] == 1
+    # A restarted worker finds what is left on disk
+    reopened = TTSCache(directory=str(tmp_path), memory_bytes=0, disk_bytes=10)
+    assert reopened.stats()["disk_entries"] == 2
+    assert run(reopened.get("c", "v", "m")) == b"12345"
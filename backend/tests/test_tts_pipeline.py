@@ -0,0 +1,43 @@
+import asyncio
+
+from tts_pipeline import SentenceSplitter, speak_stream
+
+
+def test_splitter_yields_complete_sentences_and_merges_short_ones():
+    splitter = SentenceSplitter(min_length=12)
+    assert splitter.feed("Okay. I hear that you ") == []
+    assert splitter.feed("felt alone. What ") == ["Okay. I hear that you felt alone."]
+    assert splitter.feed("happened next?") == []
+    assert splitter.flush() == "What happened next?"
+
+
+def test_audio_is_emitted_in_sentence_order():
+    async def deltas():
+        for delta in ["The first sentence is long. ", "Short one here. ", "And the end."]:
+            yield delta
+
+    async def synthesize(sentence):
+        # Earlier sentences take longer, so their audio finishes last
+        await asyncio.sleep(0.03 if sentence.startswith("The") else 0)
+        return sentence.upper().encode()
+
+    async def run():
+        return [event async for event in speak_stream(deltas(), synthesize)]
+
+    events = asyncio.run(run())
+    audio = [event for event in events if event[0] == "audio"]
+    assert [event[1:3] for event in audio] == [
+        (0, "The first sentence is long."), (1, "Short one here."), (2, "And the end.")]
+    assert audio[0][3] == b"THE FIRST SENTENCE IS LONG."
+    assert events[-1] == ("done", "The first sentence is long. Short one here. And the end.")
+
+
+def test_without_synthesize_only_text_is_relayed():
+    async def deltas():
+        yield "Hello. "
+        yield "Bye."
+
+    async def run():
+        return [event async for event in speak_stream(deltas())]
+
+    assert asyncio.run(run()) == [("delta", "Hello. "), ("delta", "Bye."), ("done", "Hello. Bye.")]
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from turn_scheduler import TurnScheduler
+
+
+def test_items_arriving_together_share_one_turn():
+    calls = []
+
+    async def respond(key, items):
+        calls.append(list(items))
+        yield "a"
+        yield "b"
+
+    async def run():
+        scheduler = TurnScheduler(respond, window=0.01)
+        first = scheduler.submit("s", 1)
+        second = scheduler.submit("s", 2)
+        assert first is second
+        assert [delta async for delta in first.stream()] == ["a", "b"]
+        assert await second.result() == "ab"
+        return scheduler.stats()
+
+    assert asyncio.run(run()) == {"turns": 1, "items": 2, "coalesced": 1}
+    assert calls == [[1, 2]]
+
+
+def test_turns_for_a_session_run_one_at_a_time():
+    running = []
+    overlapped = []
+
+    async def respond(key, items):
+        overlapped.append(bool(running))
+        running.append(key)
+        await asyncio.sleep(0.02)
+        running.remove(key)
+        yield str(items[0])
+
+    async def run():
+        scheduler = TurnScheduler(respond, window=0)
+        first = scheduler.submit("s", 1)
+        await asyncio.sleep(0.005)
+        second = scheduler.submit("s", 2)
+        assert first is not second
+        return await first.result(), await second.result()
+
+    assert asyncio.run(run()) == ("1", "2")
+    assert overlapped == [False, False]
+
+
+def test_errors_reach_every_caller():
+    async def respond(key, items):
+        raise RuntimeError("boom")
+        yield
+
+    async def run():
+        reply = TurnScheduler(respond, window=0).submit("s", 1)
+        with pytest.raises(RuntimeError):
+            await reply.result()
+        with pytest.raises(RuntimeError):
+            async for _ in reply.stream():
+                pass
+
+    asyncio.run(run())
+
+
+def test_approvals_during_a_running_turn_share_the_next_one():
+    batches = []
+
+    async def respond(key, items):
+        batches.append(list(items))
+        await asyncio.sleep(0.02)
+        yield "x"
+
+    async def run():
+        scheduler = TurnScheduler(respond, window=0)
+        first = scheduler.submit("s", 1)
+        await asyncio.sleep(0.005)
+        second = scheduler.submit("s", 2)
+        third = scheduler.submit("s", 3)
+        assert second is third
+        await first.result()
+        await third.result()
+
+    asyncio.run(run())
+    assert batches == [[1], [2, 3]]
@@ -0,0 +1,147 @@
+"""Two-tier cache of synthesized speech keyed by text, voice and model."""
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Directory for the on-disk tier, off unless set: the files are session speech, stored
+# unencrypted until size-based eviction removes them
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_MB", "32")) * 1024 * 1024
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024
+
+
+def cache_key(text, voice, model):
+    """Hash the normalized text together with the voice and model that speak it."""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{model}\0{voice}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """In-memory LRU of recent audio in front of a size-bounded directory of audio files."""
+
+    def __init__(self, directory=TTS_CACHE_DIR, memory_bytes=TTS_CACHE_MEMORY_BYTES,
+                 disk_bytes=TTS_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # Disk entries in least-recently-used order, key -> file size
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # TTS is billed per character, so count what hits saved
+        self.characters_saved = 0
+        if self.directory:
+            self._load_disk_index()
+
+    async def get(self, text, voice, model):
+        """Return cached audio for the text, or None on a miss."""
+        key = cache_key(text, voice, model)
+        audio_data = self._memory.get(key)
+        if audio_data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+        elif self.directory and key in self._disk:
+            audio_data = await asyncio.to_thread(self._read_disk, key)
+            if audio_data is not None:
+                self.disk_hits += 1
+                self._remember(key, audio_data)
+        if audio_data is None:
+            self.misses += 1
+        else:
+            self.characters_saved += len(text)
+        return audio_data
+
+    async def put(self, text, voice, model, audio_data):
+        """Store freshly synthesized audio in both tiers."""
+        key = cache_key(text, voice, model)
+        self._remember(key, audio_data)
+        if self.directory:
+            await asyncio.to_thread(self._write_disk, key, audio_data)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "characters_saved": self.characters_saved,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+        }
+
+    def _remember(self, key, audio_data):
+        if len(audio_data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio_data
+        self._memory_size += len(audio_data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _load_disk_index(self):
+        # Rebuild the LRU order from file modification times
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".mp3"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        with self._disk_lock:
+            self._evict_disk()
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio_data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._disk_lock:
+                self._disk_size -= self._disk.pop(key, 0)
+            return None
+        with self._disk_lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return audio_data
+
+    def _write_disk(self, key, audio_data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp name first so readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio_data)
+        os.replace(tmp_path, path)
+        with self._disk_lock:
+            self._disk_size -= self._disk.pop(key, 0)
+            self._disk[key] = len(audio_data)
+            self._disk_size += len(audio_data)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
@@ -0,0 +1,109 @@
+"""Sentence-level text-to-speech pipeline for streamed LLM replies."""
+import asyncio
+import os
+import re
+
+# Sentence synthesis calls allowed in flight for one reply
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))
+
+# End of a sentence: terminal punctuation plus closing quotes/brackets, then whitespace
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+|\n+")
+
+
+class SentenceSplitter:
+    """Incrementally split streamed text into complete sentences."""
+
+    def __init__(self, min_length=12):
+        # Very short sentences ("Okay.") are merged into the next one to save TTS calls
+        self.min_length = min_length
+        self.buffer = ""
+
+    def feed(self, text):
+        """Add streamed text and return any sentences it completed."""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if len(sentence) >= self.min_length:
+                sentences.append(sentence)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended."""
+        sentence, self.buffer = self.buffer.strip(), ""
+        return sentence
+
+
+async def speak_stream(deltas, synthesize=None, max_concurrency=TTS_CONCURRENCY):
+    """Relay streamed text while synthesizing it sentence by sentence.
+
+    Yields ("delta", text) as tokens arrive, ("audio", index, sentence, audio)
+    for each sentence in order as soon as its audio is ready, and finally
+    ("done", full_text). Without a synthesize coroutine only text is relayed.
+    """
+    events = asyncio.Queue()
+    pending = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tts_tasks = []
+
+    async def synthesize_sentence(sentence):
+        async with semaphore:
+            return await synthesize(sentence)
+
+    def start_sentence(sentence):
+        task = asyncio.create_task(synthesize_sentence(sentence))
+        tts_tasks.append(task)
+        pending.put_nowait((sentence, task))
+
+    async def read_text():
+        splitter = SentenceSplitter()
+        parts = []
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                await events.put(("delta", delta))
+                if synthesize is not None:
+                    for sentence in splitter.feed(delta):
+                        start_sentence(sentence)
+            tail = splitter.flush()
+            if synthesize is not None and tail:
+                start_sentence(tail)
+            return "".join(parts)
+        finally:
+            pending.put_nowait(None)
+
+    async def emit_audio():
+        # Audio is released strictly in sentence order even if later sentences finish first
+        index = 0
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            sentence, task = item
+            await events.put(("audio", index, sentence, await task))
+            index += 1
+
+    async def run():
+        try:
+            await asyncio.gather(text_task, audio_task)
+        finally:
+            events.put_nowait(None)
+
+    text_task = asyncio.create_task(read_text())
+    audio_task = asyncio.create_task(emit_audio())
+    runner = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # Re-raise an LLM or TTS failure to the caller
+        await runner
+        yield ("done", text_task.result())
+    finally:
+        for task in [text_task, audio_task, runner] + tts_tasks:
+            task.cancel()
@@ -0,0 +1,118 @@
+"""Per-session serialization and coalescing of therapist turns."""
+import asyncio
+import os
+
+# Extra time a turn waits for more approvals before it starts; approvals arriving while
+# the session's previous turn runs always share the next one, so 0 adds no latency
+COALESCE_WINDOW = float(os.getenv("THERAPIST_COALESCE_MS", "0")) / 1000
+
+
+class SharedReply:
+    """One generated reply, streamed to every caller whose approval it answers."""
+
+    def __init__(self):
+        self.items = []
+        self.deltas = []
+        self.text = None
+        self.error = None
+        self.done = asyncio.Event()
+        self._wake = asyncio.Event()
+
+    def push(self, delta):
+        self.deltas.append(delta)
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        if error is None:
+            self.text = "".join(self.deltas)
+        self.done.set()
+        self._wake.set()
+
+    async def stream(self):
+        """Yield the reply's deltas from the start, as they are generated."""
+        sent = 0
+        while True:
+            wake = self._wake
+            while sent < len(self.deltas):
+                yield self.deltas[sent]
+                sent += 1
+            if self.done.is_set():
+                if self.error is not None:
+                    raise self.error
+                return
+            await wake.wait()
+
+    async def result(self):
+        """Wait for the complete reply text."""
+        await self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+class TurnScheduler:
+    """Runs at most one turn per session at a time, batching what arrives meanwhile.
+
+    respond(key, items) is an async generator producing the reply deltas for
+    a batch of items. A batch stays open for as long as the session's
+    previous turn is still running, plus the coalescing window if one is
+    set, so approvals from both partners that arrive together are answered
+    by a single call without delaying a lone approval.
+    """
+
+    def __init__(self, respond, window=COALESCE_WINDOW):
+        self.respond = respond
+        self.window = window
+        # key -> reply still accepting items
+        self._open = {}
+        # key -> most recently scheduled reply, which later turns wait for
+        self._tails = {}
+        self._tasks = set()
+        self.turns = 0
+        self.items = 0
+        # Items answered by a turn started for another item
+        self.coalesced = 0
+
+    def submit(self, key, item):
+        """Add an item to the session's next turn and return that turn's SharedReply."""
+        reply = self._open.get(key)
+        if reply is None:
+            reply = self._open[key] = SharedReply()
+            previous = self._tails.get(key)
+            self._tails[key] = reply
+            # Keep a reference so the task is not garbage collected while it runs
+            task = asyncio.create_task(self._run(key, reply, previous))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        reply.items.append(item)
+        self.items += 1
+        return reply
+
+    async def _run(self, key, reply, previous):
+        try:
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            if previous is not None:
+                await previous.done.wait()
+            # Anything arriving from here on waits for the next turn
+            del self._open[key]
+            self.turns += 1
+            self.coalesced += len(reply.items) - 1
+            async for delta in self.respond(key, reply.items):
+                reply.push(delta)
+            reply.finish()
+        except Exception as e:
+            reply.finish(e)
+        finally:
+            if not reply.done.is_set():
+                # Cancelled, e.g. on shutdown; do not leave callers waiting
+                reply.finish(RuntimeError("Therapist turn was cancelled"))
+            if self._open.get(key) is reply:
+                del self._open[key]
+            if self._tails.get(key) is reply:
+                del self._tails[key]
+
+    def stats(self):
+        return {"turns": self.turns, "items": self.items, "coalesced": self.coalesced}
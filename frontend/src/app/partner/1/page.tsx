@@ -7,7 +7,7 @@ import { FaMicrophone, FaStop, FaPaperPlane, FaCheck, FaArrowLeft } from 'react-
 
 // Define types
 interface Message {
-  role: 'user' | 'assistant' | 'therapist';
+  role: 'user' | 'assistant' | 'therapist' | 'shared';
   content: string;
   approved?: boolean;
 }
@@ -22,12 +22,41 @@ export default function Partner1Page() {
   const audioChunksRef = useRef<Blob[]>([]);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const audioRef = useRef<HTMLAudioElement>(null);
+  const lastDraftRef = useRef('');
 
   // Scroll to bottom of messages
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages]);
 
+  // Approved messages from both partners and therapist replies are pushed by the server
+  useEffect(() => {
+    const events = new EventSource('http://localhost:8000/session/default/events');
+    events.onmessage = (event) => {
+      const turn = JSON.parse(event.data);
+      setMessages(prev => [...prev, { role: turn.role === 'assistant' ? 'therapist' : 'shared', content: turn.content }]);
+    };
+    // The server lost our place in the session, so it is sending everything again
+    events.addEventListener('reset', () => {
+      setMessages(prev => prev.filter(message => message.role !== 'therapist' && message.role !== 'shared'));
+    });
+    return () => events.close();
+  }, []);
+
+  // Let the server start rewriting what we are typing once we pause
+  useEffect(() => {
+    // Nothing to rewrite, or the server is already drafting this text
+    if (isLoading || isRecording || !inputText.trim() || inputText === lastDraftRef.current) return;
+    const timer = setTimeout(() => {
+      lastDraftRef.current = inputText;
+      axios.post('http://localhost:8000/partner/1/draft', {
+        text: inputText,
+        partner_id: 1
+      }).catch(() => {});
+    }, 600);
+    return () => clearTimeout(timer);
+  }, [inputText, isLoading, isRecording]);
+
   // Start recording audio
   const startRecording = async () => {
     try {
@@ -109,6 +138,8 @@ export default function Partner1Page() {
     
     const userMessage = inputText;
     setInputText('');
+    // Sending uses up the draft, so the same text typed again is drafted again
+    lastDraftRef.current = '';
     setIsLoading(true);
     
     // Add user message
@@ -152,13 +183,10 @@ export default function Partner1Page() {
         partner_id: 1
       });
       
-      // Mark message as approved
-      const updatedMessages = [...messages];
-      updatedMessages[index] = { ...message, approved: true };
-      setMessages(updatedMessages);
+      // Mark message as approved (events may have been added meanwhile)
+      setMessages(prev => prev.map((m, i) => (i === index ? { ...m, approved: true } : m)));
       
-      // Add therapist response
-      setMessages(prev => [...prev, { role: 'therapist', content: response.data.text }]);
+      // The therapist response arrives through the session event stream
       
       // Play audio response
       if (response.data.audio_base64) {
@@ -203,11 +231,13 @@ export default function Partner1Page() {
                   ? 'bg-blue-100 ml-auto' 
                   : message.role === 'assistant'
                     ? 'bg-white border border-gray-200'
-                    : 'bg-purple-100'
+                    : message.role === 'shared'
+                      ? 'bg-green-50 border border-green-200'
+                      : 'bg-purple-100'
               }`}
             >
               <div className="font-semibold text-xs text-gray-500 mb-1">
-                {message.role === 'user' ? 'You' : message.role === 'assistant' ? 'Your Representor' : 'Therapist'}
+                {message.role === 'user' ? 'You' : message.role === 'assistant' ? 'Your Representor' : message.role === 'shared' ? 'Shared with Therapist' : 'Therapist'}
               </div>
               <p>{message.content}</p>
               